@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Load test of the web app with stub models; no model files, GPU or network needed.
+
+Drives the real Flask routes and Socket.IO handlers in-process (through their test clients) with concurrent
+clients, and reports throughput, latency percentiles and memory of each scenario:
+    translate     POST /translate
+    translate_qe  POST /translate with QE metrics
+    live          Socket.IO live_edit events of users typing text character by character
+Model latency is simulated by benchmarks/stub_models.py; see its options below.
+
+Usage:
+    python benchmarks/bench_app.py --concurrency 1 8 32 --requests 200 -o results.json
+    python benchmarks/bench_app.py --scenarios live --sessions 16 --baseline results.json
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from stub_models import install_stubs  # noqa: E402
+
+MODEL_NAME = 'bench'
+DEF_METRIC = 'wmt22-cometkiwi-da'
+SCENARIOS = ['translate', 'translate_qe', 'live']
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentile by nearest rank"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+def rss_mb() -> Tuple[float, float]:
+    """Current and peak resident memory of this process, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    current = peak
+    status = Path('/proc/self/status')
+    if status.exists():
+        match = re.search(r'VmRSS:\s+(\d+) kB', status.read_text())
+        if match:
+            current = int(match.group(1)) / 1024
+    return round(current, 1), round(peak, 1)
+
+
+class Corpus:
+    """Deterministic synthetic sentences"""
+
+    def __init__(self, seed=0, vocab_size=5000, min_words=4, max_words=40, repeat_ratio=0.0) -> None:
+        """
+        :param repeat_ratio: fraction of sentences drawn from a small pool of frequent ones; exercises caches
+        """
+        self.seed = seed
+        self.vocab = [f'w{i}' for i in range(vocab_size)]
+        self.min_words = min_words
+        self.max_words = max_words
+        self.repeat_ratio = repeat_ratio
+        self.pool = [self.sentence(random.Random(f'{seed}-pool-{i}')) for i in range(100)]
+
+    def sentence(self, rng: random.Random) -> str:
+        n = rng.randint(self.min_words, self.max_words)
+        return ' '.join(rng.choice(self.vocab) for _ in range(n)).capitalize() + '.'
+
+    def batch(self, key: str, size: int) -> List[str]:
+        rng = random.Random(f'{self.seed}-{key}')
+        return [
+            rng.choice(self.pool) if rng.random() < self.repeat_ratio else self.sentence(rng)
+            for _ in range(size)
+        ]
+
+
+def load_app(args, work_dir: Path):
+    """Create the web app with stub models"""
+    model_path = install_stubs(
+        call_ms=args.call_ms,
+        token_ms=args.token_ms,
+        eval_call_ms=args.eval_call_ms,
+        eval_token_ms=args.eval_token_ms,
+        work_dir=str(work_dir),
+    )
+    model = dict(type='base', model=str(model_path), **json.loads(args.model_options))
+    config = work_dir / 'config.yml'
+    config.write_text(json.dumps(dict(translators={MODEL_NAME: model})))  # JSON is valid YAML
+    from pymarian_webapp.app import create_app, parse_args
+
+    return create_app(**parse_args(['-c', str(config), '-me', args.metric, '-w', str(args.workers)]))
+
+
+def run_load(fn: Callable[[int], Tuple[int, List[float]]], n_tasks: int, concurrency: int) -> Dict:
+    """Run tasks with concurrent clients
+
+    :param fn: runs a task given its index; returns number of sentences and latencies of its requests
+    :param n_tasks: number of tasks
+    :param concurrency: number of concurrent clients
+    """
+    latencies, sentences, errors = [], 0, []
+    lock = threading.Lock()
+    counter = iter(range(n_tasks))
+
+    def client():
+        nonlocal sentences
+        while True:
+            with lock:
+                idx = next(counter, None)
+            if idx is None:
+                return
+            try:
+                n_sents, task_latencies = fn(idx)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                sentences += n_sents
+                latencies.extend(task_latencies)
+
+    st = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    elapsed = time.perf_counter() - st
+    return dict(
+        seconds=round(elapsed, 3),
+        requests=len(latencies),
+        sentences=sentences,
+        errors=len(errors),
+        error_samples=errors[:3],
+        requests_per_sec=round(len(latencies) / elapsed, 1),
+        sentences_per_sec=round(sentences / elapsed, 1),
+        latency_ms={
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'mean': round(sum(latencies) / max(len(latencies), 1) * 1000, 2),
+            'max': round(max(latencies, default=0) * 1000, 2),
+        },
+    )
+
+
+def ratio(new: float, old: float):
+    return round(new / old, 3) if old else None
+
+
+def batch_stats(client) -> Dict[str, Tuple[float, float]]:
+    """Sum and count of batch sizes of each service, from /metrics"""
+    text = client.get('/metrics').get_data(as_text=True)
+    stats = {}
+    for line in text.splitlines():
+        match = re.match(r'pymarian_batch_size_(sum|count)\{service="(\w+)".*\} (\S+)', line)
+        if match:
+            field, service, value = match.groups()
+            total = stats.setdefault(service, [0.0, 0.0])
+            total[0 if field == 'sum' else 1] += float(value)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-s', '--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+', default=[1, 8, 32], help='clients')
+    parser.add_argument('-n', '--requests', type=int, default=200, help='HTTP requests per run')
+    parser.add_argument('-b', '--batch', type=int, default=8, help='sentences per HTTP request')
+    parser.add_argument('--sessions', type=int, default=16, help='live translation sessions (users) per run')
+    parser.add_argument('--live-chars', type=int, default=200, help='characters typed in each live session')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause between keystrokes')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0, help='fraction of repeated sentences')
+    parser.add_argument('--min-words', type=int, default=4)
+    parser.add_argument('--max-words', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--call-ms', type=float, default=2.0, help='stub translator latency per call')
+    parser.add_argument('--token-ms', type=float, default=0.05, help='stub translator latency per token')
+    parser.add_argument('--eval-call-ms', type=float, default=4.0, help='stub evaluator latency per call')
+    parser.add_argument('--eval-token-ms', type=float, default=0.1, help='stub evaluator latency per token')
+    parser.add_argument('--metric', default=DEF_METRIC, help='QE metric name used by translate_qe')
+    parser.add_argument('--model-options', default='{}', help='JSON of translator config options')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='worker processes of the web app')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='pymarian-bench-'))
+    app = load_app(args, work_dir)
+    corpus = Corpus(
+        seed=args.seed, min_words=args.min_words, max_words=args.max_words, repeat_ratio=args.repeat_ratio
+    )
+    local = threading.local()
+
+    def http_client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        return local.client
+
+    def translate_task(run_id: str, metrics: List[str]):
+        def task(idx):
+            sources = corpus.batch(f'{run_id}-{idx}', args.batch)
+            body = dict(source=sources, model_name=MODEL_NAME)
+            if metrics:
+                body['metrics'] = metrics
+            st = time.perf_counter()
+            resp = http_client().post('/translate', json=body)
+            elapsed = time.perf_counter() - st
+            assert resp.status_code == 200, f'HTTP {resp.status_code}: {resp.get_data(as_text=True)[:200]}'
+            return len(sources), [elapsed]
+
+        return task
+
+    def live_task(run_id: str):
+        def task(idx):
+            text = ' '.join(corpus.batch(f'{run_id}-{idx}', 20))[: args.live_chars]
+            socket_client = app.extensions['socketio'].test_client(app, flask_test_client=http_client())
+            latencies, version = [], None
+            try:
+                for pos in range(1, len(text) + 1):
+                    if version is None:
+                        data = dict(model_name=MODEL_NAME, source=text[:pos])
+                    else:
+                        edit = dict(offset=pos - 1, delete=0, insert=text[pos - 1])
+                        data = dict(model_name=MODEL_NAME, version=version, edits=[edit])
+                    st = time.perf_counter()
+                    res = socket_client.emit('live_edit', data, callback=True)
+                    latencies.append(time.perf_counter() - st)
+                    assert res and res.get('status') == 200, f'live_edit failed: {res}'
+                    version = res['version']
+                    if args.think_ms:
+                        time.sleep(args.think_ms / 1000)
+            finally:
+                socket_client.disconnect()
+            return text.count('.') + (not text.endswith('.')), latencies
+
+        return task
+
+    results = []
+    for scenario in args.scenarios:
+        for concurrency in args.concurrency:
+            run_id = f'{scenario}-{concurrency}'
+            if scenario == 'live':
+                task, n_tasks = live_task(run_id), args.sessions
+            else:
+                task = translate_task(run_id, [args.metric] if scenario == 'translate_qe' else [])
+                n_tasks = args.requests
+            task('warmup')  # models are loaded on first use; not measured
+            before = batch_stats(http_client())
+            result = dict(scenario=scenario, concurrency=concurrency, **run_load(task, n_tasks, concurrency))
+            after = batch_stats(http_client())
+            result['mean_batch_size'] = {}
+            for service, (total, count) in after.items():
+                prev_total, prev_count = before.get(service, (0, 0))
+                if count > prev_count:
+                    result['mean_batch_size'][service] = round((total - prev_total) / (count - prev_count), 2)
+            result['rss_mb'], result['peak_rss_mb'] = rss_mb()
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        baseline = {(r['scenario'], r['concurrency']): r for r in baseline}
+        for result in results:
+            base = baseline.get((result['scenario'], result['concurrency']))
+            if not base:
+                continue
+            comparison = dict(
+                scenario=result['scenario'],
+                concurrency=result['concurrency'],
+                sentences_per_sec=ratio(result['sentences_per_sec'], base['sentences_per_sec']),
+                p50=ratio(result['latency_ms']['p50'], base['latency_ms']['p50']),
+                p95=ratio(result['latency_ms']['p95'], base['latency_ms']['p95']),
+                p99=ratio(result['latency_ms']['p99'], base['latency_ms']['p99']),
+            )
+            print('vs baseline:', json.dumps(comparison))
+
+    if args.output:
+        meta = dict(
+            time=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            args=vars(args),
+        )
+        Path(args.output).write_text(json.dumps(dict(meta=meta, results=results), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark MTAPIClient chunking and concurrency against the local MTAPI stand-in server; no network access needed.
+
+Usage:
+    python benchmarks/bench_mtapi.py --sentences 5000 --latency 0.05 --parallel 1 4 8
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from mtapi_stub import serve  # noqa: E402
+
+from pymarian_webapp.mtapi_client import MTAPIClient  # noqa: E402
+
+
+def make_sentences(n: int, words: int):
+    return [' '.join(f'word{(i + j) % 97}' for j in range(words)) + '.' for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--sentences', type=int, default=5000)
+    parser.add_argument('-w', '--words', type=int, default=20, help='words per sentence')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub server latency per request (seconds)')
+    parser.add_argument('--per-char-latency', type=float, default=1e-6, help='stub latency per character')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests failing with 429')
+    parser.add_argument('--max-elements', type=int, default=100, help='texts per request')
+    parser.add_argument('-p', '--parallel', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    sources = make_sentences(args.sentences, args.words)
+    results = []
+    for parallel in args.parallel:
+        with serve(
+            latency=args.latency,
+            per_char_latency=args.per_char_latency,
+            fail_rate=args.fail_rate,
+            throttle_rate=args.throttle_rate,
+        ) as endpoint:
+            client = MTAPIClient(
+                endpoint=endpoint, subscription_key='dummy', max_parallel=parallel, max_elements=args.max_elements
+            )
+            st = time.time()
+            outputs = client.translate(sources)
+            elapsed = time.time() - st
+            assert [out[0] for out in outputs] == [src.upper() for src in sources], "Outputs out of order"
+            result = dict(
+                parallel=parallel,
+                sentences=len(sources),
+                seconds=round(elapsed, 3),
+                sentences_per_sec=round(len(sources) / elapsed, 1),
+                **endpoint.state.stats(),
+            )
+            print(json.dumps(result))
+            results.append(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MTAPI translate endpoint, for offline benchmarks and tests of MTAPIClient.
+
+It enforces the per-request limits of the real service, simulates latency, and can inject throttling (HTTP 429)
+and server errors. Translations are the uppercased source texts.
+
+Usage:
+    python benchmarks/mtapi_stub.py --port 8765 --latency 0.05 --fail-rate 0.1
+    MTAPI_ENDPOINT=http://localhost:8765/translate pymarian-webapp -c config.yml
+
+Or, from Python:
+    with serve(latency=0.05) as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy')
+"""
+import argparse
+import contextlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_ELEMENTS = 1000
+MAX_CHARS = 50_000
+
+
+class StubState:
+    def __init__(self, latency=0.0, per_char_latency=0.0, fail_rate=0.0, throttle_rate=0.0, seed=0):
+        """
+        :param latency: seconds per request
+        :param per_char_latency: additional seconds per character of request
+        :param fail_rate: fraction of requests that fail with HTTP 503
+        :param throttle_rate: fraction of requests that fail with HTTP 429 and a Retry-After header
+        :param seed: seed for failure injection
+        """
+        self.latency = latency
+        self.per_char_latency = per_char_latency
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.connections = set()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                requests=self.requests,
+                failures=self.failures,
+                max_concurrent=self.max_concurrent,
+                connections=len(self.connections),
+            )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so that connection reuse is observable
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        state = self.state
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'[]')
+        with state.lock:
+            state.requests += 1
+            state.connections.add(self.client_address)
+            state.concurrent += 1
+            state.max_concurrent = max(state.max_concurrent, state.concurrent)
+            roll = state.random.random()
+        try:
+            n_chars = sum(len(item.get('text', '')) for item in body)
+            time.sleep(state.latency + state.per_char_latency * n_chars)
+            if roll < state.throttle_rate:
+                with state.lock:
+                    state.failures += 1
+                error = dict(error=dict(code=429001, message='Too many requests'))
+                return self._reply(429, error, {'Retry-After': '0'})
+            if roll < state.throttle_rate + state.fail_rate:
+                with state.lock:
+                    state.failures += 1
+                return self._reply(503, dict(error=dict(code=503000, message='Service unavailable')))
+            if len(body) > MAX_ELEMENTS or n_chars > MAX_CHARS:
+                return self._reply(400, dict(error=dict(code=400077, message='Request too large')))
+            to = self.path.split('to=')[-1].split('&')[0] if 'to=' in self.path else 'xx'
+            result = [dict(translations=[dict(text=item['text'].upper(), to=to)]) for item in body]
+            return self._reply(200, result)
+        finally:
+            with state.lock:
+                state.concurrent -= 1
+
+
+@contextlib.contextmanager
+def serve(host='127.0.0.1', port=0, **kwargs):
+    """Run the stub server in a background thread
+
+    :param host: host to bind
+    :param port: port to bind; 0 picks a free port
+    :param kwargs: args to StubState
+    :return: context manager yielding the translate endpoint URL; the server's StubState is at `.state` of the URL
+    """
+    state = StubState(**kwargs)
+    handler = type('Handler', (StubHandler,), dict(state=state))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    endpoint = Endpoint(f'http://{host}:{server.server_address[1]}/translate')
+    endpoint.state = state
+    try:
+        yield endpoint
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Endpoint(str):
+    """URL of the stub server; also carries its state"""
+
+    state: StubState = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-ho', '--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--per-char-latency', type=float, default=0.0, help='seconds per character')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests failing with 429')
+    args = vars(parser.parse_args())
+    host, port = args.pop('host'), args.pop('port')
+    with serve(host=host, port=port, **args) as endpoint:
+        print(f'Serving MTAPI stand-in at {endpoint}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
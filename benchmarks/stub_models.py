@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-ins for pymarian.Translator and pymarian.Evaluator, for offline benchmarks.
+
+They need no model files, GPU or network. Outputs are a pure function of inputs, and latency follows
+a simple model of a Marian decoder: a fixed cost per call plus a cost per token of the padded batch
+(batch size x longest sentence). Calls to one instance are serialized, as they are on one Marian model.
+
+Usage:
+    from stub_models import install_stubs
+    install_stubs(call_ms=2, token_ms=0.05)  # before the web app creates its services
+"""
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import List
+
+
+def _padded_tokens(rows: List[str]) -> int:
+    lens = [len(row.split()) + 1 for row in rows]
+    return len(lens) * max(lens) if lens else 0
+
+
+class StubTranslator:
+    """Mimics pymarian.Translator: translation is the uppercased source; honors force decoding of prefixes"""
+
+    # latency model; set by install_stubs
+    call_ms = 2.0
+    token_ms = 0.05
+
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+
+    def translate(self, sources: List[str], **kwargs) -> List[str]:
+        with self.lock:
+            time.sleep((self.call_ms + self.token_ms * _padded_tokens(sources)) / 1000)
+            self.calls += 1
+            self.rows += len(sources)
+        outputs = []
+        for row in sources:
+            if kwargs.get('force_decode'):
+                source, _, prefix = row.partition('\t')
+                hyp = source.upper().split()
+                prefix_toks = prefix.split()
+                outputs.append(' '.join(prefix_toks + hyp[len(prefix_toks) :]))
+            else:
+                outputs.append(row.upper())
+        return outputs
+
+
+class StubEvaluator:
+    """Mimics pymarian.Evaluator of a QE metric: rows are 'source<tab>mt'; scores are hashes in [0, 1)"""
+
+    call_ms = 4.0
+    token_ms = 0.1
+
+    def __init__(self, **kwargs) -> None:
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+
+    @classmethod
+    def new(cls, **kwargs) -> 'StubEvaluator':
+        return cls(**kwargs)
+
+    def evaluate(self, rows: List[str]) -> List[float]:
+        with self.lock:
+            time.sleep((self.call_ms + self.token_ms * _padded_tokens(rows)) / 1000)
+            self.calls += 1
+            self.rows += len(rows)
+        return [zlib.crc32(row.encode('utf-8')) % 10_000 / 10_000 for row in rows]
+
+
+def make_model_files(work_dir: Path) -> Path:
+    """Empty model and vocab files, so that configs of type 'base' pass path checks
+    :return: path to model file; vocab.spm is next to it
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    model_path = work_dir / 'model.npz'
+    model_path.touch()
+    (work_dir / 'vocab.spm').touch()
+    return model_path
+
+
+def install_stubs(
+    call_ms=2.0, token_ms=0.05, eval_call_ms=4.0, eval_token_ms=0.1, work_dir='/tmp/pymarian-stubs'
+):
+    """Replace pymarian models with stubs. Call before models are loaded.
+
+    :param call_ms: translator latency per call, in milliseconds
+    :param token_ms: translator latency per token of padded batch, in milliseconds
+    :param eval_call_ms: evaluator latency per call, in milliseconds
+    :param eval_token_ms: evaluator latency per token of padded batch, in milliseconds
+    :param work_dir: directory for placeholder model files
+    """
+    import pymarian
+    import pymarian.utils
+
+    StubTranslator.call_ms, StubTranslator.token_ms = call_ms, token_ms
+    StubEvaluator.call_ms, StubEvaluator.token_ms = eval_call_ms, eval_token_ms
+    model_path = make_model_files(Path(work_dir))
+    # the web app's services import these when they load models
+    pymarian.Translator = StubTranslator
+    pymarian.Evaluator = StubEvaluator
+    pymarian.utils.get_model_path = lambda name: model_path
+    pymarian.utils.get_vocab_path = lambda name: model_path.parent / 'vocab.spm'
+    return model_path
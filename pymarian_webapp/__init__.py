@@ -1,5 +1,13 @@
 __version__ = '0.1'
 
 import logging as log
+import os
 
 log.basicConfig(level=log.INFO)
+
+# sources, translations and scores are logged at DEBUG level of this logger; off unless asked for,
+# as formatting them is costly under load. Enable with $MARIAN_LOG_PAYLOADS or --log-payloads
+payload_log = log.getLogger('pymarian_webapp.payloads')
+payload_log.setLevel(
+    log.DEBUG if os.getenv('MARIAN_LOG_PAYLOADS', "").lower() in ("1", "yes", "y", "true", "on") else log.INFO
+)
@@ -0,0 +1,188 @@
+"""
+Admission control of translation and scoring requests.
+
+Requests are admitted only if they are within size limits, their client is within its concurrency and rate
+limits, and the work queue of their model has room. Others are rejected right away, with a hint of when to
+retry, rather than queued: under overload, latency of admitted requests stays bounded.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .constants import (
+    DEF_CLIENT_CONCURRENCY,
+    DEF_CLIENT_RATE,
+    DEF_MAX_CHARS,
+    DEF_MAX_QUEUE,
+    DEF_MAX_SENTENCES,
+    DEF_RETRY_AFTER,
+)
+from .instrumentation import ADMITTED_SENTENCES, REJECTED
+
+MAX_IDLE_CLIENTS = 10_000  # state of idle clients is pruned beyond this
+
+
+class Rejected(Exception):
+    """A request that is not admitted"""
+
+    def __init__(self, message: str, status: int = 429, retry_after: Optional[float] = None) -> None:
+        """
+        :param message: reason, for the client
+        :param status: HTTP status: 413 for requests over size limits, 429 for overload
+        :param retry_after: seconds after which the client may retry; None => not worth retrying as is
+        """
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        if self.retry_after is None:
+            return {}
+        return {'Retry-After': str(max(1, math.ceil(self.retry_after)))}
+
+    def to_dict(self) -> Dict:
+        """Response of a Socket.IO event"""
+        res = dict(status=self.status, error=str(self))
+        if self.retry_after is not None:
+            res['retry_after'] = max(1, math.ceil(self.retry_after))
+        return res
+
+
+class _Client:
+    __slots__ = ('inflight', 'tokens', 'updated')
+
+    def __init__(self, tokens: float) -> None:
+        self.inflight = 0
+        self.tokens = tokens  # of the rate limiter's bucket
+        self.updated = time.monotonic()
+
+
+class AdmissionControl:
+    """Limits on request size, per client concurrency and rate, and sentences queued for each model"""
+
+    def __init__(
+        self,
+        max_sentences: int = DEF_MAX_SENTENCES,
+        max_chars: int = DEF_MAX_CHARS,
+        client_concurrency: int = DEF_CLIENT_CONCURRENCY,
+        client_rate: float = DEF_CLIENT_RATE,
+        max_queue: int = DEF_MAX_QUEUE,
+        model_queues: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        All limits are disabled with 0.
+        :param max_sentences: sentences per request
+        :param max_chars: characters of all sentences of a request
+        :param client_concurrency: requests of a client that are processed at the same time
+        :param client_rate: requests per second of a client, with bursts of up to a second's worth
+        :param max_queue: sentences admitted for a model and not yet done
+        :param model_queues: max_queue of specific models
+        """
+        limits = [max_sentences, max_chars, client_concurrency, client_rate, max_queue]
+        assert min(limits) >= 0, f"Limits should be non-negative. Given: {limits}"
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.client_concurrency = client_concurrency
+        self.client_rate = client_rate
+        self.burst = max(1.0, client_rate)
+        self.max_queue = max_queue
+        self.model_queues = model_queues or {}
+        self.clients: Dict[str, _Client] = {}
+        self.queued: Dict[str, int] = {}  # sentences of each model
+        self.lock = threading.Lock()
+
+    def check_size(self, sources: List[str]):
+        """Rejects requests over size limits; these are not worth retrying"""
+        if self.max_sentences and len(sources) > self.max_sentences:
+            REJECTED.inc(reason='sentences')
+            raise Rejected(f"Too many sentences: {len(sources)}. Limit: {self.max_sentences}", status=413)
+        if self.max_chars:
+            chars = sum(len(src) for src in sources)
+            if chars > self.max_chars:
+                REJECTED.inc(reason='chars')
+                raise Rejected(f"Too many characters: {chars}. Limit: {self.max_chars}", status=413)
+
+    def _refill(self, client: _Client, now: float):
+        client.tokens = min(self.burst, client.tokens + (now - client.updated) * self.client_rate)
+        client.updated = now
+
+    def _prune(self, now: float):
+        """Forget clients that have nothing in flight and a full bucket. Caller must hold the lock"""
+        for client_id, client in list(self.clients.items()):
+            if client.inflight == 0:
+                self._refill(client, now)
+                if client.tokens >= self.burst:
+                    del self.clients[client_id]
+
+    def acquire(self, client_id: str, model_name: Optional[str] = None, n_sentences: int = 0):
+        """Admit a request, or raise Rejected. Admitted requests must be released when they are done
+
+        :param client_id: client, e.g. its IP address; sessions of a client share its limits
+        :param model_name: model whose queue the sentences wait in, if any
+        :param n_sentences: sentences of the request
+        """
+        now = time.monotonic()
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is None:
+                if len(self.clients) >= MAX_IDLE_CLIENTS:
+                    self._prune(now)
+                client = self.clients[client_id] = _Client(self.burst)
+            try:
+                self._check(client, model_name, n_sentences, now)
+            except Rejected:
+                if client.inflight == 0 and not self.client_rate:
+                    del self.clients[client_id]
+                raise
+            if self.client_rate:
+                client.tokens -= 1
+            client.inflight += 1
+            if model_name:
+                self.queued[model_name] = self.queued.get(model_name, 0) + n_sentences
+                ADMITTED_SENTENCES.set(self.queued[model_name], model=model_name)
+
+    def _check(self, client: _Client, model_name: Optional[str], n_sentences: int, now: float):
+        """Raises Rejected if a request of the client is over a limit. Caller must hold the lock"""
+        if self.client_rate:
+            self._refill(client, now)
+            if client.tokens < 1:
+                REJECTED.inc(reason='rate')
+                wait = (1 - client.tokens) / self.client_rate
+                raise Rejected(f"Rate limit of {self.client_rate} requests/s exceeded", retry_after=wait)
+        if self.client_concurrency and client.inflight >= self.client_concurrency:
+            REJECTED.inc(reason='concurrency')
+            raise Rejected(
+                f"Too many concurrent requests. Limit: {self.client_concurrency}", retry_after=DEF_RETRY_AFTER
+            )
+        max_queue = self.model_queues.get(model_name, self.max_queue)
+        queued = self.queued.get(model_name, 0)
+        # a request larger than the queue is admitted when the queue is empty
+        if model_name and max_queue and queued and queued + n_sentences > max_queue:
+            REJECTED.inc(reason='queue')
+            raise Rejected(
+                f"Queue of {model_name} is full: {queued} sentences. Limit: {max_queue}",
+                retry_after=DEF_RETRY_AFTER,
+            )
+
+    def release(self, client_id: str, model_name: Optional[str] = None, n_sentences: int = 0):
+        """Release a request admitted by acquire()"""
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is not None:
+                client.inflight -= 1
+                if client.inflight == 0 and not self.client_rate:
+                    del self.clients[client_id]
+            if model_name:
+                self.queued[model_name] -= n_sentences
+                ADMITTED_SENTENCES.set(self.queued[model_name], model=model_name)
+
+    @contextmanager
+    def admit(self, client_id: str, model_name: Optional[str] = None, n_sentences: int = 0):
+        """Admit a request for the duration of the block, or raise Rejected; see acquire()"""
+        self.acquire(client_id, model_name, n_sentences)
+        try:
+            yield
+        finally:
+            self.release(client_id, model_name, n_sentences)
@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 """
 Serves Marian model using Flask HTTP server
+
+Importing this module has no side effects; the app is made by create_app(). Models are loaded lazily,
+or warmed up in the background; see /readyz.
+For WSGI servers: gunicorn 'pymarian_webapp.app:create_app(["-c", "config.yml"])', which takes CLI args,
+or uwsgi --module pymarian_webapp.app:app --pyargv "-c config.yml"
 """
 import argparse
+import functools
 import getpass
+import hmac
+import importlib.metadata
 import os
 import platform
 import socket
@@ -13,69 +21,202 @@ from pathlib import Path
 from typing import List, Optional
 
 import flask
-import pymarian
 import yaml
 from flask import Blueprint, Flask, request, send_from_directory
 from flask_socketio import SocketIO, emit, send
-from pymarian.defaults import Defaults as D
 
-from . import __version__, log
-from .constants import BASE_ARGS, DEF_FLICKER_SIZE, CHOSEN_METRICS, DEF_EAGER_LOAD
+from . import __version__, log, payload_log, timing
+from .constants import (
+    BASE_ARGS,
+    CHOSEN_METRICS,
+    COMMIT_POLICIES,
+    DEF_CACHE_DB,
+    DEF_CACHE_DB_BYTES,
+    DEF_CLIENT_CONCURRENCY,
+    DEF_CLIENT_RATE,
+    DEF_COMMIT_POLICY,
+    DEF_EAGER_LOAD,
+    DEF_FLICKER_SIZE,
+    DEF_IDLE_TIMEOUT,
+    DEF_LIVE_DEBOUNCE_MS,
+    DEF_LIVE_THREADS,
+    DEF_MAX_CHARS,
+    DEF_MAX_QUEUE,
+    DEF_MAX_SENTENCES,
+    DEF_MEMORY_BUDGET,
+    DEF_PIPELINE_THREADS,
+    DEF_PROFILE_INTERVAL_MS,
+    DEF_PROFILE_SECONDS,
+    DEF_STREAM_CHUNK_SIZE,
+    DEF_WARMUP_DECODES,
+    DEF_WORKERS,
+)
+from .admission import AdmissionControl, Rejected
 from .translator_service import TranslatorService
+from .disk_cache import DiskCache
 from .evaluator_service import EvaluatorService
+from .instrumentation import CONTENT_TYPE, LIVE_SECONDS, REGISTRY, merge, render
+from .live_scheduler import LiveScheduler, Outbox, run_blocking
+from .live_session import LiveSessions
+from .pipeline import Pipeline
+from .profiling import ProfilerBusy, collapsed, sample
+from .reload import ConfigReloader
+from .segmentation import iter_paragraphs
+from .serialization import dumps_json, respond, round_floats
+from .streaming import iter_lines, translate_stream
+from .residency import ResidencyManager
+from .warmup import WarmUp
+from .worker_pool import WorkerPool
 
 DEF_MODEL_ID = 'NA'
-FLOAT_POINTS = 4
 exp = None
-app = Flask(__name__)
-app.config['JSON_AS_ASCII'] = False
-bp = Blueprint('app', __name__, template_folder='templates', static_folder='static')
-socketio = SocketIO(app)
-
-
-sys_info = {
-    'pymarian': pymarian.__version__,
-    'Python Version': sys.version,
-    'Platform': platform.platform(),
-    'Platform Version': platform.version(),
-    'Processor': platform.processor(),
-    'GPU': '[unavailable]',  # TODO: get GPU name
-    'Hostname': socket.gethostname(),
-    'Username': getpass.getuser(),
-    'Root Directory': str(Path(__file__).parent.absolute()),
-    'Base Args': BASE_ARGS,
-}
+
+
+@functools.lru_cache(maxsize=1)
+def get_sys_info():
+    try:
+        pymarian_version = importlib.metadata.version('pymarian')  # without importing pymarian
+    except importlib.metadata.PackageNotFoundError:
+        pymarian_version = '[unavailable]'
+    return {
+        'pymarian': pymarian_version,
+        'Python Version': sys.version,
+        'Platform': platform.platform(),
+        'Platform Version': platform.version(),
+        'Processor': platform.processor(),
+        'GPU': '[unavailable]',  # TODO: get GPU name
+        'Hostname': socket.gethostname(),
+        'Username': getpass.getuser(),
+        'Root Directory': str(Path(__file__).parent.absolute()),
+        'Base Args': BASE_ARGS,
+    }
+
 
 def render_template(*args, **kwargs):
     return flask.render_template(*args, environ=os.environ, **kwargs)
 
 
-def jsonify(obj):
-
-    if obj is None or isinstance(obj, (int, bool, str)):
-        return obj
-    elif isinstance(obj, float):
-        return round(obj, FLOAT_POINTS)
-    elif isinstance(obj, dict):
-        return {key: jsonify(val) for key, val in obj.items()}
-    elif isinstance(obj, list):
-        return [jsonify(it) for it in obj]
-    # elif isinstance(ob, np.ndarray):
-    #    return _jsonify(ob.tolist())
-    else:
-        log.warning(f"Type {type(obj)} maybe not be json serializable")
-        return obj
+def create_app(argv: Optional[List[str]] = None, **kwargs) -> Flask:
+    """Creates the app and its services; models are warmed up in a background thread.
 
+    :param argv: CLI args, used when kwargs are not given, e.g. by WSGI servers. Default: defaults of the CLI
+    :param kwargs: same as the parsed CLI args; see parse_args()
+    :return: Flask app; its SocketIO is at app.extensions['socketio']
+    """
+    if not kwargs:
+        kwargs = parse_args(argv or [])
+    app = Flask(__name__)
+    app.config['JSON_AS_ASCII'] = False
+    socketio = SocketIO(app)
+    bp = Blueprint('app', __name__, template_folder='templates', static_folder='static')
+    attach_routes(app, bp, socketio, **kwargs)
+    app.register_blueprint(bp, url_prefix=kwargs.get('base'))
+    if kwargs.get('debug'):
+        app.debug = True
+
+    @app.route('/favicon.ico')
+    def favicon():
+        return send_from_directory(os.path.join(bp.root_path, 'static', 'favicon'), 'favicon.ico')
+
+    # register an index page if needed; and link to home
+    if kwargs.get('base'):
+
+        @app.route('/')
+        def index():
+            return render_template('index.html', demo_url=kwargs.get('base'))
+
+    return app
+
+
+def attach_routes(app: Flask, bp: Blueprint, socketio: SocketIO, **kwargs):
+    memory_budget = kwargs.get('memory_budget', DEF_MEMORY_BUDGET)
+    eager = kwargs.get('eager', DEF_EAGER_LOAD)
+    workers = kwargs.get('workers', DEF_WORKERS)
+    mt_models = kwargs.get('mt_models') or {}
+    cache_db = kwargs.get('cache_db', DEF_CACHE_DB)
+    # translations persist across restarts, and are shared by worker processes
+    disk_cache = None
+    if cache_db:
+        disk_cache = DiskCache(cache_db, max_bytes=kwargs.get('cache_db_bytes', DEF_CACHE_DB_BYTES))
+    if workers > 0:
+        # models are loaded and served by long-lived worker processes, forked before the services below
+        # start threads
+        transl_service = WorkerPool(
+            mt_models, num_workers=workers, memory_budget=memory_budget, disk_cache=disk_cache
+        )
+    # shared by all models loaded in this process
+    idle_timeout = kwargs.get('idle_timeout', DEF_IDLE_TIMEOUT)
+    residency = ResidencyManager(budget=memory_budget, idle_timeout=idle_timeout)
+    if workers <= 0:
+        # models are loaded on first use, or by the warm-up thread
+        transl_service = TranslatorService(
+            mt_models, eager_load=False, residency=residency, disk_cache=disk_cache
+        )
+    eval_service = EvaluatorService(names=kwargs.get('metrics'), eager_load=False, residency=residency)
+    # requests over limits are rejected right away rather than queued, so that latency stays bounded
+    admission = AdmissionControl(
+        max_sentences=kwargs.get('max_sentences', DEF_MAX_SENTENCES),
+        max_chars=kwargs.get('max_chars', DEF_MAX_CHARS),
+        client_concurrency=kwargs.get('client_concurrency', DEF_CLIENT_CONCURRENCY),
+        client_rate=kwargs.get('client_rate', DEF_CLIENT_RATE),
+        max_queue=kwargs.get('max_queue', DEF_MAX_QUEUE),
+        model_queues={name: model['max_queue'] for name, model in mt_models.items() if 'max_queue' in model},
+    )
+    # translation and QE scoring of a request overlap; metrics score in parallel
+    pipeline = Pipeline(
+        transl_service, eval_service, threads=kwargs.get('pipeline_threads', DEF_PIPELINE_THREADS)
+    )
+    # decodes of HTTP requests run off the event loop, like those of live translation, so that the handlers of
+    # concurrent requests keep running meanwhile and their sentences are batched together
+    blocking = functools.partial(run_blocking, socketio.async_mode)
+    live_sessions = LiveSessions()
+    # live translation requests run off the Socket.IO event loop; superseded ones are dropped
+    live_scheduler = LiveScheduler(
+        threads=kwargs.get('live_threads', DEF_LIVE_THREADS),
+        debounce_ms=kwargs.get('live_debounce_ms', DEF_LIVE_DEBOUNCE_MS),
+    )
+    # their results are sent by the event loop rather than by the threads of the scheduler
+    outbox = Outbox(socketio)
+    # worker processes load their models anyway; warming up waits for them
+    warmup = WarmUp(
+        transl_service,
+        eval_service,
+        load_translators=eager or workers > 0,
+        load_evaluators=eager,
+        n_decodes=kwargs.get('warmup_decodes', DEF_WARMUP_DECODES),
+    ).start()
+
+    def on_reload(models, changes):
+        admission.model_queues = {
+            name: model['max_queue'] for name, model in models.items() if 'max_queue' in model
+        }
+        warmup.reloaded(changes)
+
+    # translators of the config file are reloaded on SIGHUP (see main()) or POST /admin/reload
+    reloader = ConfigReloader(
+        kwargs.get('config_path'),
+        transl_service,
+        on_reload=on_reload,
+        n_decodes=kwargs.get('warmup_decodes', DEF_WARMUP_DECODES),
+    )
+    app.extensions['pymarian'] = dict(
+        translator=transl_service, evaluator=eval_service, warmup=warmup, reloader=reloader
+    )
 
-@app.route('/favicon.ico')
-def favicon():
-    return send_from_directory(os.path.join(bp.root_path, 'static', 'favicon'), 'favicon.ico')
+    @app.errorhandler(Rejected)
+    def on_rejected(e: Rejected):
+        return str(e), e.status, e.headers()
 
+    @app.route('/healthz')
+    def healthz():
+        """Liveness: the server is up; models may still be loading"""
+        return respond(dict(status='ok', version=__version__))
 
-def attach_routes(**kwargs):
-    transl_service = TranslatorService(kwargs.get('mt_models', None), eager_load=kwargs.get('eager', DEF_EAGER_LOAD))
-    eval_service = EvaluatorService(names=kwargs.get('metrics'), eager_load=kwargs.get('eager', DEF_EAGER_LOAD))
-    sys_info['mt_models'] = transl_service.known_models
+    @app.route('/readyz')
+    def readyz():
+        """Readiness: models are warm; 503 while warming up or if a translator failed to load"""
+        status = warmup.status()
+        return respond(status, 200 if status['ready'] else 503)
 
     @bp.route('/')
     def home():
@@ -96,6 +237,33 @@ def attach_routes(**kwargs):
                 args = request.form
         return args
 
+    def timed(view):
+        """Collects phase timings of a request, and reports them in its Server-Timing header"""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with timing.collect() as timings:
+                response = flask.make_response(view(*args, **kwargs))
+            response.headers['Server-Timing'] = timings.header()
+            return response
+
+        return wrapper
+
+    def timed_event(handler):
+        """Collects phase timings of a Socket.IO event"""
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            with timing.collect():
+                return handler(*args, **kwargs)
+
+        return wrapper
+
+    def _add_timings(args, res, timings: timing.Timings):
+        """Add phase timings so far, in milliseconds, to a result if the request has 'timings' arg"""
+        if str(args.get("timings", "")).lower() in ('1', 'true', 'yes'):
+            res['timings'] = timings.durations()
+
     def _get_list(args, key):
         if hasattr(args, 'getlist'):
             values = args.getlist(key)
@@ -106,31 +274,119 @@ def attach_routes(**kwargs):
         return values
 
     @bp.route("/translate", methods=["POST", "GET"])
+    @timed
     def translate():
         if request.method not in ("POST", "GET"):
             return "GET and POST are supported", 400
 
         st = time.time()
-        args = _get_args(request)
-        sources = _get_list(args, "source")
+        with timing.phase('parse'):
+            args = _get_args(request)
+            sources = _get_list(args, "source")
 
         if not sources:
             return "Please submit 'source' parameter", 400
 
         model_name = args.get("model_name")
-        translations = transl_service.translate(model_name, sources)
-        mts = translations[0]['outputs']
+        if model_name not in transl_service.known_models:  # e.g. removed by a config reload
+            return f"Model '{model_name}' not found", 400
+        metrics = _get_list(args, "metrics") or []
+        for metric in metrics:
+            if metric not in eval_service.known_models:
+                return f"Unknown metric {metric}. Known metrics are {list(eval_service.known_models)}", 400
+        admission.check_size(sources)
+        with admission.admit(request.remote_addr, model_name, len(sources)):
+            # chunks are scored as soon as they are translated
+            translations, scores = blocking(pipeline.translate, model_name, sources, metrics)
         res = dict(sources=sources, translations=translations, time_units='s')
-        metrics = args.get("metrics", [])
         if metrics:
-            res['metrics'] = {}
-            for metric in metrics:
-                if metric not in eval_service.known_models:
-                    return f"Unknown metric {metric}. Known metrics are {eval_service.known_models}", 400
-                scores = eval_service.evaluate(metric, sources, mts)
-                res['metrics'][metric] = scores
+            res['metrics'] = scores
         res['time_taken'] = round(time.time() - st, 3)
-        return flask.jsonify(jsonify(res))
+        _add_timings(args, res, timing.current())
+        return respond(res)
+
+    @bp.route("/translate/stream", methods=["POST"])
+    def translate_document():
+        """Translate a large document; results are streamed back as NDJSON as soon as each chunk is translated.
+
+        The document is uploaded as 'file' (multipart/form-data), sent as the request body (text/plain),
+        or sent as 'source' string in JSON body. 'model_name' and optional 'chunk_size' are given as URL params.
+        Each line of the response is a JSON object: dict(line, source, translation) where line is
+        the index of the input line the sentence came from. The last line is dict(done=true, sentences, time_taken),
+        or dict(error=..) if translation failed midway.
+        """
+        st = time.time()
+        model_name = request.args.get("model_name") or request.form.get("model_name")
+        if model_name not in transl_service.known_models:
+            return f"Model '{model_name}' not found", 400
+        try:
+            chunk_size = int(request.args.get("chunk_size", DEF_STREAM_CHUNK_SIZE))
+            assert chunk_size > 0
+        except (ValueError, AssertionError):
+            return "chunk_size should be a positive integer", 400
+
+        if 'file' in request.files:
+            lines = iter_lines(request.files['file'].stream)
+        elif request.is_json:
+            source = (request.json or {}).get("source")
+            if not isinstance(source, str):
+                return "Please submit 'source' string", 400
+            lines = iter_paragraphs(source)  # lines are not copied into a list
+        else:
+            lines = iter_lines(request.stream)  # read lazily while translating
+
+        # documents are not bounded in size; a client streams a limited number of them at a time
+        client_id = request.remote_addr
+        admission.acquire(client_id)
+
+        def generate():
+            count = 0
+            try:
+                records = translate_stream(
+                    transl_service, model_name, lines, chunk_size=chunk_size, run=blocking
+                )
+                for rec in records:
+                    count += 1
+                    yield dumps_json(round_floats(rec)) + b'\n'
+            except Exception as e:
+                log.exception(f"Streaming translation failed after {count} sentences")
+                yield dumps_json(dict(error=str(e), sentences=count)) + b'\n'
+                return
+            done = dict(done=True, sentences=count, time_taken=round(time.time() - st, 3), time_units='s')
+            yield dumps_json(done) + b'\n'
+
+        response = flask.Response(flask.stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.call_on_close(lambda: admission.release(client_id))
+        return response
+
+    @bp.route("/evaluate", methods=["POST", "GET"])
+    @timed
+    def evaluate():
+        """Score (source, mt) pairs with QE metrics.
+
+        Args: 'source' and 'mt' lists of the same length, and optional 'metrics' list; default: all known metrics.
+        Response: dict(metrics={metric: [score, ...]}, time_taken)
+        """
+        st = time.time()
+        with timing.phase('parse'):
+            args = _get_args(request)
+            sources = _get_list(args, "source")
+            mts = _get_list(args, "mt")
+        if not sources or not mts:
+            return "Please submit 'source' and 'mt' parameters", 400
+        if len(sources) != len(mts):
+            return f"'source' and 'mt' should have the same length. Given {len(sources)} and {len(mts)}", 400
+        metrics = _get_list(args, "metrics") or list(eval_service.known_models.keys())
+        for metric in metrics:
+            if metric not in eval_service.known_models:
+                return f"Unknown metric {metric}. Known metrics are {list(eval_service.known_models)}", 400
+        admission.check_size(sources)
+        with admission.admit(request.remote_addr):
+            res = dict(metrics=blocking(pipeline.evaluate, metrics, sources, mts))
+        res['time_taken'] = round(time.time() - st, 3)
+        res['time_units'] = 's'
+        _add_timings(args, res, timing.current())
+        return respond(res)
 
     ####### Live MT ########
     @bp.route("/live", methods=["GET"])
@@ -146,13 +402,25 @@ def attach_routes(**kwargs):
     @socketio.on('disconnect')
     def ont_disconnect():
         log.debug('Client disconnected')
+        live_sessions.drop(request.sid)
+        live_scheduler.drop(request.sid)
 
     @socketio.on('translate')
     def on_translate(data):
+        """Live translation of the whole text.
+
+        Request: dict(model_name, source, target_segments, source_segments, flicker_size, timings, async)
+        Response: dict(status, source_segments, target_segments), and phase timings in milliseconds if
+            `timings` is true. With `async` true, requests of a client are coalesced: only the newest one that
+            is pending runs, and results of requests that are superseded while running are dropped. The
+            response is then dict(status=202, request_id) right away, and the result is emitted to the client
+            as 'translated' event, with its request_id
+        """
         st = time.time()
         model_name = data.get("model_name")
         source = data.get("source", "").strip()
         target_segments_in = data.get("target_segments", [])
+        source_segments_in = data.get("source_segments")
         flicker_size = data.get("flicker_size", DEF_FLICKER_SIZE)
         assert (
             isinstance(flicker_size, int) and flicker_size >= 0
@@ -161,32 +429,236 @@ def attach_routes(**kwargs):
             return dict(status=400, error="Please submit 'source' parameter")
         if target_segments_in and not isinstance(target_segments_in, list):
             return dict(status=400, error="target_segments should be a list or empty.")
+        if source_segments_in and not isinstance(source_segments_in, list):
+            return dict(status=400, error="source_segments should be a list or empty.")
 
+        if model_name not in transl_service.known_models:
+            return dict(status=400, error=f"Model '{model_name}' not found")
+        try:
+            admission.check_size([source])
+        except Rejected as e:
+            return e.to_dict()
+
+        sid, client_id = request.sid, request.remote_addr
+
+        def translate():
+            try:
+                with timing.collect() as timings, admission.admit(client_id, model_name, 1):
+                    source_segs, target_segs_out = transl_service.live_translate(
+                        model_name,
+                        source=source,
+                        target_segments=target_segments_in,
+                        flicker_size=flicker_size,
+                        source_segments=source_segments_in,
+                    )
+            except Rejected as e:
+                return e.to_dict()
+            except Exception as e:
+                log.exception("Live translation failed")
+                return dict(status=500, error=f'{type(e).__name__}: {e}')
+            res = dict(
+                status=200,
+                source_segments=source_segs,
+                target_segments=target_segs_out,
+                time_taken=round(time.time() - st, 3),
+                time_units='s',
+            )
+            _add_timings(data, res, timings)
+            LIVE_SECONDS.observe(time.time() - st, event='translate', model=model_name)
+            return res
+
+        if not data.get("async"):
+            return blocking(translate)
+
+        def deliver(req_id, res):
+            outbox.call(socketio.emit, 'translated', dict(res, request_id=req_id), to=sid)
+
+        req_id = live_scheduler.submit(sid, translate, deliver, event='translate')
+        return dict(status=202, request_id=req_id)
+
+    @socketio.on('live_edit')
+    @timed_event
+    def on_live_edit(data):
+        """Session based live translation: the client sends edits and receives changed target segments only.
+
+        Request: either full text, dict(model_name, source, flicker_size), which (re)starts the session,
+            or edits, dict(model_name, version, edits=[dict(offset, delete, insert), ...], flicker_size),
+            where version is that of the last response. Optional commit_policy: agreement (default) keeps
+            the words that consecutive translations of a sentence agree on; flicker keeps all but flicker_size
+            tokens of the previous translation.
+        Response: dict(status, version, start, delete, segments=[[source, target], ...]):
+            the client replaces `delete` segments starting at index `start` with `segments`.
+            Phase timings in milliseconds are added as `timings` if the request has `timings` true.
+            status=409 means the session is out of sync; the client should resend the full text.
+        Edits must be applied in order, so they are not coalesced; the client sends the next edits after
+        the response to the previous ones. Decoding runs off the event loop.
+        """
+        st = time.time()
+        model_name = data.get("model_name")
+        flicker_size = data.get("flicker_size", DEF_FLICKER_SIZE)
+        if not isinstance(flicker_size, int) or flicker_size < 0:
+            return dict(status=400, error=f"flicker_size should be a non-negative integer. Given: {flicker_size}")
+        commit_policy = data.get("commit_policy", DEF_COMMIT_POLICY)
+        if commit_policy not in COMMIT_POLICIES:
+            error = f"commit_policy should be one of {COMMIT_POLICIES}. Given: {commit_policy}"
+            return dict(status=400, error=error)
         if model_name not in transl_service.known_models:
             return dict(status=400, error=f"Model '{model_name}' not found")
 
-        source_segs, target_segs_out = transl_service.live_translate(
-            model_name, source=source, target_segments=target_segments_in, flicker_size=flicker_size
-        )
-
-        res = dict(
-            status=200,
-            source_segments=source_segs,
-            target_segments=target_segs_out,
-            time_taken=round(time.time() - st, 3),
-            time_units='s',
-        )
+        client_id = request.remote_addr
+        try:
+            admission.acquire(client_id, model_name, 1)
+        except Rejected as e:
+            return e.to_dict()
+        try:
+            session = live_sessions.get(request.sid)
+            if "source" in data:
+                source = data["source"]
+                if not isinstance(source, str):
+                    return dict(status=400, error="source should be a string")
+                try:
+                    admission.check_size([source])
+                except Rejected as e:
+                    return e.to_dict()
+                if session is None:
+                    session = live_sessions.create(request.sid, transl_service, model_name)
+                res = blocking(
+                    session.reset,
+                    source,
+                    model_name=model_name,
+                    flicker_size=flicker_size,
+                    commit_policy=commit_policy,
+                )
+            else:
+                edits = data.get("edits")
+                if not isinstance(edits, list):
+                    return dict(status=400, error="Please submit 'edits' list or 'source' parameter")
+                if session is None or session.model_name != model_name:
+                    return dict(status=409, error="Session out of sync. Please resend the full source")
+                try:
+                    res = blocking(
+                        session.apply_edits,
+                        edits,
+                        version=data.get("version"),
+                        flicker_size=flicker_size,
+                        commit_policy=commit_policy,
+                    )
+                except ValueError as e:
+                    return dict(status=409, error=str(e))
+        finally:
+            admission.release(client_id, model_name, 1)
+        res.update(status=200, time_taken=round(time.time() - st, 3), time_units='s')
+        _add_timings(data, res, timing.current())
+        LIVE_SECONDS.observe(time.time() - st, event='live_edit', model=model_name)
         return res
 
     @bp.route('/about')
     def about():
-        return render_template('about.html', sys_info=sys_info)
-
+        resident_models = transl_service.resident_models() + eval_service.resident_models()
+        sys_info = dict(get_sys_info(), mt_models=transl_service.known_models)
+        return render_template('about.html', sys_info=sys_info, resident_models=resident_models)
+
+    @bp.route('/metrics')
+    def metrics():
+        """Metrics in Prometheus text format"""
+        families = merge(REGISTRY.collect(), transl_service.collect_metrics(), eval_service.collect_metrics())
+        return flask.Response(render(families), content_type=CONTENT_TYPE)
+
+    ####### Admin ########
+    admin_token = kwargs.get('admin_token')
+
+    def admin_only(view):
+        """Requires the admin token if one is configured; otherwise, allows local clients only"""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if admin_token:
+                given = request.headers.get('X-Admin-Token', '')
+                auth = request.headers.get('Authorization', '')
+                if auth.startswith('Bearer '):
+                    given = auth[len('Bearer ') :]
+                if not hmac.compare_digest(given.encode(), admin_token.encode()):
+                    return "Unauthorized", 401
+            elif request.remote_addr not in ('127.0.0.1', '::1'):
+                return "Admin endpoints are only available to local clients when --admin-token is not set", 403
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    def _cache_stats():
+        return dict(
+            translations=transl_service.cache_stats(),
+            disk=transl_service.disk_cache_stats(),
+            scores=eval_service.cache_stats(),
+        )
 
-def parse_args():
+    @bp.route('/admin/cache', methods=["GET"])
+    @admin_only
+    def cache_stats():
+        return respond(_cache_stats())
+
+    @bp.route('/admin/profile', methods=["GET", "POST"])
+    @admin_only
+    def profile():
+        """Sample stacks of all threads for 'seconds', every 'interval_ms', and return them as collapsed
+        stacks (text/plain, for flame graph tools), or as JSON with 'format=json'. With --workers, 'worker' id
+        profiles a worker process rather than the web server process.
+        """
+        args = _get_args(request)
+        try:
+            seconds = float(args.get("seconds", DEF_PROFILE_SECONDS))
+            interval_ms = float(args.get("interval_ms", DEF_PROFILE_INTERVAL_MS))
+            worker = args.get("worker")
+            worker = None if worker in (None, '') else int(worker)
+        except ValueError as e:
+            return f"Invalid argument: {e}", 400
+        if worker is not None and not isinstance(transl_service, WorkerPool):
+            return "'worker' is only supported with --workers", 400
+        try:
+            if worker is None:
+                res = blocking(sample, seconds, interval_ms)
+            else:
+                res = blocking(transl_service.profile, worker, seconds, interval_ms)
+        except ProfilerBusy as e:
+            return str(e), 409
+        except (AssertionError, ValueError) as e:
+            return str(e), 400
+        if args.get("format") == 'json':
+            return respond(res)
+        return flask.Response(collapsed(res), mimetype='text/plain')
+
+    @bp.route('/admin/reload', methods=["GET", "POST"])
+    @admin_only
+    def reload_config():
+        """POST: reload translators of the config file in the background; GET: state of the last reload"""
+        if request.method == 'GET':
+            return respond(reloader.status())
+        if not reloader.trigger():
+            return respond(reloader.status(), 409)
+        return respond(reloader.status(), 202)
+
+    @bp.route('/admin/cache/flush', methods=["POST"])
+    @admin_only
+    def cache_flush():
+        """Flush translation cache of 'model_name' and/or score cache of 'metric'; everything if neither is given"""
+        args = _get_args(request)
+        model_name, metric = args.get("model_name"), args.get("metric")
+        if model_name and model_name not in transl_service.known_models:
+            return f"Model '{model_name}' not found", 400
+        if metric and metric not in eval_service.known_models:
+            return f"Metric '{metric}' not found", 400
+        if model_name or not metric:
+            transl_service.flush_cache(model_name)
+        if metric or not model_name:
+            eval_service.flush_cache(metric)
+        return respond(_cache_stats())
+
+
+def parse_args(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         prog="pymarian-webapp",
-        description="Deploy Marian model to a RESTful server",
+        description="Deploy Marian model to a RESTful server. "
+        "To translate files offline, see: pymarian-webapp batch -h",
         epilog=f'Loaded from {__file__}',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
@@ -201,10 +673,65 @@ def parse_args():
     parser.add_argument("-me", "--metrics", type=str, nargs="*",
                        help="List of MT evaluation metrics. Only QE metrics are supported.",
                        default=CHOSEN_METRICS)
-    args = parser.parse_args()
+    parser.add_argument("-w", "--workers", type=int, default=DEF_WORKERS,
+                        help="Number of worker processes that keep MT models loaded and serve requests. "
+                        "0 serves models from the web server process. "
+                        "See 'placement' in the config file to assign models to workers.")
+    parser.add_argument("-at", "--admin-token",
+                        help="Token required by /admin/* endpoints, sent as 'Authorization: Bearer <token>' header. "
+                        "If not set, $PYMARIAN_ADMIN_TOKEN is used; if neither is set, "
+                        "admin endpoints are only available to local clients.")
+    parser.add_argument("-mb", "--memory-budget", type=int, default=DEF_MEMORY_BUDGET,
+                        help="Memory budget (MB) for loaded models; least recently used models are unloaded "
+                        "to stay within it. Applies to each worker process when --workers is used. 0 => unlimited. "
+                        "Default from $MARIAN_MEMORY_BUDGET")
+    parser.add_argument("-it", "--idle-timeout", type=int, default=DEF_IDLE_TIMEOUT,
+                        help="Unload models that are not used for these many seconds. 0 => never. "
+                        "Default from $MARIAN_IDLE_TIMEOUT")
+    parser.add_argument("-cd", "--cache-db", default=DEF_CACHE_DB,
+                        help="SQLite database of translations that persist across restarts and are shared by the "
+                        "processes of a node; translations are looked up there when not in memory. "
+                        "Default from $MARIAN_CACHE_DB; not used if not set")
+    parser.add_argument("-cdb", "--cache-db-bytes", type=int, default=DEF_CACHE_DB_BYTES,
+                        help="Size budget of --cache-db; least recently used translations are evicted beyond it. "
+                        "0 => unlimited. Default from $MARIAN_CACHE_DB_BYTES")
+    parser.add_argument("-lp", "--log-payloads", action="store_true",
+                        help="Log sources, translations and scores; costly under load. "
+                        "Also enabled by $MARIAN_LOG_PAYLOADS")
+    parser.add_argument("-wd", "--warmup-decodes", type=int, default=DEF_WARMUP_DECODES,
+                        help="Number of dummy decodes run by the background warm-up after loading a model. "
+                        "Models are warmed up when --eager or --workers is given; see /readyz")
+    parser.add_argument("-ms", "--max-sentences", type=int, default=DEF_MAX_SENTENCES,
+                        help="Sentences per request; larger requests are rejected with HTTP 413. 0 => no limit")
+    parser.add_argument("-mc", "--max-chars", type=int, default=DEF_MAX_CHARS,
+                        help="Characters of all sentences of a request; larger requests are rejected with HTTP 413. "
+                        "0 => no limit")
+    parser.add_argument("-cc", "--client-concurrency", type=int, default=DEF_CLIENT_CONCURRENCY,
+                        help="Requests of a client (IP address) processed at the same time; more are rejected with "
+                        "HTTP 429. 0 => no limit")
+    parser.add_argument("-cr", "--client-rate", type=float, default=DEF_CLIENT_RATE,
+                        help="Requests per second of a client (IP address); more are rejected with HTTP 429. "
+                        "0 => no limit")
+    parser.add_argument("-mq", "--max-queue", type=int, default=DEF_MAX_QUEUE,
+                        help="Sentences of a model that are admitted and not done yet; requests beyond it are "
+                        "rejected with HTTP 429. See also 'max_queue' in the config file. 0 => no limit")
+    parser.add_argument("-pt", "--pipeline-threads", type=int, default=DEF_PIPELINE_THREADS,
+                        help="Chunks of /translate requests with metrics that are translated and scored "
+                        "concurrently; chunks are scored while later ones are translated")
+    parser.add_argument("-lt", "--live-threads", type=int, default=DEF_LIVE_THREADS,
+                        help="Async live translation requests (of different clients) translated concurrently")
+    parser.add_argument("-ld", "--live-debounce-ms", type=float, default=DEF_LIVE_DEBOUNCE_MS,
+                        help="Async live translation requests wait this long for a newer request of the "
+                        "same client, which replaces them. 0 => no wait")
+    args = parser.parse_args(argv)
+    if args.log_payloads:
+        payload_log.setLevel(log.DEBUG)
+    args.admin_token = args.admin_token or os.getenv('PYMARIAN_ADMIN_TOKEN')
 
     config_stream = args.config
     args.mt_models = {}
+    # for reloads; not of stdin
+    args.config_path = config_stream.name if config_stream and config_stream is not sys.stdin else None
     if config_stream:
         try:
             config = yaml.safe_load(config_stream)
@@ -216,31 +743,37 @@ def parse_args():
     return vars(args)
 
 
-# uwsgi can take CLI args too
-# uwsgi --http 127.0.0.1:5000 --module nllb_serve.app:app # --pyargv "--foo=bar"
-cli_args = parse_args()
-attach_routes(**cli_args)
-app.register_blueprint(bp, url_prefix=cli_args.get('base'))
-if cli_args.pop('debug'):
-    app.debug = True
-
-# register an index page if needed; and link to home
-if cli_args.get('base'):
-
-    @app.route('/')
-    def index():
-        return render_template('index.html', demo_url=cli_args.get('base'))
+def __getattr__(name):
+    # `app` is made on first access, for WSGI servers that take a module attribute.
+    # uwsgi can take CLI args too
+    # uwsgi --http 127.0.0.1:5000 --module pymarian_webapp.app:app # --pyargv "--foo=bar"
+    if name == 'app':
+        global app
+        app = create_app(**parse_args())
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def main():
+    if sys.argv[1:2] == ['batch']:
+        # offline translation of files; see batch.py
+        from .batch import main as batch_main
+
+        return batch_main(sys.argv[2:])
+    cli_args = parse_args()
+    app = create_app(**cli_args)
+    socketio = app.extensions['socketio']
+    app.extensions['pymarian']['reloader'].install_signal()  # kill -HUP <pid> reloads translators
+    sys_info = dict(get_sys_info(), mt_models=cli_args['mt_models'])
     sys_yaml = yaml.dump(sys_info, default_flow_style=False)
     log.info(f"System Info:\n{sys_yaml}")
     # app.run(port=cli_args["port"], host=cli_args["host"], threaded=False, processes=8)
     # app.run(port=cli_args["port"], host=cli_args["host"], threaded=True)
     """
-    FIXME: threaded=True  :: is slow for MTAPI. it doesnt really parallelize requests
+    NOTE: threaded=True  :: is slow for MTAPI. it doesnt really parallelize requests
            threaded=False, processes=8  :: parallelize requests, but... cached_models doesnt work.
                                 so we endup reloading model for each request
+        Use --workers N instead: models are loaded once in N worker processes which serve all requests.
     """
     socketio.run(app, port=cli_args["port"], host=cli_args["host"], debug=app.debug)
 
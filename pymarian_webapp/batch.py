@@ -0,0 +1,352 @@
+"""
+Offline translation of large files, without the web server: `pymarian-webapp batch`.
+
+The input is read in chunks of lines, so memory use does not grow with file size. Chunks are translated
+concurrently, by worker processes that keep the model loaded when --workers is given, and are optionally
+scored with QE metrics while later chunks are being translated. Output is written in input order; after each
+chunk, a checkpoint records how far the input and output got, so that an interrupted job resumes where it
+stopped.
+
+Usage:
+    pymarian-webapp batch -c config.yml -m en-de -i input.txt -o output.txt -w 4
+    pymarian-webapp batch -c config.yml -m en-de -i input.tsv -o output.tsv -f tsv --column 1 \
+        -me wmt22-cometkiwi-da
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import yaml
+
+from . import log
+from .constants import DEF_BATCH_CHUNK_SIZE, DEF_CACHE_DB, DEF_CACHE_DB_BYTES, DEF_MEMORY_BUDGET, DEF_WORKERS
+from .disk_cache import DiskCache
+from .evaluator_service import EvaluatorService
+from .residency import ResidencyManager
+from .translator_service import TranslatorService
+from .worker_pool import WorkerPool
+
+FORMATS = ('text', 'tsv')
+LOG_INTERVAL = 30  # seconds between progress logs
+
+
+@dataclass
+class Chunk:
+    """Lines of the input, translated and written together"""
+
+    start: int  # index of first line
+    end_offset: int  # byte offset in the input after the last line
+    lines: List[bytes]  # raw lines, without line breaks
+    sources: List[str]  # one per line; empty sources are not translated
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a job; saved next to the output after each chunk is written"""
+
+    input: str
+    model: str
+    metrics: List[str]
+    format: str
+    column: int
+    model_config: str = ''  # digest of the model's config; empty in checkpoints of older versions
+    lines: int = 0  # input lines done
+    input_offset: int = 0  # bytes of input done
+    output_offset: int = 0  # bytes of output written for them
+    done: bool = False
+
+    JOB_KEYS = ('input', 'model', 'model_config', 'metrics', 'format', 'column')
+
+    def differences(self, other: 'Checkpoint') -> List[str]:
+        """:return: names of the job fields that differ from other; outputs of different jobs must not mix"""
+        return [key for key in self.JOB_KEYS if getattr(self, key) != getattr(other, key)]
+
+    def same_job(self, other: 'Checkpoint') -> bool:
+        return not self.differences(other)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['Checkpoint']:
+        if not path.exists():
+            return None
+        return cls(**json.loads(path.read_text(encoding='utf-8')))
+
+    def save(self, path: Path):
+        """Atomically replace the checkpoint file"""
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as out:
+            json.dump(asdict(self), out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, path)
+
+
+def read_chunks(
+    path: Path, chunk_size: int, fmt: str = 'text', column: int = 0, start_line: int = 0, offset: int = 0
+) -> Iterator[Chunk]:
+    """Read lines of a file in chunks, lazily
+
+    :param path: input file
+    :param chunk_size: lines per chunk
+    :param fmt: text: each line is a source; tsv: source is in a column of each line
+    :param column: column of source in tsv
+    :param start_line: index of the line at offset
+    :param offset: byte offset to start reading from, e.g. of a checkpoint
+    :return: chunks
+    """
+    assert fmt in FORMATS, f"format should be one of {FORMATS}. Given: {fmt}"
+    assert chunk_size > 0, f"chunk_size should be positive. Given: {chunk_size}"
+    assert column >= 0, f"column should be non-negative. Given: {column}"
+    with open(path, 'rb') as inp:
+        inp.seek(offset)
+        chunk = Chunk(start=start_line, end_offset=offset, lines=[], sources=[])
+        for raw in inp:
+            line_idx = chunk.start + len(chunk.lines)
+            chunk.end_offset += len(raw)
+            raw = raw.rstrip(b'\r\n')
+            text = raw.decode('utf-8', errors='replace')
+            if fmt == 'tsv':
+                fields = text.split('\t')
+                assert column < len(fields), f"Line {line_idx + 1} has no column {column}: {text!r}"
+                text = fields[column]
+            chunk.lines.append(raw)
+            chunk.sources.append(text.strip())
+            if len(chunk.lines) >= chunk_size:
+                yield chunk
+                chunk = Chunk(start=line_idx + 1, end_offset=chunk.end_offset, lines=[], sources=[])
+        if chunk.lines:
+            yield chunk
+
+
+class BatchJob:
+    """Translates (and scores) a file chunk by chunk; several chunks are in flight at a time"""
+
+    def __init__(
+        self,
+        transl_service,
+        model_name: str,
+        eval_service: Optional[EvaluatorService] = None,
+        metrics: Optional[List[str]] = None,
+        inflight: int = 2,
+    ) -> None:
+        """
+        :param transl_service: TranslatorService, or WorkerPool
+        :param model_name: model to translate with
+        :param eval_service: scores translations with QE metrics
+        :param metrics: QE metrics; none => no scoring
+        :param inflight: chunks translated (or scored) concurrently
+        """
+        assert model_name in transl_service.known_models, f"Unknown model {model_name}"
+        assert inflight > 0, f"inflight should be positive. Given: {inflight}"
+        assert not metrics or eval_service, "eval_service is required for metrics"
+        self.transl_service = transl_service
+        self.model_name = model_name
+        self.eval_service = eval_service
+        self.metrics = metrics or []
+        self.inflight = inflight
+        # scoring waits for translation in its own threads, so that it overlaps translation of later chunks
+        self.translators = ThreadPoolExecutor(max_workers=inflight, thread_name_prefix='batch-translate')
+        self.scorers = ThreadPoolExecutor(max_workers=inflight, thread_name_prefix='batch-score')
+
+    def _translate(self, sources: List[str]) -> List[str]:
+        idxs = [idx for idx, src in enumerate(sources) if src]
+        outputs = [''] * len(sources)
+        if idxs:
+            translations = self.transl_service.translate(self.model_name, [sources[idx] for idx in idxs])
+            for idx, output in zip(idxs, translations[0]['outputs']):
+                outputs[idx] = ' '.join(output.splitlines())  # one line of output per line of input
+        return outputs
+
+    def _score(self, sources: List[str], translated: Future) -> Tuple[List[str], Dict[str, List]]:
+        outputs = translated.result()
+        idxs = [idx for idx, src in enumerate(sources) if src and outputs[idx]]
+        scores = {}
+        for metric in self.metrics:
+            scores[metric] = [None] * len(sources)
+            if idxs:
+                values = self.eval_service.evaluate(
+                    metric, [sources[idx] for idx in idxs], [outputs[idx] for idx in idxs]
+                )
+                for idx, value in zip(idxs, values):
+                    scores[metric][idx] = value
+        return outputs, scores
+
+    def submit(self, chunk: Chunk) -> Future:
+        """:return: future of (translations, scores of each metric)"""
+        translated = self.translators.submit(self._translate, chunk.sources)
+        return self.scorers.submit(self._score, chunk.sources, translated)
+
+    @staticmethod
+    def format_line(raw: bytes, output: str, scores: List[Optional[float]], fmt: str) -> bytes:
+        """Output line: translation (text), or input fields followed by translation (tsv); then scores"""
+        fields = [raw.decode('utf-8', errors='replace')] if fmt == 'tsv' else []
+        fields.append(output)
+        fields.extend('' if score is None else f'{score:.4f}' for score in scores)
+        return ('\t'.join(fields) + '\n').encode('utf-8')
+
+    def run(self, chunks: Iterator[Chunk], out, checkpoint: Checkpoint, checkpoint_path: Path, fmt: str):
+        """Translate chunks and write their lines in order; checkpoint is saved after each chunk
+
+        :param chunks: input chunks
+        :param out: output file, opened in binary mode, positioned at checkpoint.output_offset
+        """
+        pending = deque()
+        st = last_log = time.time()
+        done_lines = 0
+
+        def write_next():
+            nonlocal done_lines, last_log
+            chunk, future = pending.popleft()
+            outputs, scores = future.result()
+            for idx, raw in enumerate(chunk.lines):
+                line_scores = [scores[metric][idx] for metric in self.metrics]
+                out.write(self.format_line(raw, outputs[idx], line_scores, fmt))
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.lines = chunk.start + len(chunk.lines)
+            checkpoint.input_offset = chunk.end_offset
+            checkpoint.output_offset = out.tell()
+            checkpoint.save(checkpoint_path)
+            done_lines += len(chunk.lines)
+            if time.time() - last_log >= LOG_INTERVAL:
+                last_log = time.time()
+                rate = done_lines / (last_log - st)
+                log.info(f"Done {checkpoint.lines:,} lines; {rate:.1f} lines/s")
+
+        try:
+            for chunk in chunks:
+                pending.append((chunk, self.submit(chunk)))
+                if len(pending) >= self.inflight:
+                    write_next()
+            while pending:
+                write_next()
+        finally:
+            for _, future in pending:
+                future.cancel()
+            self.translators.shutdown(wait=True, cancel_futures=True)
+            self.scorers.shutdown(wait=True, cancel_futures=True)
+        checkpoint.done = True
+        checkpoint.save(checkpoint_path)
+        elapsed = time.time() - st
+        log.info(f"Done {checkpoint.lines:,} lines; {done_lines:,} in this run, in {elapsed:.1f}s")
+
+
+def config_digest(model_config: Dict) -> str:
+    """Digest of a model's config, so that a job is not resumed with a different model under the same name"""
+    return hashlib.sha256(json.dumps(model_config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="pymarian-webapp batch",
+        description="Translate a file offline, with the models of a config file. "
+        "Interrupted jobs resume from a checkpoint saved next to the output",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-c", "--config", type=argparse.FileType('r'), required=True, help="Config file with MT models"
+    )
+    parser.add_argument("-m", "--model", required=True, help="Name of the MT model in the config file")
+    parser.add_argument(
+        "-i", "--input", type=Path, required=True, help="Input file; UTF-8, one source per line"
+    )
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Output file")
+    parser.add_argument("-f", "--format", choices=FORMATS, default='text',
+                        help="text: each line is a source, output lines are translations. "
+                        "tsv: source is in --column of each line, output lines are input lines with "
+                        "translation appended. QE scores, if any, are appended as more columns")
+    parser.add_argument("--column", type=int, default=0, help="Column of source in tsv input; 0-based")
+    parser.add_argument("-me", "--metrics", type=str, nargs="*", default=[],
+                        help="QE metrics to score translations with")
+    parser.add_argument("-w", "--workers", type=int, default=DEF_WORKERS,
+                        help="Number of worker processes that keep the model loaded and translate chunks. "
+                        "0 translates in this process")
+    parser.add_argument("-cs", "--chunk-size", type=int, default=DEF_BATCH_CHUNK_SIZE,
+                        help="Lines translated together; progress is checkpointed after each chunk")
+    parser.add_argument("-if", "--inflight", type=int, default=0,
+                        help="Chunks translated concurrently. 0 => two per worker process")
+    parser.add_argument("-mb", "--memory-budget", type=int, default=DEF_MEMORY_BUDGET,
+                        help="Memory budget (MB) for loaded models, of each worker process. 0 => unlimited")
+    parser.add_argument("-cd", "--cache-db", default=DEF_CACHE_DB,
+                        help="Persistent translation cache shared with the web app; see pymarian-webapp -h")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args(argv)
+    config = yaml.safe_load(args.config) or {}
+    args.mt_models = config.get("translators", {})
+    return vars(args)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    model_name, fmt, column = args['model'], args['format'], args['column']
+    assert model_name in args['mt_models'], f"Unknown model {model_name}. Known: {list(args['mt_models'])}"
+    assert args['input'].is_file(), f"Input file {args['input']} not found"
+    output: Path = args['output']
+    checkpoint_path = output.with_name(output.name + '.ckpt')
+    checkpoint = Checkpoint(
+        input=str(args['input'].resolve()),
+        model=model_name,
+        model_config=config_digest(args['mt_models'][model_name]),
+        metrics=args['metrics'],
+        format=fmt,
+        column=column,
+    )
+    prior = None if args['restart'] else Checkpoint.load(checkpoint_path)
+    if prior is not None:
+        changed = prior.differences(checkpoint)
+        assert not changed, (
+            f"Checkpoint {checkpoint_path} is of a different job; {', '.join(changed)} changed: {prior}. "
+            "Resuming would mix outputs of both in one file; use --restart to start over"
+        )
+        if prior.done:
+            log.info(f"Job is already done: {prior.lines:,} lines in {output}. Use --restart to start over")
+            return
+        assert output.exists() and output.stat().st_size >= prior.output_offset, (
+            f"Output {output} is shorter than its checkpoint; use --restart to start over"
+        )
+        checkpoint = prior
+        log.info(f"Resuming from line {prior.lines:,} of {args['input']}")
+
+    # chunks are skipped to where the last job stopped, by the byte offset of the input
+    chunks = read_chunks(
+        args['input'],
+        args['chunk_size'],
+        fmt=fmt,
+        column=column,
+        start_line=checkpoint.lines,
+        offset=checkpoint.input_offset,
+    )
+    workers = args['workers']
+    residency = ResidencyManager(budget=args['memory_budget'], idle_timeout=0)
+    models = {model_name: args['mt_models'][model_name]}
+    disk_cache = DiskCache(args['cache_db'], max_bytes=DEF_CACHE_DB_BYTES) if args['cache_db'] else None
+    if workers > 0:
+        transl_service = WorkerPool(
+            models, num_workers=workers, memory_budget=args['memory_budget'], disk_cache=disk_cache
+        )
+    else:
+        transl_service = TranslatorService(
+            models, eager_load=True, residency=residency, disk_cache=disk_cache
+        )
+    eval_service = None
+    if args['metrics']:
+        eval_service = EvaluatorService(names=args['metrics'], eager_load=True, residency=residency)
+        # metrics that fail to load are dropped by the service; fail now rather than after chunks are written
+        missing = [name for name in args['metrics'] if name not in eval_service.known_models]
+        assert not missing, f"Metrics {missing} could not be loaded; see the warnings above"
+    inflight = args['inflight'] or 2 * max(1, workers)
+    job = BatchJob(transl_service, model_name, eval_service, metrics=args['metrics'], inflight=inflight)
+    try:
+        with open(output, 'r+b' if prior is not None else 'wb') as out:
+            out.truncate(checkpoint.output_offset)  # lines written after the last checkpoint are redone
+            out.seek(checkpoint.output_offset)
+            job.run(chunks, out, checkpoint, checkpoint_path, fmt)
+    finally:
+        if workers > 0:
+            transl_service.close()
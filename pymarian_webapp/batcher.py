@@ -0,0 +1,291 @@
+"""
+Dynamic micro-batching of decode calls across concurrent requests.
+
+Concurrent callers submit their sentences to a per-model MicroBatcher, which groups them into batches
+bounded by size, token budget and wait time, runs one decode per batch and hands each caller its own outputs.
+Within a batch, items can be decoded in buckets of similar length to reduce padding; see `decode_bucketed`.
+Phases of a batch, and the time callers waited for it, are added to the timings of the callers' requests.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import log, timing
+from .constants import DEF_MAX_BATCH_SIZE, DEF_MAX_BATCH_TOKENS, DEF_MAX_WAIT_MS
+
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate used for batch budgets; whitespace tokens"""
+    return len(text.split()) + 1
+
+
+def length_buckets(
+    lengths: List[int], max_batch_size: int = DEF_MAX_BATCH_SIZE, max_batch_tokens: int = DEF_MAX_BATCH_TOKENS
+) -> List[List[int]]:
+    """Group items of similar length, so that short items are not padded to the length of long ones.
+
+    :param lengths: token length of each item
+    :param max_batch_size: maximum number of items in a bucket
+    :param max_batch_tokens: maximum number of padded tokens (items x longest item) in a bucket.
+        An item longer than this makes its own bucket
+    :return: indices of items in each bucket; buckets are in ascending order of length
+    """
+    assert max_batch_size > 0, f"max_batch_size should be positive. Given: {max_batch_size}"
+    buckets, bucket = [], []
+    for idx in sorted(range(len(lengths)), key=lengths.__getitem__):  # stable: ties keep their order
+        if bucket and (len(bucket) >= max_batch_size or (len(bucket) + 1) * lengths[idx] > max_batch_tokens):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(idx)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def decode_bucketed(
+    fn: Callable[..., List[Any]],
+    items: List[Any],
+    max_batch_size: int = DEF_MAX_BATCH_SIZE,
+    max_batch_tokens: int = DEF_MAX_BATCH_TOKENS,
+    length_fn: Callable[[Any], int] = count_tokens,
+    **options,
+) -> List[Any]:
+    """Decode items in length buckets (see `length_buckets`), one call of `fn` per bucket.
+
+    :param fn: function that maps a list of items (and options as kwargs) to a list of outputs of same length
+    :param items: items to decode
+    :param options: keyword args passed to `fn`
+    :return: outputs, in the order of items
+    """
+    outputs = [None] * len(items)
+    for bucket in length_buckets([length_fn(item) for item in items], max_batch_size, max_batch_tokens):
+        bucket_outputs = fn([items[idx] for idx in bucket], **options)
+        assert len(bucket_outputs) == len(
+            bucket
+        ), f"Expected {len(bucket)} outputs from batch function, but got {len(bucket_outputs)}"
+        for idx, output in zip(bucket, bucket_outputs):
+            outputs[idx] = output
+    return outputs
+
+
+class _Job:
+    """A group of items submitted by a single caller"""
+
+    __slots__ = (
+        'items', 'options', 'key', 'results', 'cursor', 'pending', 'future', 'arrival', 'timings', 'waited'
+    )
+
+    def __init__(self, items: List[Any], options: Dict[str, Any]) -> None:
+        self.items = items
+        self.options = options
+        self.key = tuple(sorted(options.items()))
+        self.results = [None] * len(items)
+        self.cursor = 0  # index of next item to be scheduled
+        self.pending = len(items)  # number of items yet to be decoded
+        self.future = Future()
+        self.arrival = time.monotonic()
+        self.timings = timing.current()  # of the caller's request
+        self.waited = False  # whether the wait for its first batch is in its timings
+
+
+class MicroBatcher:
+    """Collects items from concurrent callers into batches and runs `fn` once per batch.
+
+    Only items submitted with identical options are batched together, so e.g. plain decoding and
+    force decoding requests never end up in the same batch.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[..., List[Any]],
+        name: str = 'batcher',
+        max_batch_size: int = DEF_MAX_BATCH_SIZE,
+        max_batch_tokens: int = DEF_MAX_BATCH_TOKENS,
+        max_wait_ms: float = DEF_MAX_WAIT_MS,
+        num_workers: int = 1,
+        length_fn: Callable[[Any], int] = count_tokens,
+        phase: str = 'decode',
+    ) -> None:
+        """
+        :param fn: function that maps a list of items (and options as kwargs) to a list of outputs of same length
+        :param name: name used in thread names and logs
+        :param max_batch_size: maximum number of items in a batch
+        :param max_batch_tokens: maximum number of (estimated) tokens in a batch
+        :param max_wait_ms: maximum time (milliseconds) the oldest item waits for the batch to fill up
+        :param num_workers: number of batches that may be decoded concurrently
+        :param length_fn: estimates the token length of an item
+        :param phase: name of the phase of batches in the timings of requests; waiting is `<phase>_wait`
+        """
+        assert max_batch_size > 0, f"max_batch_size should be positive. Given: {max_batch_size}"
+        assert max_batch_tokens > 0, f"max_batch_tokens should be positive. Given: {max_batch_tokens}"
+        assert max_wait_ms >= 0, f"max_wait_ms should be non-negative. Given: {max_wait_ms}"
+        self.fn = fn
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.length_fn = length_fn
+        self.phase = phase
+        self.queue: deque[_Job] = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.holders = 0  # callers that are about to submit; see hold()
+        self.workers = []
+        for i in range(max(1, num_workers)):
+            worker = threading.Thread(target=self._run, name=f'{name}-batcher-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, items: List[Any], **options) -> Future:
+        """Schedule items for decoding.
+
+        :param items: items to decode
+        :param options: keyword args passed to `fn`
+        :return: future resolving to the list of outputs, in the order of items
+        """
+        job = _Job(list(items), options)
+        if not job.items:
+            job.future.set_result([])
+            return job.future
+        with self.cond:
+            if self.closed:
+                raise RuntimeError(f"Batcher {self.name} is closed")
+            self.queue.append(job)
+            self.cond.notify()
+        return job.future
+
+    def process(self, items: List[Any], **options) -> List[Any]:
+        """Blocking version of `submit`"""
+        return self.submit(items, **options).result()
+
+    def queue_depth(self) -> int:
+        """Number of items waiting to be scheduled"""
+        with self.cond:
+            return sum(len(job.items) - job.cursor for job in self.queue)
+
+    def hold(self):
+        """Keep the batcher open for a caller that is about to submit, until it calls release()"""
+        with self.cond:
+            if self.closed:
+                raise RuntimeError(f"Batcher {self.name} is closed")
+            self.holders += 1
+
+    def release(self):
+        with self.cond:
+            self.holders -= 1
+            self.cond.notify_all()
+
+    def close(self, wait: bool = False):
+        """Stop taking items; items already submitted are still decoded
+
+        :param wait: first wait for the callers that hold the batcher to release it
+        """
+        with self.cond:
+            while wait and self.holders:
+                self.cond.wait()
+            self.closed = True
+            self.cond.notify_all()
+
+    def join(self, timeout: Optional[float] = None):
+        """Wait for the items submitted before close() to be decoded"""
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def _ready_size(self, key: Tuple) -> Tuple[int, int]:
+        """Number of waiting items and tokens that are batchable with `key`. Caller must hold the lock."""
+        n_items, n_tokens = 0, 0
+        for job in self.queue:
+            if job.key != key:
+                continue
+            for item in job.items[job.cursor :]:
+                n_items += 1
+                n_tokens += self.length_fn(item)
+                if n_items >= self.max_batch_size or n_tokens >= self.max_batch_tokens:
+                    return n_items, n_tokens
+        return n_items, n_tokens
+
+    def _take_batch(self) -> Optional[Tuple[List[Tuple[_Job, int]], Dict[str, Any]]]:
+        """Waits for a batch to be ready and removes it from the queue.
+        :return: list of (job, item_index) and the options of the batch; None if closed
+        """
+        with self.cond:
+            while True:
+                while self.queue and self.queue[0].future.done():
+                    self.queue.popleft()  # failed jobs; skip the rest of their items
+                if not self.queue:
+                    if self.closed:
+                        return None
+                    self.cond.wait()
+                    continue
+                head = self.queue[0]
+                deadline = head.arrival + self.max_wait
+                while not self.closed and self.queue and self.queue[0] is head:
+                    n_items, n_tokens = self._ready_size(head.key)
+                    remaining = deadline - time.monotonic()
+                    if n_items >= self.max_batch_size or n_tokens >= self.max_batch_tokens or remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                if self.queue and self.queue[0] is head:
+                    break
+                # another worker took the head meanwhile; start over
+
+            batch, n_tokens = [], 0
+            for job in list(self.queue):
+                if job.key != head.key or job.future.done():
+                    continue
+                while job.cursor < len(job.items) and len(batch) < self.max_batch_size:
+                    item_len = self.length_fn(job.items[job.cursor])
+                    if batch and n_tokens + item_len > self.max_batch_tokens:
+                        break
+                    batch.append((job, job.cursor))
+                    n_tokens += item_len
+                    job.cursor += 1
+                if job.cursor >= len(job.items):
+                    self.queue.remove(job)
+                if len(batch) >= self.max_batch_size or job.cursor < len(job.items):
+                    break
+            return batch, head.options
+
+    def _call(self, jobs: List[_Job], items: List[Any], options: Dict[str, Any]) -> List[Any]:
+        """Run fn on a batch; its phases are added to the timings of the requests of its jobs, if any"""
+        if all(job.timings is None for job in jobs):
+            return self.fn(items, **options)
+        start = time.monotonic()
+        with timing.collect() as batch_timings:
+            try:
+                return self.fn(items, **options)
+            finally:
+                spans = batch_timings.spans + [(self.phase, start, time.monotonic())]
+                for job in jobs:
+                    if job.timings is None:
+                        continue
+                    job.timings.extend(spans)
+                    if not job.waited:  # later batches of a job wait while its earlier ones are decoded
+                        job.timings.add(f'{self.phase}_wait', job.arrival, start)
+                        job.waited = True
+
+    def _run(self):
+        while True:
+            taken = self._take_batch()
+            if taken is None:
+                return
+            batch, options = taken
+            items = [job.items[idx] for job, idx in batch]
+            try:
+                outputs = self._call(list(dict.fromkeys(job for job, _ in batch)), items, options)
+                assert len(outputs) == len(
+                    items
+                ), f"Expected {len(items)} outputs from batch function, but got {len(outputs)}"
+            except BaseException as e:
+                log.exception(f"Batch of {len(items)} items failed in {self.name}")
+                for job, _ in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+            for (job, idx), output in zip(batch, outputs):
+                job.results[idx] = output
+                job.pending -= 1
+                if job.pending == 0 and not job.future.done():
+                    job.future.set_result(job.results)
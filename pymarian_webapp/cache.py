@@ -0,0 +1,156 @@
+"""
+Bounded, per-model cache of translations.
+"""
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from .constants import DEF_CACHE_BYTES, DEF_CACHE_TTL
+
+ENTRY_OVERHEAD = 200  # bytes; approx. cost of the OrderedDict node, tuples and bookkeeping of an entry
+
+
+def sizeof(obj: Any) -> int:
+    """Approximate memory size of a (nested) object in bytes"""
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(sizeof(it) for it in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+def normalize(text: Optional[str]) -> str:
+    """Normalize text for use in cache keys: unicode NFC and collapsed whitespace"""
+    if not text:
+        return ''
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+class ModelCache:
+    """LRU cache with a byte budget and optional time-to-live of entries"""
+
+    def __init__(self, max_bytes: int = DEF_CACHE_BYTES, ttl: float = DEF_CACHE_TTL) -> None:
+        """
+        :param max_bytes: memory budget in bytes; least recently used entries are evicted beyond it
+        :param ttl: time to live of entries in seconds; 0 or None => entries do not expire
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, Tuple[Any, int, float]] = OrderedDict()  # key -> (value, size, expiry)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] and entry[2] < time.monotonic():
+                self._remove(key)  # expired
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        size = sizeof(key) + sizeof(value) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return  # would evict everything else
+        expiry = time.monotonic() + self.ttl if self.ttl else 0
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expiry)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def flush(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(
+                entries=len(self.entries),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                ttl=self.ttl,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=self.hits / total if total else 0.0,
+            )
+
+
+class TranslationCache:
+    """Translation cache with a separate budget for each model.
+
+    Entries are keyed by (normalized source, normalized prefix, decoding options) within a model.
+    """
+
+    def __init__(self, max_bytes: int = DEF_CACHE_BYTES, ttl: float = DEF_CACHE_TTL) -> None:
+        """
+        :param max_bytes: default memory budget per model, in bytes
+        :param ttl: default time to live of entries in seconds; 0 or None => no expiry
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.models: Dict[str, ModelCache] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source: str, prefix: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> Tuple:
+        return (normalize(source), normalize(prefix), tuple(sorted((options or {}).items())))
+
+    def configure(self, model_name: str, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        """Sets the budget of a model. Existing entries of the model are dropped."""
+        with self.lock:
+            self.models[model_name] = ModelCache(
+                max_bytes=self.max_bytes if max_bytes is None else max_bytes,
+                ttl=self.ttl if ttl is None else ttl,
+            )
+
+    def get_model_cache(self, model_name: str) -> ModelCache:
+        with self.lock:
+            if model_name not in self.models:
+                self.models[model_name] = ModelCache(max_bytes=self.max_bytes, ttl=self.ttl)
+            return self.models[model_name]
+
+    def get(self, model_name: str, key: Tuple) -> Optional[Any]:
+        return self.get_model_cache(model_name).get(key)
+
+    def put(self, model_name: str, key: Tuple, value: Any):
+        self.get_model_cache(model_name).put(key, value)
+
+    def remove(self, model_name: str):
+        """Forget a model, along with its entries and budget"""
+        with self.lock:
+            self.models.pop(model_name, None)
+
+    def flush(self, model_name: Optional[str] = None):
+        """Flush entries of a model; all models if model_name is None"""
+        with self.lock:
+            caches = list(self.models.values()) if model_name is None else [self.models.get(model_name)]
+        for cache in caches:
+            if cache:
+                cache.flush()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            caches = dict(self.models)
+        return {name: cache.stats() for name, cache in caches.items()}
@@ -4,6 +4,10 @@ QUIET = os.getenv('MARIAN_QUIET', "").lower() in ("1", "yes", "y", "true", "on")
 CPU_THREADS = int(os.getenv('MARIAN_CPU_THREADS', "4"))
 WORKSPACE_MEMORY = int(os.getenv('MARIAN_WORKSPACE_MEMORY', "6000"))
 DEF_EAGER_LOAD = False
+# memory budget (MB) for all loaded models; least recently used models are unloaded beyond it. 0 => unlimited
+DEF_MEMORY_BUDGET = int(os.getenv('MARIAN_MEMORY_BUDGET', "0"))
+# unload models that are not used for these many seconds. 0 => never
+DEF_IDLE_TIMEOUT = int(os.getenv('MARIAN_IDLE_TIMEOUT', "0"))
 
 BASE_ARGS = dict(
     mini_batch=8,
@@ -14,6 +18,75 @@ BASE_ARGS = dict(
 )
 
 DEF_FLICKER_SIZE = 4  # tokens
+# live translation: how much of the previous translation of an edited sentence is kept (forced) when it is
+# decoded again. agreement: the words that two consecutive translations agree on;
+# flicker: all but flicker_size tokens
+COMMIT_POLICIES = ('agreement', 'flicker')
+DEF_COMMIT_POLICY = 'agreement'
+DEF_LIVE_THREADS = 8  # live translation requests (of different clients) served concurrently
+DEF_LIVE_DEBOUNCE_MS = 0  # a request waits this long for a newer one from the same client; 0 => no wait
+LIVE_POLL_MS = 5  # with eventlet and gevent, results of live requests are picked up for sending this often
+
+# sentence splitting; language of a model can be set in the config file
+DEF_LANGUAGE = 'en'
+DEF_SEGMENT_CACHE_BYTES = int(os.getenv('MARIAN_SEGMENT_CACHE_BYTES', 8 * 1024 * 1024))  # per language
+
+# warm-up: dummy decodes run after loading a model, so that its workspace is allocated before real requests come
+DEF_WARMUP_DECODES = 2
+WARMUP_SENTENCES = ["Hello world.", "This sentence is only used to warm up the model before it serves requests."]
+
+# translation cache; can be overridden per model in the config file
+DEF_CACHE_BYTES = int(os.getenv('MARIAN_CACHE_BYTES', 64 * 1024 * 1024))  # per model
+DEF_CACHE_TTL = float(os.getenv('MARIAN_CACHE_TTL', 0))  # seconds; 0 => no expiry
+# persistent translation cache (SQLite database), shared by processes of a node; not used if no path is given
+DEF_CACHE_DB = os.getenv('MARIAN_CACHE_DB')
+DEF_CACHE_DB_BYTES = int(os.getenv('MARIAN_CACHE_DB_BYTES', 1024 * 1024 * 1024))
+
+# dynamic batching of concurrent requests; can be overridden per model in the config file
+DEF_MAX_BATCH_SIZE = 32  # sentences
+DEF_MAX_BATCH_TOKENS = 4096  # whitespace tokens
+DEF_MAX_WAIT_MS = 5  # milliseconds
+# translator replicas per model; each decodes a batch at a time, in parallel with others
+DEF_REPLICAS = 1
+
+# document models (doc_enabled): documents are translated in windows of consecutive sentences
+DEF_DOC_WINDOW_TOKENS = 256  # whitespace tokens per window
+DEF_DOC_WINDOW_OVERLAP = 0  # sentences of preceding window repeated as context
+
+# responses: digits of floats (e.g. scores) after the decimal point, and gzip of large responses
+FLOAT_POINTS = 4
+DEF_GZIP_MIN_BYTES = int(os.getenv('MARIAN_GZIP_MIN_BYTES', 16 * 1024))  # 0 => never compress
+DEF_GZIP_LEVEL = 5
+
+# admission control; 0 => no limit. max_queue can be set per model in the config file
+DEF_MAX_SENTENCES = 1024  # per request
+DEF_MAX_CHARS = 256 * 1024  # per request, of all sentences
+DEF_CLIENT_CONCURRENCY = 16  # requests of a client (IP address) processed at the same time
+DEF_CLIENT_RATE = 0  # requests per second of a client
+DEF_MAX_QUEUE = 4096  # sentences of admitted requests of a model that are not done yet
+DEF_RETRY_AFTER = 1  # seconds; hint to clients rejected for overload
+
+# sampling profiler of /admin/profile
+DEF_PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 120
+DEF_PROFILE_INTERVAL_MS = 5  # milliseconds between samples
+
+# translation with QE: chunks are scored as soon as they are translated, while later ones are decoded
+DEF_PIPELINE_CHUNK_SIZE = 32  # sentences
+DEF_PIPELINE_THREADS = 16  # chunks translated and scored concurrently, across requests
+
+DEF_STREAM_CHUNK_SIZE = 64  # sentences translated at once by the streaming endpoint
+DEF_BATCH_CHUNK_SIZE = 256  # lines translated at once, and checkpointed, by offline batch jobs
+
+# multi-process serving; 0 workers => models are served from the web server process
+DEF_WORKERS = 0
+DEF_WORKER_THREADS = 8  # concurrent requests handled by each worker process
+
+# QE scoring; batching of concurrent requests and cache of scores
+DEF_EVAL_MAX_BATCH_SIZE = 64  # (source, mt) pairs
+DEF_EVAL_MAX_BATCH_TOKENS = 8192  # whitespace tokens
+DEF_EVAL_MAX_WAIT_MS = 10  # milliseconds
+DEF_SCORE_CACHE_BYTES = int(os.getenv('MARIAN_SCORE_CACHE_BYTES', 32 * 1024 * 1024))  # per metric
 
 # make these metrics available by default
 CHOSEN_METRICS = ["wmt20-comet-qe-da", "wmt22-cometkiwi-da", "wmt23-cometkiwi-da-xl"]
\ No newline at end of file
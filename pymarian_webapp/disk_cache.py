@@ -0,0 +1,265 @@
+"""
+Persistent translation cache in a SQLite database, shared by the processes of a node and kept across restarts.
+
+It backs the in-memory TranslationCache: sentences missing there are looked up here before they are decoded.
+Entries are keyed by model identity, a hash of the model and vocab files and of the options that change its
+output, so a cache outlives deploys of the same model but not a change of it. The database is in WAL mode: any
+number of processes read concurrently while one writes. Least recently used entries are evicted beyond a size
+budget.
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import log
+from .constants import DEF_CACHE_DB_BYTES
+
+ENTRY_OVERHEAD = 64  # bytes; approx. cost of an entry's row and index entries besides its key and value
+TOUCH_INTERVAL = 3600  # seconds; last use of entries is recorded at this resolution, to spare writes on reads
+BUSY_TIMEOUT = 60  # seconds to wait for a write lock held by another process, e.g. during a preload
+HASH_BLOCK = 1 << 20
+
+# options of a model config that change its translations; see TranslatorService.get_model()
+IDENTITY_KEYS = (
+    'type',
+    'source-language',
+    'target-language',
+    'endpoint',
+    'sentence_breaking',
+    'doc_enabled',
+    'sentence_join_token',
+    'doc_window_tokens',
+    'doc_window_overlap',
+    'language',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    model TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL,
+    PRIMARY KEY (model, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER, bytes INTEGER);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT NOT NULL, size INTEGER NOT NULL, mtime INTEGER NOT NULL, digest TEXT NOT NULL,
+    PRIMARY KEY (path, size, mtime)
+);
+CREATE TABLE IF NOT EXISTS preloads (model TEXT NOT NULL, digest TEXT NOT NULL, PRIMARY KEY (model, digest));
+"""
+
+
+UPSERT = (
+    'INSERT INTO entries VALUES (?, ?, ?, ?, ?) ON CONFLICT (model, key) DO UPDATE'
+    ' SET value = excluded.value, size = excluded.size, used = excluded.used'
+)
+
+
+def encode_key(key: Tuple) -> str:
+    """Text of a TranslationCache key"""
+    return json.dumps(key, ensure_ascii=False, separators=(',', ':'))
+
+
+def _entry(model_id: str, key: str, value: Any, now: float) -> Tuple:
+    """Row of a translation; values are stored as JSON, as some are not text, e.g. outputs of MTAPI models"""
+    value = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return model_id, key, value, len(key) + len(value) + ENTRY_OVERHEAD, now
+
+
+class DiskCache:
+    """Translations of each model identity in a SQLite database; safe to use from threads and forked
+    processes. The database is opened on first use. Errors of reads and writes are logged, not raised:
+    the cache is an optimization.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEF_CACHE_DB_BYTES) -> None:
+        """
+        :param path: database file; created if it does not exist
+        :param max_bytes: budget of keys and values, in bytes; least recently used entries are evicted
+            beyond it. 0 => unlimited
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.local = threading.local()  # connection of each thread
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.schema_pid = None  # process that made sure the schema exists
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection of this thread; connections are not shared with forked processes"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            if self.schema_pid != os.getpid():
+                conn.executescript(SCHEMA)
+                self.schema_pid = os.getpid()
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def file_digest(self, path: Path) -> str:
+        """SHA-256 of a file; remembered in the database by path, size and modification time"""
+        stat = Path(path).stat()
+        meta = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT digest FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?', meta
+        ).fetchone()
+        if row:
+            return row[0]
+        log.info(f"Hashing {path} for the identity of its translations in the cache")
+        sha = hashlib.sha256()
+        with open(path, 'rb') as inp:
+            for block in iter(lambda: inp.read(HASH_BLOCK), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        conn.execute('INSERT OR IGNORE INTO file_hashes VALUES (?, ?, ?, ?)', meta + (digest,))
+        return digest
+
+    def model_id(self, model: Dict[str, Any], decode_args: Optional[Dict[str, Any]] = None) -> str:
+        """Identity of a model's translations
+
+        :param model: model config
+        :param decode_args: decoding options given to the model, e.g. beam size
+        :return: hash of model and vocab files, decoding options and options of the config that change outputs
+        """
+        identity = {key: model[key] for key in IDENTITY_KEYS if key in model}
+        identity['decode_args'] = decode_args or {}
+        identity['values'] = 'json'  # entries of earlier versions stored text as is
+        if model.get('type', 'base') == 'base' and 'model' in model:
+            model_path = Path(model['model'])
+            vocab_path = Path(model['vocab']) if 'vocab' in model else model_path.parent / 'vocab.spm'
+            identity['files'] = [self.file_digest(model_path), self.file_digest(vocab_path)]
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_many(self, model_id: str, keys: List[Tuple]) -> List[Optional[Any]]:
+        """Translations of keys; None for the ones not in cache (or if the database cannot be read)"""
+        if not keys:
+            return []
+        texts = [encode_key(key) for key in keys]
+        found: Dict[str, Tuple[str, float]] = {}
+        try:
+            conn = self._connect()
+            for start in range(0, len(texts), 500):  # within SQLite's limit of variables of a statement
+                part = texts[start : start + 500]
+                marks = ','.join('?' * len(part))
+                query = f'SELECT key, value, used FROM entries WHERE model = ? AND key IN ({marks})'
+                rows = conn.execute(query, [model_id] + part)
+                found.update((key, (value, used)) for key, value, used in rows)
+            now = time.time()
+            stale = [(now, model_id, key) for key, (_, used) in found.items() if now - used > TOUCH_INTERVAL]
+            if stale:
+                conn.executemany('UPDATE entries SET used = ? WHERE model = ? AND key = ?', stale)
+        except sqlite3.Error as e:
+            log.warning(f"Could not read translation cache {self.path}: {e}")
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return [json.loads(found[text][0]) if text in found else None for text in texts]
+
+    def put_many(self, model_id: str, items: Iterable[Tuple[Tuple, Any]]):
+        """Store (key, translation) pairs of a model"""
+        now = time.time()
+        rows = [_entry(model_id, encode_key(key), value, now) for key, value in items]
+        if not rows:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(UPSERT, rows)
+                self._evict(conn)
+        except sqlite3.Error as e:
+            log.warning(f"Could not write translation cache {self.path}: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Evict least recently used entries down to 90% of the budget. Runs in the caller's transaction"""
+        entries, size = conn.execute('SELECT entries, bytes FROM totals WHERE id = 0').fetchone()
+        if not self.max_bytes or size <= self.max_bytes or not entries:
+            return
+        n = math.ceil((size - 0.9 * self.max_bytes) / (size / entries))
+        conn.execute(
+            'DELETE FROM entries WHERE (model, key) IN'
+            ' (SELECT model, key FROM entries ORDER BY used LIMIT ?)',
+            (n,),
+        )
+        with self.lock:
+            self.evictions += n
+
+    def preload(self, model_id: str, tsv_path: Path, make_key) -> int:
+        """Load known translations of a model from a TSV file of `source<tab>translation` lines.
+        A file is loaded once per model; loading it again does nothing, unless the file changes.
+
+        :param make_key: key of a source, e.g. TranslationCache.make_key
+        :return: number of translations loaded
+        """
+        digest = self.file_digest(tsv_path)
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')  # other processes wait rather than loading the same file
+            query = 'SELECT 1 FROM preloads WHERE model = ? AND digest = ?'
+            if conn.execute(query, (model_id, digest)).fetchone():
+                return 0
+            now, rows, skipped = time.time(), [], 0
+            with open(tsv_path, encoding='utf-8') as inp:
+                for line in inp:
+                    source, sep, translation = line.rstrip('\r\n').partition('\t')
+                    if not sep or not source.strip():
+                        skipped += 1
+                        continue
+                    rows.append(_entry(model_id, encode_key(make_key(source)), translation, now))
+            conn.executemany(UPSERT, rows)
+            conn.execute('INSERT INTO preloads VALUES (?, ?)', (model_id, digest))
+            self._evict(conn)
+        log.info(f"Preloaded {len(rows):,} translations from {tsv_path}; skipped {skipped} lines without tab")
+        return len(rows)
+
+    def flush(self, model_id: Optional[str] = None):
+        """Delete entries of a model; all entries if model_id is None"""
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            if model_id is None:
+                conn.execute('DELETE FROM entries')
+                conn.execute('DELETE FROM preloads')
+            else:
+                conn.execute('DELETE FROM entries WHERE model = ?', (model_id,))
+                conn.execute('DELETE FROM preloads WHERE model = ?', (model_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Entries and bytes of the database; hits, misses and evictions of this process"""
+        try:
+            conn = self._connect()
+            entries, size = conn.execute('SELECT entries, bytes FROM totals WHERE id = 0').fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(
+                entries=entries,
+                bytes=size,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_ratio=self.hits / total if total else 0.0,
+            )
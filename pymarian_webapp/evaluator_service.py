@@ -1,13 +1,39 @@
-from functools import lru_cache
+import threading
+import time
+from functools import lru_cache, partial
 from itertools import zip_longest
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from pymarian import Evaluator, Defaults
-from pymarian.utils import get_model_path, get_vocab_path
 
-from . import log
-from .constants import BASE_ARGS, DEF_FLICKER_SIZE, CHOSEN_METRICS, DEF_EAGER_LOAD
+from . import log, payload_log, timing
+from .batcher import MicroBatcher, count_tokens
+from .cache import TranslationCache
+from .constants import (
+    BASE_ARGS,
+    CHOSEN_METRICS,
+    DEF_EAGER_LOAD,
+    DEF_EVAL_MAX_BATCH_SIZE,
+    DEF_EVAL_MAX_BATCH_TOKENS,
+    DEF_EVAL_MAX_WAIT_MS,
+    DEF_FLICKER_SIZE,
+    DEF_SCORE_CACHE_BYTES,
+    DEF_WARMUP_DECODES,
+    WARMUP_SENTENCES,
+)
+from .instrumentation import (
+    BATCH_SECONDS,
+    BATCH_SIZE,
+    MODEL_LOAD_SECONDS,
+    REQUESTS,
+    SENTENCES,
+    MetricFamily,
+    cache_families,
+)
+from .residency import ResidencyManager, estimate_cost
+
+if TYPE_CHECKING:
+    from pymarian import Evaluator
 
 
 @dataclass
@@ -20,14 +46,35 @@ class ModelMeta:
 
 class EvaluatorService:
 
-    def __init__(self, names: List[str] = CHOSEN_METRICS, eager_load=DEF_EAGER_LOAD) -> None:
-        self.known_models = self.download_models(names)
-        self.cache: Dict[str, Evaluator] = {}
+    def __init__(
+        self,
+        names: List[str] = CHOSEN_METRICS,
+        eager_load=DEF_EAGER_LOAD,
+        residency: Optional[ResidencyManager] = None,
+    ) -> None:
+        """
+        :param names: metric names. Models are resolved (and downloaded) when first used; see resolve_model()
+        :param eager_load: resolve and load all models now
+        :param residency: keeps loaded models within a memory budget; may be shared with other services.
+            Default: no budget
+        """
+        # metric name -> model metadata; None until resolved
+        self.known_models: Dict[str, Optional[ModelMeta]] = {name: None for name in names or []}
+        self.residency = residency or ResidencyManager(budget=0, idle_timeout=0)
+        self.cache: Dict[str, 'Evaluator'] = {}
+        self._load_lock = threading.RLock()
+        self.batchers: Dict[str, MicroBatcher] = {}
+        self._batchers_lock = threading.Lock()
+        # (source, mt) -> score, per metric
+        self.score_cache = TranslationCache(max_bytes=DEF_SCORE_CACHE_BYTES)
         if eager_load:
             self.load_all()
 
     @staticmethod
     def download_models(names:List[str]) -> Dict[str, ModelMeta]:
+        from pymarian import Defaults
+        from pymarian.utils import get_model_path, get_vocab_path
+
         metas = {}
         for name in names:
             assert name in Defaults.KNOWN_METRICS, \
@@ -49,8 +96,30 @@ class EvaluatorService:
                 continue
         return metas
 
+    def resolve_model(self, model_name: str) -> ModelMeta:
+        """Resolve model and vocab paths of a metric; downloads the model if not already.
+        Metrics that cannot be resolved are removed from known models.
+        """
+        meta = self.known_models.get(model_name)
+        if meta is not None:
+            return meta
+        with self._load_lock:
+            assert model_name in self.known_models,\
+                f"Unknown model {model_name}. Known models are {list(self.known_models)}"
+            if self.known_models[model_name] is None:
+                try:
+                    metas = self.download_models([model_name])
+                except Exception:
+                    self.known_models.pop(model_name, None)
+                    raise
+                if model_name not in metas:
+                    self.known_models.pop(model_name, None)
+                    raise ValueError(f"Metric {model_name} is not available; it is not a comet-qe model")
+                self.known_models[model_name] = metas[model_name]
+            return self.known_models[model_name]
+
     def load_all(self):
-        for model_name in self.known_models:
+        for model_name in list(self.known_models):
             try:
                 self.get_model(model_name)
             except Exception as e:
@@ -58,37 +127,89 @@ class EvaluatorService:
                 self.known_models.pop(model_name, None)
                 continue
 
-    def get_model(self, model_name) -> Evaluator:
+    def get_model(self, model_name) -> 'Evaluator':
         """
         Instantiate a model if not already in cache.
         """
-        if model_name not in self.cache:
-            log.warning(f"Model name '{model_name}' not in cache. Going to initialize."\
-                f"Currently cached models are {self.cache.keys()}")
-            assert model_name in self.known_models,\
-                f"Unknown model {model_name}. Known models are {self.known_models}"
-            meta = self.known_models[model_name]
-            model_args = BASE_ARGS | dict(
-                model_file=meta.model_path,
-                vocab_file=meta.vocab_path,
-                like = meta.like,
-                fp16 = False,
-            )
-            log.info(f"Creating evaluator with args:\n {model_args}")
-            evaluator = Evaluator.new(**model_args)
-            self.cache[model_name] = evaluator
-        return self.cache[model_name]
-
-    def evaluate(self, model_name:str, sources:List[str], mts: List[str], refs: List[str]=None) -> float:
-        assert not refs, f"Ref not supported and only QE models are supported at the moment" # future work
-        log.info(f"Eval '{model_name}'; src:{sources}; mt:{mts}")
-        assert sources and mts, f"Source and mt are required"
-        assert len(sources) == len(mts), f"Source and mt must have the same length"
-        rows = [f'{s}\t{t}' for (s,t) in zip(sources, mts)]
+        evaluator = self.cache.get(model_name)
+        if evaluator is not None:
+            self.residency.touch(f"evaluator:{model_name}")
+            return evaluator
+        with self._load_lock:
+            if model_name not in self.cache:
+                log.warning(f"Model name '{model_name}' not in cache. Going to initialize."\
+                    f"Currently cached models are {self.cache.keys()}")
+                meta = self.resolve_model(model_name)
+                model_args = BASE_ARGS | dict(
+                    model_file=meta.model_path,
+                    vocab_file=meta.vocab_path,
+                    like = meta.like,
+                    fp16 = False,
+                )
+                resident_name = f"evaluator:{model_name}"
+                self.residency.admit(
+                    resident_name, cost=estimate_cost(meta.model_path), unload=partial(self._unload, model_name)
+                )
+                log.info(f"Creating evaluator with args:\n {model_args}")
+                st = time.perf_counter()
+                try:
+                    from pymarian import Evaluator
+
+                    with timing.phase('load'):
+                        evaluator = Evaluator.new(**model_args)
+                except Exception:
+                    self.residency.discard(resident_name)
+                    raise
+                MODEL_LOAD_SECONDS.observe(time.perf_counter() - st, service='evaluator', model=model_name)
+                self.cache[model_name] = evaluator
+            return self.cache[model_name]
+
+    def _unload(self, model_name: str):
+        """Unload a model; it will be loaded again when needed"""
+        log.info(f"Unloading evaluator '{model_name}'")
+        self.cache.pop(model_name, None)
+
+    def warm_up(self, model_name: str, n_decodes: int = DEF_WARMUP_DECODES):
+        """Load a model and score a few dummy pairs, so that its workspace is allocated before requests come.
+        Dummy calls bypass the batching scheduler and the score cache.
+        """
         evaluator = self.get_model(model_name)
-        scores = list(evaluator.evaluate(rows))
-        log.info(f"input: {rows}")
-        log.info(f"score: {scores}")
+        for _ in range(n_decodes):
+            list(evaluator.evaluate([f'{sent}\t{sent}' for sent in WARMUP_SENTENCES]))
+
+    def resident_models(self) -> List[Dict]:
+        """Evaluators currently loaded in memory"""
+        return self.residency.resident(prefix="evaluator:")
+
+    def get_batcher(self, model_name) -> MicroBatcher:
+        """
+        Get the batching scheduler of a metric; created if not already.
+        (source, mt) pairs from concurrent requests are scored together in batches.
+        """
+        with self._batchers_lock:
+            if model_name not in self.batchers:
+                assert model_name in self.known_models,\
+                    f"Unknown model {model_name}. Known models are {self.known_models}"
+                self.batchers[model_name] = MicroBatcher(
+                    fn=partial(self._score, model_name),
+                    name=model_name,
+                    max_batch_size=DEF_EVAL_MAX_BATCH_SIZE,
+                    max_batch_tokens=DEF_EVAL_MAX_BATCH_TOKENS,
+                    max_wait_ms=DEF_EVAL_MAX_WAIT_MS,
+                    length_fn=lambda pair: count_tokens(pair[0]) + count_tokens(pair[1]),
+                    phase='qe',
+                )
+            return self.batchers[model_name]
+
+    def _score(self, model_name: str, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Score a batch of (source, mt) pairs. Called by the batching scheduler."""
+        rows = [f'{s}\t{t}' for (s,t) in pairs]
+        evaluator = self.get_model(model_name)
+        BATCH_SIZE.observe(len(rows), service='evaluator', model=model_name)
+        with BATCH_SECONDS.time(service='evaluator', model=model_name):
+            scores = list(evaluator.evaluate(rows))
+        payload_log.debug("input: %s", rows)
+        payload_log.debug("score: %s", scores)
         res = []
         for score in scores:
             # some metrics give forward and backward scores, we pick the first one
@@ -96,3 +217,44 @@ class EvaluatorService:
                 score = score[0]
             res.append(score)
         return res
+
+    def evaluate(self, model_name:str, sources:List[str], mts: List[str], refs: List[str]=None) -> List[float]:
+        """Score MT outputs. Scores are cached; only pairs not in cache are scored.
+
+        :param model_name: metric name
+        :param sources: source sentences
+        :param mts: translations of sources. A list of translations of a source (e.g. of MTAPI models)
+            is scored as the translations joined by spaces
+        :param refs: references; not supported yet
+        :return: scores, one per (source, mt) pair
+        """
+        assert not refs, f"Ref not supported and only QE models are supported at the moment" # future work
+        payload_log.debug("Eval '%s'; src:%s; mt:%s", model_name, sources, mts)
+        assert sources and mts, f"Source and mt are required"
+        assert len(sources) == len(mts), f"Source and mt must have the same length"
+        assert model_name in self.known_models,\
+            f"Unknown model {model_name}. Known models are {self.known_models}"
+        REQUESTS.inc(service='evaluator', model=model_name)
+        SENTENCES.inc(len(sources), service='evaluator', model=model_name)
+        mts = [mt if isinstance(mt, str) else ' '.join(mt) for mt in mts]  # pairs are cache keys
+        pairs = list(zip(sources, mts))
+        res = [self.score_cache.get(model_name, pair) for pair in pairs]
+        misses = [idx for idx, score in enumerate(res) if score is None]
+        if misses:
+            scores = self.get_batcher(model_name).process([pairs[idx] for idx in misses])
+            for idx, score in zip(misses, scores):
+                res[idx] = score
+                self.score_cache.put(model_name, pairs[idx], score)
+        return res
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Score cache statistics of each metric"""
+        return self.score_cache.stats()
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """Score cache statistics in Prometheus families; see instrumentation.py"""
+        return cache_families(self.cache_stats(), cache='scores')
+
+    def flush_cache(self, model_name: Optional[str] = None):
+        """Flush score cache of a metric; all metrics if model_name is None"""
+        self.score_cache.flush(model_name)
@@ -0,0 +1,268 @@
+"""
+In-process metrics exported in Prometheus text format.
+
+Metrics are kept in memory by the process that records them; no external service is needed.
+Worker processes send their metrics to the web front end, which labels them with the worker id.
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+# (name, type, help, samples); samples are (sample name, labels, value). Plain data, so it can be pickled
+MetricFamily = Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]
+
+DEF_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)  # items
+LOAD_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)  # seconds
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        assert len(labels) == len(
+            self.labelnames
+        ), f"{self.name} requires labels {self.labelnames}. Given: {labels}"
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self.lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self.values.items()]
+
+    def collect(self) -> MetricFamily:
+        return self.name, self.type, self.help, self._samples()
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=DEF_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)  # buckets are inclusive upper bounds
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]  # bucket counts, +Inf, sum
+            counts[idx] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, in seconds"""
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - st, **labels)
+
+    def _samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = []
+        with self.lock:
+            items = [(key, list(counts)) for key, counts in self.values.items()]
+        for key, counts in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((f'{self.name}_count', labels, cumulative))
+            samples.append((f'{self.name}_sum', labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Metrics of a process"""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            assert metric.name not in self.metrics, f"Metric {metric.name} is already registered"
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets=DEF_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets=buckets))
+
+    def collect(self) -> List[MetricFamily]:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return [metric.collect() for metric in metrics]
+
+
+def with_labels(families: Iterable[MetricFamily], **labels) -> List[MetricFamily]:
+    """Add labels to all samples, e.g. the id of the worker process they came from"""
+    return [
+        (name, mtype, help, [(sname, dict(slabels, **labels), value) for sname, slabels, value in samples])
+        for name, mtype, help, samples in families
+    ]
+
+
+def merge(*family_lists: Iterable[MetricFamily]) -> List[MetricFamily]:
+    """Merge samples of families with the same name; families are kept in the order they first appear"""
+    merged: Dict[str, MetricFamily] = {}
+    for families in family_lists:
+        for name, mtype, help, samples in families:
+            if name in merged:
+                merged[name][3].extend(samples)
+            else:
+                merged[name] = (name, mtype, help, list(samples))
+    return list(merged.values())
+
+
+def cache_families(stats: Dict[str, Dict[str, Any]], cache: str) -> List[MetricFamily]:
+    """Metric families of cache statistics
+
+    :param stats: statistics of each model's cache, as returned by TranslationCache.stats()
+    :param cache: name of the cache, e.g. translations or scores
+    """
+    fields = [
+        ('pymarian_cache_hits_total', 'counter', 'Cache hits', 'hits'),
+        ('pymarian_cache_misses_total', 'counter', 'Cache misses', 'misses'),
+        ('pymarian_cache_evictions_total', 'counter', 'Cache evictions', 'evictions'),
+        ('pymarian_cache_hit_ratio', 'gauge', 'Ratio of cache lookups that were hits', 'hit_ratio'),
+        ('pymarian_cache_entries', 'gauge', 'Entries in cache', 'entries'),
+        ('pymarian_cache_bytes', 'gauge', 'Estimated memory used by cache', 'bytes'),
+    ]
+    return [
+        (name, mtype, help, [(name, dict(cache=cache, model=model), s[field]) for model, s in stats.items()])
+        for name, mtype, help, field in fields
+    ]
+
+
+def queue_families(stats: Dict[str, Dict[str, Any]]) -> List[MetricFamily]:
+    """Metric families of model load
+
+    :param stats: load of each model, as returned by TranslatorService.queue_stats()
+    """
+    fields = [
+        ('pymarian_queue_depth', 'Sentences waiting to be batched', 'queue_depth'),
+        ('pymarian_replicas', 'Loaded replicas of model', 'replicas'),
+        ('pymarian_replicas_busy', 'Replicas decoding a batch', 'busy'),
+        ('pymarian_replicas_waiting', 'Batches waiting for a free replica', 'waiting'),
+    ]
+    return [
+        (name, 'gauge', help, [(name, dict(model=model), s[field]) for model, s in stats.items()])
+        for name, help, field in fields
+    ]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def render(families: Iterable[MetricFamily]) -> str:
+    """Prometheus text exposition of metric families"""
+    lines = []
+    for name, mtype, help, samples in families:
+        lines.append(f'# HELP {name} {_escape(help)}')
+        lines.append(f'# TYPE {name} {mtype}')
+        for sname, labels, value in samples:
+            if labels:
+                label_str = ','.join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+                lines.append(f'{sname}{{{label_str}}} {_format_value(value)}')
+            else:
+                lines.append(f'{sname} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    'pymarian_requests_total', 'Requests to translator and evaluator services', ['service', 'model']
+)
+SENTENCES = REGISTRY.counter(
+    'pymarian_sentences_total', 'Sentences sent to translator and evaluator services', ['service', 'model']
+)
+BATCH_SECONDS = REGISTRY.histogram(
+    'pymarian_batch_seconds', 'Latency of decoding (or scoring) a batch', ['service', 'model']
+)
+BATCH_SIZE = REGISTRY.histogram(
+    'pymarian_batch_size',
+    'Sentences per decoded (or scored) batch',
+    ['service', 'model'],
+    buckets=SIZE_BUCKETS,
+)
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    'pymarian_model_load_seconds', 'Time taken to load a model', ['service', 'model'], buckets=LOAD_BUCKETS
+)
+MTAPI_REQUEST_SECONDS = REGISTRY.histogram(
+    'pymarian_mtapi_request_seconds', 'Latency of MTAPI HTTP requests, by HTTP status or error', ['status']
+)
+MTAPI_RETRIES = REGISTRY.counter('pymarian_mtapi_retries_total', 'MTAPI requests that were retried')
+LIVE_SECONDS = REGISTRY.histogram(
+    'pymarian_live_seconds', 'Latency of Socket.IO live translation events', ['event', 'model']
+)
+REJECTED = REGISTRY.counter(
+    'pymarian_rejected_total', 'Requests rejected by admission control, by limit exceeded', ['reason']
+)
+ADMITTED_SENTENCES = REGISTRY.gauge(
+    'pymarian_admitted_sentences', 'Sentences of admitted requests that are not done yet', ['model']
+)
+LIVE_SUPERSEDED = REGISTRY.counter(
+    'pymarian_live_superseded_total',
+    'Live translation requests dropped for a newer one of the same client',
+    ['event'],
+)
@@ -0,0 +1,161 @@
+"""
+Scheduling of live translation requests off the Socket.IO event loop.
+
+A client that types fast sends requests faster than they are translated. Requests of each client are
+coalesced: only the newest pending request runs, and results of requests superseded while running are dropped.
+Requests run on a pool of threads, so a slow decode does not hold up the events of other clients. Their
+results are sent by the event loop (see Outbox): with eventlet and gevent, native threads must not use it.
+"""
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from . import log, timing
+from .constants import DEF_LIVE_DEBOUNCE_MS, DEF_LIVE_THREADS, LIVE_POLL_MS
+from .instrumentation import LIVE_SUPERSEDED
+
+
+def run_blocking(async_mode: str, fn: Callable, *args, **kwargs) -> Any:
+    """Run a blocking function (e.g. a decode) from a Socket.IO handler without blocking the event loop.
+    With eventlet and gevent, the function runs in a native thread while the handler yields; otherwise,
+    handlers already run in their own threads.
+
+    :param async_mode: async mode of the Socket.IO server
+    """
+    fn = timing.in_context(fn)  # phases are recorded in the timings of the handler's request
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+
+        return tpool.execute(fn, *args, **kwargs)
+    if async_mode.startswith('gevent'):
+        import gevent
+
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+
+class Outbox:
+    """Calls functions, e.g. socketio.emit, on the Socket.IO event loop for native threads such as those of
+    LiveScheduler. With eventlet and gevent, calls are queued and made by a background task of the server;
+    otherwise, they are made right away by the calling thread.
+    """
+
+    def __init__(self, socketio, poll_ms: float = LIVE_POLL_MS) -> None:
+        """
+        :param socketio: Socket.IO server
+        :param poll_ms: how often the background task checks for queued calls
+        """
+        self.socketio = socketio
+        self.poll = poll_ms / 1000
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.task = None
+        if socketio.async_mode == 'eventlet' or socketio.async_mode.startswith('gevent'):
+            self.task = socketio.start_background_task(self._run)
+
+    def call(self, fn: Callable, *args, **kwargs):
+        if self.task is None:
+            fn(*args, **kwargs)
+        else:
+            self.queue.put((fn, args, kwargs))
+
+    def _run(self):
+        while True:
+            try:
+                fn, args, kwargs = self.queue.get_nowait()  # a blocking get would block the event loop
+            except queue.Empty:
+                self.socketio.sleep(self.poll)
+                continue
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                log.exception(f"Call of {fn} from the outbox failed")
+
+
+class _Slot:
+    """Requests of a client"""
+
+    __slots__ = ('pending', 'running', 'latest')
+
+    def __init__(self) -> None:
+        self.pending = None  # (request id, fn, callback, event) of the newest request that has not started
+        self.running = False
+        self.latest = 0  # id of the newest request
+
+
+class LiveScheduler:
+    """Runs the newest request of each client on a thread pool; older pending requests are dropped"""
+
+    def __init__(self, threads: int = DEF_LIVE_THREADS, debounce_ms: float = DEF_LIVE_DEBOUNCE_MS) -> None:
+        """
+        :param threads: number of requests (of different clients) that run concurrently
+        :param debounce_ms: a request waits this long for a newer one from the same client before it runs
+        """
+        assert threads > 0, f"threads should be positive. Given: {threads}"
+        assert debounce_ms >= 0, f"debounce_ms should be non-negative. Given: {debounce_ms}"
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='live')
+        self.debounce = debounce_ms / 1000
+        self.slots: Dict[str, _Slot] = {}
+        self.lock = threading.Lock()
+        self.req_ids = itertools.count(1)
+
+    def submit(
+        self, client_id: str, fn: Callable[[], Any], callback: Callable[[int, Any], None], event='translate'
+    ) -> int:
+        """Schedule a request of a client; supersedes its earlier requests.
+
+        :param client_id: client (Socket.IO session) id
+        :param fn: does the work of the request
+        :param callback: receives the request id and the result of fn, unless the request was superseded;
+            runs on a thread of the pool, so it should send results with Outbox
+        :param event: name of the event, for metrics
+        :return: request id
+        """
+        req_id = next(self.req_ids)
+        with self.lock:
+            slot = self.slots.setdefault(client_id, _Slot())
+            if slot.pending is not None:
+                LIVE_SUPERSEDED.inc(event=event)
+            slot.pending = (req_id, fn, callback, event)
+            slot.latest = req_id
+            if slot.running:
+                return req_id  # picked up when the running request finishes
+            slot.running = True
+        self.executor.submit(self._drain, client_id, slot)
+        return req_id
+
+    def _drain(self, client_id: str, slot: _Slot):
+        """Runs requests of a client, newest first, until none is pending"""
+        while True:
+            if self.debounce:
+                time.sleep(self.debounce)  # newer requests replace the pending one meanwhile
+            with self.lock:
+                if slot.pending is None or self.slots.get(client_id) is not slot:
+                    slot.running = False
+                    return
+                req_id, fn, callback, event = slot.pending
+                slot.pending = None
+            try:
+                result = fn()
+            except Exception:
+                log.exception(f"Live request {req_id} of {client_id} failed")
+                continue
+            with self.lock:
+                superseded = slot.latest != req_id or self.slots.get(client_id) is not slot
+            if superseded:
+                LIVE_SUPERSEDED.inc(event=event)
+                continue
+            try:
+                callback(req_id, result)
+            except Exception:
+                log.exception(f"Could not deliver result of live request {req_id} to {client_id}")
+
+    def drop(self, client_id: str):
+        """Forget a client, e.g. when it disconnects; its pending and running requests are dropped"""
+        with self.lock:
+            self.slots.pop(client_id, None)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,256 @@
+"""
+Server-side state of live translation clients.
+
+Clients send edit deltas instead of the whole document; the server keeps the segmentation and translations of
+each client and re-segments and re-translates only the sentences affected by an edit.
+
+While a sentence is being typed, the words that its consecutive translations agree on are committed (local
+agreement): they are forced as prefix of later translations of the sentence, so they neither flicker nor get
+decoded again.
+"""
+import bisect
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from . import log
+from .constants import COMMIT_POLICIES, DEF_COMMIT_POLICY, DEF_FLICKER_SIZE
+
+
+@dataclass
+class Segment:
+    start: int  # char offset of the segment in the session text
+    end: int
+    source: str
+    target: Optional[str] = None
+    committed: str = ''  # prefix of target that is final while the source only grows
+
+    @property
+    def final(self) -> bool:
+        """The whole translation is committed"""
+        return self.target is not None and self.committed == self.target
+
+
+def locate_sentences(text: str, sentences: List[str], offset: int = 0) -> List[Segment]:
+    """Find char offsets of sentences in text. The sentence splitter normalizes whitespace, so the search
+    tolerates any whitespace between tokens. Empty sentences (blank lines between paragraphs) are kept as
+    segments of the next line, with an empty translation, so that segments match those of other requests.
+
+    :param text: text that was split
+    :param sentences: sentences, in order
+    :param offset: offset added to positions, for when text is a substring of a larger text
+    :return: segments with positions
+    """
+    segments = []
+    cursor = 0
+    for sent in sentences:
+        tokens = sent.split()
+        if not tokens:
+            newline = text.find('\n', cursor)
+            start = newline + 1 if newline >= 0 else cursor
+            end = text.find('\n', start)
+            end = len(text) if end < 0 else end
+            segments.append(Segment(start + offset, end + offset, source=sent, target='', committed=''))
+            cursor = end
+            continue
+        pattern = r'\s+'.join(re.escape(tok) for tok in tokens)
+        match = re.compile(pattern).search(text, cursor)
+        if match:
+            start, end = match.start(), match.end()
+        else:  # should not happen; fallback to an approximation
+            log.warning(f"Could not locate sentence '{sent}' in text")
+            start, end = cursor, min(len(text), cursor + len(sent))
+        segments.append(Segment(start=start + offset, end=end + offset, source=sent))
+        cursor = end
+    return segments
+
+
+class LiveSession:
+    """Text, segmentation and translations of a live translation client"""
+
+    def __init__(self, service, model_name: str) -> None:
+        """
+        :param service: translator service; used for sentence splitting and (force) decoding
+        :param model_name: model name
+        """
+        self.service = service
+        self.model_name = model_name
+        self.text = ''
+        self.segments: List[Segment] = []
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def reset(
+        self,
+        source: str,
+        model_name: Optional[str] = None,
+        flicker_size=DEF_FLICKER_SIZE,
+        commit_policy=DEF_COMMIT_POLICY,
+    ) -> Dict:
+        """Replace the whole text; all segments are translated again
+
+        :return: splice of target segments; see `_update`
+        """
+        with self.lock:
+            if model_name:
+                self.model_name = model_name
+            self.text = ''
+            self.segments = []
+            return self._update(source, flicker_size=flicker_size, commit_policy=commit_policy)
+
+    def apply_edits(
+        self, edits: List[Dict], version: int, flicker_size=DEF_FLICKER_SIZE, commit_policy=DEF_COMMIT_POLICY
+    ) -> Dict:
+        """Apply edits to the text and translate the affected sentences.
+
+        :param edits: list of dict(offset=int, delete=int, insert=str); applied in the given order
+            and each offset refers to the text after the previous edits. Offsets and lengths count code
+            points (not e.g. UTF-16 units of JavaScript strings)
+        :param version: version of the session the edits are based on
+        :param flicker_size: number of tokens removed from the previous translation of a changed sentence
+           before it is used as prefix for force decoding. With the agreement policy, used only when
+           a sentence is edited other than at its end
+        :param commit_policy: agreement or flicker; see constants.COMMIT_POLICIES
+        :return: splice of target segments; see `_update`
+        :raises ValueError: when the edits do not apply to the current version of the session
+        """
+        with self.lock:
+            if version != self.version:
+                raise ValueError(f"Edits are based on version {version}, but session is at version {self.version}")
+            text = self.text
+            for edit in edits:
+                offset, delete, insert = edit.get('offset', 0), edit.get('delete', 0), edit.get('insert', '')
+                if not (
+                    isinstance(offset, int) and isinstance(delete, int) and isinstance(insert, str)
+                    and 0 <= offset <= len(text) and 0 <= delete <= len(text) - offset
+                ):
+                    raise ValueError(f"Invalid edit {edit} for text of length {len(text)}")
+                text = text[:offset] + insert + text[offset + delete :]
+            return self._update(text, flicker_size=flicker_size, commit_policy=commit_policy)
+
+    def _update(self, text: str, flicker_size: int, commit_policy: str) -> Dict:
+        """Re-segment and re-translate the region of text that changed. Caller must hold the lock.
+
+        :return: dict(version=int, start=int, delete=int, segments=[[source, target], ...]):
+            replace `delete` segments starting at index `start` with `segments`
+        """
+        old_text, old_segs = self.text, self.segments
+        # the changed region: [prefix_len, len - suffix_len) in both old and new texts
+        max_common = min(len(old_text), len(text))
+        prefix_len = 0
+        while prefix_len < max_common and old_text[prefix_len] == text[prefix_len]:
+            prefix_len += 1
+        suffix_len = 0
+        while suffix_len < max_common - prefix_len and old_text[-1 - suffix_len] == text[-1 - suffix_len]:
+            suffix_len += 1
+        old_edit_end = len(old_text) - suffix_len
+        shift = len(text) - len(old_text)
+
+        # affected segments [first, last], including a neighbor on each side as boundaries may move
+        n = len(old_segs)
+        first = max(0, bisect.bisect_left([seg.end for seg in old_segs], prefix_len) - 1)
+        last = min(n - 1, bisect.bisect_right([seg.start for seg in old_segs], old_edit_end))
+        # the region starts and ends at a sentence: blank lines at its ends would not make empty sentences
+        while first > 0 and not old_segs[first].source:
+            first -= 1
+        while last < n - 1 and not old_segs[last].source:
+            last += 1
+        if n == 0:
+            first, last = 0, -1
+            region_start, region_end = 0, len(text)
+        else:
+            region_start = min(old_segs[first].start, prefix_len)
+            if last == n - 1:
+                region_end = len(text)
+            else:
+                region_end = max(old_segs[last].end, old_edit_end) + shift
+
+        region = text[region_start:region_end]
+        region_sents = self.service.sentence_split(region, self.model_name)
+        new_segs = locate_sentences(region, region_sents, offset=region_start)
+
+        # reuse translations of sentences that did not change; others get prior translation as prefix
+        assert commit_policy in COMMIT_POLICIES, f"Unknown commit policy {commit_policy}."
+        tokenizer = self.service.tokenizer(self.model_name)
+        replaced = old_segs[first : last + 1]
+        prior_by_source = {seg.source: seg for seg in replaced if seg.target is not None}
+        prior_by_start = {
+            seg.start: seg for seg in replaced if seg.target is not None and seg.start < prefix_len
+        }
+        is_last = region_end == len(text)  # the last new segment is the last of the text
+        fresh_segs, prefixes, grown_from = [], [], []
+        for idx, seg in enumerate(new_segs):
+            if not seg.source:
+                continue  # blank line
+            prior = prior_by_source.get(seg.source)
+            if prior:
+                seg.target = prior.target
+                # a sentence that is followed by another one is complete; its translation is final
+                followed = idx < len(new_segs) - 1 or not is_last
+                seg.committed = prior.target if followed else prior.committed
+                continue
+            prior = prior_by_start.get(seg.start)
+            if prior and commit_policy == 'agreement' and seg.source.startswith(prior.source):
+                prefixes.append(prior.committed or None)  # the source grew at its end
+            elif prior:
+                prefixes.append(tokenizer.trim(prior.target, flicker_size) or None)
+                prior = None  # edited other than at its end; its commitment no longer holds
+            else:
+                prefixes.append(None)
+            fresh_segs.append(seg)
+            grown_from.append(prior)
+        if fresh_segs:
+            outputs = self.service.force_decode_batch(
+                self.model_name, [seg.source for seg in fresh_segs], prefixes
+            )
+            for seg, prior, out in zip(fresh_segs, grown_from, outputs):
+                seg.target = out
+                if prior:  # commit what the previous and this translation agree on
+                    agreed = tokenizer.common_prefix(prior.target, out)
+                    seg.committed = agreed if len(agreed) >= len(prior.committed) else prior.committed
+
+        for seg in old_segs[last + 1 :]:
+            seg.start += shift
+            seg.end += shift
+        self.segments = old_segs[:first] + new_segs + old_segs[last + 1 :]
+        self.text = text
+        self.version += 1
+        return dict(
+            version=self.version,
+            start=first,
+            delete=len(replaced),
+            segments=[[seg.source, seg.target] for seg in new_segs],
+        )
+
+    @property
+    def source_segments(self) -> List[str]:
+        return [seg.source for seg in self.segments]
+
+    @property
+    def target_segments(self) -> List[str]:
+        return [seg.target for seg in self.segments]
+
+
+class LiveSessions:
+    """Live translation sessions keyed by client (Socket.IO session) id"""
+
+    def __init__(self) -> None:
+        self.sessions: Dict[str, LiveSession] = {}
+        self.lock = threading.Lock()
+
+    def get(self, sid: str) -> Optional[LiveSession]:
+        with self.lock:
+            return self.sessions.get(sid)
+
+    def create(self, sid: str, service, model_name: str) -> LiveSession:
+        with self.lock:
+            session = self.sessions[sid] = LiveSession(service, model_name)
+            return session
+
+    def drop(self, sid: str):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def __len__(self):
+        return len(self.sessions)
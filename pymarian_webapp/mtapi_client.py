@@ -1,22 +1,92 @@
 #!/usr/bin/env python3
 """
 Queries the MSFT MTAPI interface.
+
+Large inputs are split into chunks that respect the service's per-request limits; chunks are sent concurrently
+over pooled connections, retried with backoff when throttled or on server errors, and results are reassembled
+in input order.
 """
 
 import os
+import random
+import time
 import uuid
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from . import log
+from .instrumentation import MTAPI_REQUEST_SECONDS, MTAPI_RETRIES
+
+DEF_ENDPOINT = "https://api.cognitive.microsofttranslator.com/translate"
+# per-request limits of the service; see https://learn.microsoft.com/en-us/azure/ai-services/translator/service-limits
+MAX_ELEMENTS = 1000
+MAX_CHARS = 50_000
+DEF_MAX_PARALLEL = 4  # concurrent requests per client
+DEF_TIMEOUT = (5, 30)  # seconds; connect and read timeouts
+DEF_MAX_RETRIES = 4
+DEF_BACKOFF = 0.5  # seconds; doubled on each retry
+MAX_BACKOFF = 30  # seconds
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class MTAPIError(Exception):
+    pass
+
+
+def make_chunks(texts: List[str], max_elements=MAX_ELEMENTS, max_chars=MAX_CHARS) -> List[Tuple[int, int]]:
+    """Split texts into chunks that respect per-request limits
+
+    :param texts: list of texts
+    :param max_elements: maximum number of texts per chunk
+    :param max_chars: maximum number of characters per chunk. A text longer than this makes its own chunk.
+    :return: list of [start, end) index ranges
+    """
+    chunks = []
+    start, n_chars = 0, 0
+    for idx, text in enumerate(texts):
+        if idx > start and (idx - start >= max_elements or n_chars + len(text) > max_chars):
+            chunks.append((start, idx))
+            start, n_chars = idx, 0
+        n_chars += len(text)
+    if start < len(texts):
+        chunks.append((start, len(texts)))
+    return chunks
 
 
 class MTAPIClient:
-    def __init__(self, srcLang="en", trgLang="de", region="eastus", subscription_key=None):
+    def __init__(
+        self,
+        srcLang="en",
+        trgLang="de",
+        region="eastus",
+        subscription_key=None,
+        endpoint=None,
+        max_parallel=DEF_MAX_PARALLEL,
+        max_elements=MAX_ELEMENTS,
+        max_chars=MAX_CHARS,
+        timeout=DEF_TIMEOUT,
+        max_retries=DEF_MAX_RETRIES,
+    ):
         self.srcLang = srcLang
         self.trgLang = trgLang
         self.region = os.environ.get("MTAPI_REGION", region)
         self.subscription_key = os.environ.get("MTAPI_SUBSCRIPTION_KEY", subscription_key)
-        self.endpoint = "https://api.cognitive.microsofttranslator.com/translate"
+        self.endpoint = endpoint or os.environ.get("MTAPI_ENDPOINT", DEF_ENDPOINT)
+        self.max_parallel = max_parallel
+        self.max_elements = max_elements
+        self.max_chars = max_chars
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        # connections are pooled and reused across requests; one connection per concurrent request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_parallel)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='mtapi')
 
     def get_headers(self):
         headers = {
@@ -28,24 +98,76 @@ class MTAPIClient:
 
         return headers
 
-    def translate(self, text: List[str]) -> List[str]:
-        """
-        Gets translation(s) for a list of sentences.
-        """
+    def get_params(self):
         params = {
             'api-version': '3.0',
             'to': [self.trgLang],
         }
         if self.srcLang is not None:
             params["from"] = self.srcLang
+        return params
 
-        body = [{'text': text} for text in text]
-        request = requests.post(self.endpoint, params=params, headers=self.get_headers(), json=body)
-        response = request.json()
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Delay before the next attempt: Retry-After header if given, else exponential backoff with jitter"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), MAX_BACKOFF)
+                except ValueError:
+                    pass
+        return min(DEF_BACKOFF * 2**attempt, MAX_BACKOFF) * random.uniform(0.5, 1)
 
-        translations = []
+    def _post(self, texts: List[str]) -> List[List[str]]:
+        """Translate a chunk of texts with a single request; retries on throttling, server and network errors"""
+        body = [{'text': text} for text in texts]
+        for attempt in range(self.max_retries + 1):
+            response, error = None, None
+            st = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.endpoint,
+                    params=self.get_params(),
+                    headers=self.get_headers(),
+                    json=body,
+                    timeout=self.timeout,
+                )
+                MTAPI_REQUEST_SECONDS.observe(time.perf_counter() - st, status=response.status_code)
+                if response.status_code not in RETRY_STATUS:
+                    break
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                MTAPI_REQUEST_SECONDS.observe(time.perf_counter() - st, status=type(e).__name__)
+                error = e
+            if attempt < self.max_retries:
+                MTAPI_RETRIES.inc()
+                delay = self._retry_delay(attempt, response)
+                log.warning(f"MTAPI request failed ({error}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+        else:
+            raise MTAPIError(f"MTAPI request failed after {self.max_retries + 1} attempts: {error}")
 
-        for sent in response:
+        if response.status_code != 200:
+            raise MTAPIError(f"MTAPI request failed with HTTP {response.status_code}: {response.text}")
+        translations = []
+        for sent in response.json():
             translations.append([translation["text"] for translation in sent["translations"]])
+        if len(translations) != len(texts):
+            raise MTAPIError(f"Expected {len(texts)} translations, but MTAPI returned {len(translations)}")
+        return translations
 
+    def translate(self, text: List[str]) -> List[str]:
+        """
+        Gets translation(s) for a list of sentences.
+        """
+        if not text:
+            return []
+        chunks = make_chunks(text, max_elements=self.max_elements, max_chars=self.max_chars)
+        if len(chunks) == 1:
+            return self._post(text)
+        log.info(f"Sending {len(text)} texts to MTAPI in {len(chunks)} chunks")
+        futures = [self.executor.submit(self._post, text[start:end]) for start, end in chunks]
+        translations = []
+        for future in futures:  # in input order
+            translations.extend(future.result())
         return translations
@@ -0,0 +1,97 @@
+"""
+Pipelined translation and QE scoring of a request.
+
+Sources are translated in chunks; as soon as a chunk is translated, it is scored with each metric, while later
+chunks are still being decoded. Metrics are independent models with their own batching schedulers, so they
+score in parallel. Latency of a request is then close to that of its slowest stage, rather than the sum of
+all stages.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from . import timing
+from .constants import DEF_PIPELINE_CHUNK_SIZE, DEF_PIPELINE_THREADS
+
+
+def merge_translations(parts: List[List[Dict]]) -> List[Dict]:
+    """Merge results of TranslatorService.translate() of consecutive chunks; list values are concatenated"""
+    merged = [dict(res) for res in parts[0]]
+    for part in parts[1:]:
+        for res, more in zip(merged, part):
+            for key, val in more.items():
+                if isinstance(val, list):
+                    res[key] = res[key] + val
+    return merged
+
+
+class Pipeline:
+    """Translates and scores requests on a shared thread pool. Tasks never wait on other tasks, so requests
+    cannot starve the pool of threads: a translated chunk submits its scoring tasks, and only callers wait.
+    """
+
+    def __init__(
+        self, transl_service, eval_service, threads=DEF_PIPELINE_THREADS, chunk_size=DEF_PIPELINE_CHUNK_SIZE
+    ) -> None:
+        """
+        :param transl_service: TranslatorService, or WorkerPool
+        :param eval_service: EvaluatorService
+        :param threads: chunks translated and scored concurrently, across requests
+        :param chunk_size: sentences per chunk
+        """
+        assert threads > 0, f"threads should be positive. Given: {threads}"
+        assert chunk_size > 0, f"chunk_size should be positive. Given: {chunk_size}"
+        self.transl_service = transl_service
+        self.eval_service = eval_service
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='pipeline')
+
+    def _translate_chunk(
+        self, model_name: str, sources: List[str], metrics: List[str]
+    ) -> Tuple[List[Dict], Dict[str, Future]]:
+        """Translate a chunk, and submit its scoring with each metric"""
+        translations = self.transl_service.translate(model_name, sources)
+        mts = translations[0]['outputs']
+        return translations, self._score(metrics, sources, mts)
+
+    def _score(self, metrics: List[str], sources: List[str], mts: List[str]) -> Dict[str, Future]:
+        evaluate = self.eval_service.evaluate
+        submit = self.executor.submit
+        return {metric: submit(timing.in_context(evaluate), metric, sources, mts) for metric in metrics}
+
+    def translate(
+        self, model_name: str, sources: List[str], metrics: List[str]
+    ) -> Tuple[List[Dict], Dict[str, List[float]]]:
+        """Translate sources and score translations with QE metrics
+
+        :param model_name: translation model
+        :param sources: source sentences
+        :param metrics: QE metrics; may be empty
+        :return: translations, as returned by TranslatorService.translate(), and scores of each metric
+        """
+        if not metrics:  # nothing to overlap with
+            return self.transl_service.translate(model_name, sources), {}
+        chunks = [sources[i : i + self.chunk_size] for i in range(0, len(sources), self.chunk_size)]
+        submit = self.executor.submit
+        translate_chunk = self._translate_chunk
+        futures = [submit(timing.in_context(translate_chunk), model_name, chunk, metrics) for chunk in chunks]
+        parts, scores = [], {metric: [] for metric in metrics}
+        try:
+            for future in futures:  # in input order
+                translations, scoring = future.result()
+                parts.append(translations)
+                for metric, scored in scoring.items():
+                    scores[metric].extend(scored.result())
+        finally:
+            for future in futures:
+                future.cancel()  # of chunks not started, if a chunk failed
+        return merge_translations(parts), scores
+
+    def evaluate(self, metrics: List[str], sources: List[str], mts: List[str]) -> Dict[str, List[float]]:
+        """Score (source, mt) pairs with metrics in parallel
+        :return: scores of each metric
+        """
+        futures = self._score(metrics, sources, mts)
+        return {metric: future.result() for metric, future in futures.items()}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
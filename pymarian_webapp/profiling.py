@@ -0,0 +1,81 @@
+"""
+Sampling profiler of a live process.
+
+Stacks of all threads are sampled at a fixed interval for a while, and counted as collapsed stacks: one line
+per distinct stack, `thread;outer_function;...;inner_function count`, the input format of flame graph tools
+such as flamegraph.pl and speedscope. Sampling costs little in the profiled threads, so it can run on a
+production server; native code (e.g. decoding in Marian) shows as the Python function that called it.
+With eventlet and gevent, greenlets that are not running are not sampled.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+from .constants import DEF_PROFILE_INTERVAL_MS, MAX_PROFILE_SECONDS
+
+_LOCK = threading.Lock()  # one profile at a time
+
+
+class ProfilerBusy(RuntimeError):
+    """Another profile of this process is running"""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f'{module}.{code.co_name}:{code.co_firstlineno}'
+
+
+def sample(seconds: float, interval_ms: float = DEF_PROFILE_INTERVAL_MS) -> Dict:
+    """Sample stacks of all threads of this process
+
+    :param seconds: duration of profiling; at most MAX_PROFILE_SECONDS
+    :param interval_ms: time between samples
+    :return: dict(seconds, interval_ms, samples, stacks={collapsed stack: count})
+    """
+    limit = MAX_PROFILE_SECONDS
+    assert 0 < seconds <= limit, f"seconds should be in (0, {limit}]. Given: {seconds}"
+    assert interval_ms > 0, f"interval_ms should be positive. Given: {interval_ms}"
+    if not _LOCK.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        frame_names: Dict = {}  # code object -> name; code objects live as long as their functions
+        n_samples, interval = 0, interval_ms / 1000
+        start = time.monotonic()
+        deadline = start + seconds
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    name = frame_names.get(frame.f_code)
+                    if name is None:
+                        name = frame_names[frame.f_code] = _frame_name(frame)
+                    stack.append(name)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                stacks[';'.join(reversed(stack))] += 1
+            n_samples += 1
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        return dict(
+            seconds=round(time.monotonic() - start, 3),
+            interval_ms=interval_ms,
+            samples=n_samples,
+            stacks=dict(stacks.most_common()),
+        )
+    finally:
+        _LOCK.release()
+
+
+def collapsed(profile: Dict) -> str:
+    """Text of a profile in collapsed stack format; see sample()"""
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].items())
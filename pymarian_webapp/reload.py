@@ -0,0 +1,108 @@
+"""
+Hot reload of the translators config.
+
+The config file is read again on SIGHUP or POST /admin/reload, and compared with the models being served.
+New and changed models are loaded and warmed up in the background, then swapped in at once. Removed models
+stop taking new requests, and are unloaded once the requests they already have are done. Unchanged models
+keep serving throughout, with their caches.
+"""
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import yaml
+
+from . import log
+from .constants import DEF_WARMUP_DECODES
+
+IDLE = 'idle'
+RELOADING = 'reloading'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def read_translators(path: Path) -> Dict[str, Dict]:
+    """Model configs of the `translators` section of a config file"""
+    with open(path, encoding='utf-8') as inp:
+        config = yaml.safe_load(inp) or {}
+    models = config.get('translators') or {}
+    assert isinstance(models, dict), f"translators should be a mapping of model names to configs in {path}"
+    for name, model in models.items():
+        assert isinstance(model, dict), f"Config of model {name} should be a mapping. Given: {model}"
+    return models
+
+
+def diff_models(old: Dict[str, Dict], new: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """Names of added, changed, removed and unchanged models of a new config; any changed key counts"""
+    return dict(
+        added=[name for name in new if name not in old],
+        changed=[name for name in new if name in old and new[name] != old[name]],
+        removed=[name for name in old if name not in new],
+        unchanged=[name for name in new if name in old and new[name] == old[name]],
+    )
+
+
+class ConfigReloader:
+    """Reloads the translators of a config file into a translator service, one reload at a time"""
+
+    def __init__(
+        self,
+        config_path: Optional[Path],
+        transl_service,
+        on_reload: Optional[Callable[[Dict[str, Dict], Dict[str, List[str]]], None]] = None,
+        n_decodes: int = DEF_WARMUP_DECODES,
+    ) -> None:
+        """
+        :param config_path: config file; None => reloads are refused
+        :param transl_service: TranslatorService, or WorkerPool
+        :param on_reload: called with the new model configs and their changes after they are swapped in
+        :param n_decodes: dummy decodes that warm up a model before it is swapped in
+        """
+        self.config_path = Path(config_path) if config_path else None
+        self.transl_service = transl_service
+        self.on_reload = on_reload
+        self.n_decodes = n_decodes
+        self.lock = threading.Lock()
+        self.state = dict(state=IDLE)
+
+    def trigger(self) -> bool:
+        """Start a reload in the background
+        :return: False if a reload is already running
+        """
+        with self.lock:
+            if self.state['state'] == RELOADING:
+                return False
+            self.state = dict(state=RELOADING, started_at=time.time())
+        threading.Thread(target=self.run, name='config-reload', daemon=True).start()
+        return True
+
+    def run(self):
+        started_at = self.state.get('started_at', time.time())
+        try:
+            assert self.config_path, "No config file to reload; the server was not started with --config"
+            log.info(f"Reloading translators of {self.config_path}")
+            models = read_translators(self.config_path)
+            changes = self.transl_service.reload(models, n_decodes=self.n_decodes)
+            if self.on_reload:
+                self.on_reload(models, changes)
+        except Exception as e:
+            log.exception("Reloading translators failed; models being served are unchanged")
+            state = dict(state=FAILED, error=f'{type(e).__name__}: {e}')
+        else:
+            log.info(f"Reloaded translators: {changes}")
+            state = dict(state=DONE, changes=changes)
+        with self.lock:
+            self.state = dict(state, started_at=started_at, secs=round(time.time() - started_at, 3))
+
+    def status(self) -> Dict:
+        with self.lock:
+            return dict(self.state)
+
+    def install_signal(self, signum: int = signal.SIGHUP):
+        """Reload on a signal. Only the main thread of a process can install signal handlers"""
+        if threading.current_thread() is not threading.main_thread():
+            log.warning("Config reload on signal is not installed; not in the main thread")
+            return
+        signal.signal(signum, lambda *_: self.trigger())
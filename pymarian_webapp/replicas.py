@@ -0,0 +1,56 @@
+"""
+Pool of replicas of a model, for decoding batches in parallel within one process.
+
+A Marian translator decodes one batch at a time; a hot model can use more cores by loading several replicas,
+each with its own share of CPU threads. Each call is handed to a free replica; callers wait when all are busy.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+
+class ReplicaPool:
+    """Dispatches calls to the least recently used free replica; has the same translate() as a replica"""
+
+    def __init__(self, replicas: List[Any]) -> None:
+        """
+        :param replicas: translators, or any objects with translate(sources, **kwargs)
+        """
+        assert replicas, "At least one replica is required"
+        self.replicas = list(replicas)
+        self.idle = deque(range(len(self.replicas)))  # free replicas; least recently used first
+        self.cond = threading.Condition()
+        self.waiting = 0  # callers waiting for a free replica
+        self.calls = [0] * len(self.replicas)
+        self.busy_secs = [0.0] * len(self.replicas)
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def translate(self, sources: List[str], **kwargs) -> List[str]:
+        with self.cond:
+            self.waiting += 1
+            while not self.idle:
+                self.cond.wait()
+            self.waiting -= 1
+            idx = self.idle.popleft()
+        st = time.perf_counter()
+        try:
+            return self.replicas[idx].translate(sources, **kwargs)
+        finally:
+            with self.cond:
+                self.calls[idx] += 1
+                self.busy_secs[idx] += time.perf_counter() - st
+                self.idle.append(idx)
+                self.cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return dict(
+                replicas=len(self.replicas),
+                busy=len(self.replicas) - len(self.idle),
+                waiting=self.waiting,
+                calls=list(self.calls),
+                busy_secs=[round(secs, 3) for secs in self.busy_secs],
+            )
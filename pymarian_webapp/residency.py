@@ -0,0 +1,132 @@
+"""
+Keeps loaded models within a memory budget.
+
+Services register the models they load with a ResidencyManager, along with an estimated memory cost and a callback
+to unload the model. When loading a model would exceed the budget, the least recently used models are unloaded.
+Models that have not been used for a while can also be unloaded.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from . import log
+from .constants import DEF_IDLE_TIMEOUT, DEF_MEMORY_BUDGET, WORKSPACE_MEMORY
+
+MIN_REAP_INTERVAL = 1  # seconds
+MAX_REAP_INTERVAL = 60  # seconds
+
+
+def estimate_cost(model_path: Optional[Union[str, Path]] = None, workspace: int = WORKSPACE_MEMORY) -> float:
+    """Estimated memory (MB) of a Marian model: its workspace plus the size of its parameters
+
+    :param model_path: path to model file; its size approximates the size of parameters in memory
+    :param workspace: workspace memory in MB
+    """
+    cost = workspace
+    if model_path and Path(model_path).is_file():
+        cost += Path(model_path).stat().st_size / 2**20
+    return cost
+
+
+@dataclass
+class Resident:
+    name: str
+    cost: float  # MB
+    unload: Callable[[], None] = field(repr=False)
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+
+
+class ResidencyManager:
+    """Tracks loaded models and unloads them to stay within a memory budget"""
+
+    def __init__(self, budget: float = DEF_MEMORY_BUDGET, idle_timeout: float = DEF_IDLE_TIMEOUT) -> None:
+        """
+        :param budget: memory budget in MB for all models; 0 => unlimited
+        :param idle_timeout: unload models that are not used for these many seconds; 0 => never
+        """
+        self.budget = budget
+        self.idle_timeout = idle_timeout
+        self.residents: OrderedDict[str, Resident] = OrderedDict()  # in least recently used first order
+        self.lock = threading.RLock()
+        self.reaper = None
+        if idle_timeout > 0:
+            self.reaper = threading.Thread(target=self._reap, name='model-reaper', daemon=True)
+            self.reaper.start()
+
+    @property
+    def used(self) -> float:
+        return sum(res.cost for res in self.residents.values())
+
+    def admit(self, name: str, cost: float, unload: Callable[[], None]):
+        """Register a model that is about to be loaded; unloads least recently used models to make room
+
+        :param name: unique name of the model, e.g. translator:en-de
+        :param cost: estimated memory in MB
+        :param unload: callback that unloads the model
+        """
+        with self.lock:
+            self.residents.pop(name, None)
+            if self.budget > 0:
+                while self.residents and self.used + cost > self.budget:
+                    victim = next(iter(self.residents))
+                    log.info(f"Unloading {victim} to make room for {name} within memory budget of {self.budget}MB")
+                    self.evict(victim)
+                if cost > self.budget:
+                    log.warning(f"Model {name} needs {cost:.0f}MB which exceeds memory budget of {self.budget}MB")
+            self.residents[name] = Resident(name=name, cost=cost, unload=unload)
+
+    def touch(self, name: str):
+        """Mark a model as recently used"""
+        with self.lock:
+            res = self.residents.get(name)
+            if res:
+                res.last_used = time.time()
+                self.residents.move_to_end(name)
+
+    def evict(self, name: str, idle_since: Optional[float] = None):
+        """Unload a model
+
+        :param name: model name
+        :param idle_since: if given, unload only if the model was not used after this time
+        """
+        with self.lock:
+            res = self.residents.get(name)
+            if res and (idle_since is None or res.last_used < idle_since):
+                self.residents.pop(name)
+            else:
+                res = None
+        if res:
+            try:
+                res.unload()
+            except Exception as e:
+                log.warning(f"Failed to unload {name}: {e}")
+
+    def discard(self, name: str):
+        """Forget a model that was unloaded by its owner"""
+        with self.lock:
+            self.residents.pop(name, None)
+
+    def resident(self, prefix: str = '') -> List[Dict]:
+        """Resident models whose name starts with prefix; least recently used first"""
+        now = time.time()
+        with self.lock:
+            return [
+                dict(name=res.name, memory_mb=round(res.cost), idle_secs=round(now - res.last_used))
+                for res in self.residents.values()
+                if res.name.startswith(prefix)
+            ]
+
+    def _reap(self):
+        interval = min(max(self.idle_timeout / 2, MIN_REAP_INTERVAL), MAX_REAP_INTERVAL)
+        while True:
+            time.sleep(interval)
+            cutoff = time.time() - self.idle_timeout
+            with self.lock:
+                idle = [res.name for res in self.residents.values() if res.last_used < cutoff]
+            for name in idle:
+                log.info(f"Unloading {name}; idle for more than {self.idle_timeout}s")
+                self.evict(name, idle_since=cutoff)
@@ -0,0 +1,126 @@
+"""
+Sentence segmentation shared by all services of a process.
+
+Splitters are created once per language, and sentences of recently seen paragraphs are cached, so that
+re-segmenting a text that changed in one place (e.g. on every keystroke of live translation) only splits
+the paragraph that changed.
+"""
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Union
+
+from . import log, timing
+from .cache import TranslationCache
+from .constants import DEF_LANGUAGE, DEF_SEGMENT_CACHE_BYTES
+
+if TYPE_CHECKING:
+    import sentence_splitter
+
+
+def model_language(model: Optional[Dict]) -> str:
+    """Source language of a model config, for sentence splitting: `language`, or `source-language` of MTAPI models
+
+    :param model: model config
+    :return: language code, e.g. 'en' for 'en-US'
+    """
+    lang = (model or {}).get("language") or (model or {}).get("source-language") or DEF_LANGUAGE
+    return lang.replace("_", "-").split("-")[0].lower()
+
+
+def iter_paragraphs(text: str) -> Iterator[str]:
+    """Lines of text, without copying the text into a list first"""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+class Segmenter:
+    """Sentence splitters of each language, with a bounded cache of the sentences of each paragraph"""
+
+    def __init__(self, max_bytes: int = DEF_SEGMENT_CACHE_BYTES) -> None:
+        """
+        :param max_bytes: memory budget of the cache of each language, in bytes; 0 => no cache
+        """
+        self.splitters: Dict[str, 'sentence_splitter.SentenceSplitter'] = {}
+        self.lock = threading.RLock()  # reentrant: unsupported languages take the splitter of the default one
+        self.max_bytes = max_bytes
+        self.cache = TranslationCache(max_bytes=max_bytes, ttl=0)  # keyed by language, then paragraph
+
+    def get_splitter(self, language: str = DEF_LANGUAGE) -> 'sentence_splitter.SentenceSplitter':
+        """Splitter of a language; created on first use. Unsupported languages fall back to the default language"""
+        splitter = self.splitters.get(language)
+        if splitter is not None:
+            return splitter
+        import sentence_splitter
+
+        with self.lock:
+            if language not in self.splitters:
+                log.info(f"Creating sentence splitter for language '{language}'")
+                try:
+                    self.splitters[language] = sentence_splitter.SentenceSplitter(language=language)
+                except sentence_splitter.SentenceSplitterException as e:
+                    assert language != DEF_LANGUAGE, f"Could not create sentence splitter: {e}"
+                    log.warning(f"{e}. Using sentence splitter of '{DEF_LANGUAGE}' for '{language}'")
+                    self.splitters[language] = self.get_splitter(DEF_LANGUAGE)
+            return self.splitters[language]
+
+    def split_paragraph(self, paragraph: str, language: str = DEF_LANGUAGE, cache=True) -> List[str]:
+        """Sentences of a paragraph (i.e. text without line breaks)
+
+        :param cache: look up and store the result in cache
+        """
+        use_cache = cache and self.max_bytes > 0
+        if use_cache:
+            sentences = self.cache.get(language, paragraph)
+            if sentences is not None:
+                return list(sentences)
+        sentences = self.get_splitter(language).split(paragraph)
+        if use_cache:
+            self.cache.put(language, paragraph, tuple(sentences))
+        return sentences
+
+    def iter_split(
+        self, text: Union[str, Iterable[str]], language: str = DEF_LANGUAGE, cache=True
+    ) -> Iterator[str]:
+        """Split text into sentences lazily, paragraph by paragraph.
+        Same sentences as SentenceSplitter.split() of the whole text: a blank line between paragraphs makes an
+        empty sentence; blank lines at start and end make none.
+
+        :param text: text, or its lines
+        :param language: language code
+        :param cache: cache the sentences of each paragraph; disable for large documents read only once
+        :return: sentences
+        """
+        if isinstance(text, str) and not text:
+            return
+        lines = iter_paragraphs(text) if isinstance(text, str) else text
+        started, blanks = False, 0
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.strip():
+                blanks += started  # emitted only if followed by more text
+                continue
+            yield from [""] * blanks
+            started, blanks = True, 0
+            yield from self.split_paragraph(line, language, cache=cache)
+        if not started and isinstance(text, str):
+            yield ""  # text of whitespace only
+
+    def split(self, text: str, language: str = DEF_LANGUAGE, cache=True) -> List[str]:
+        """Split text into sentences; see iter_split"""
+        with timing.phase('split'):
+            return list(self.iter_split(text, language, cache=cache))
+
+    def stats(self) -> Dict[str, Dict]:
+        """Cache statistics of each language"""
+        return self.cache.stats()
+
+    def flush(self):
+        self.cache.flush()
+
+
+SEGMENTER = Segmenter()  # shared by services of this process
@@ -0,0 +1,106 @@
+"""
+Serialization of responses.
+
+Results are prepared in one pass: floats (e.g. QE scores) are rounded, and lists of strings, such as sources
+and translations, are passed through without being copied. JSON is encoded by orjson when it is installed.
+Clients that send `Accept: application/msgpack` get MessagePack, if the msgpack package is installed; large
+responses are gzipped for clients that accept it.
+"""
+import gzip
+import json
+from typing import Any, Tuple
+
+import flask
+from werkzeug.datastructures import Accept, MIMEAccept
+
+from . import log, timing
+from .constants import DEF_GZIP_LEVEL, DEF_GZIP_MIN_BYTES, FLOAT_POINTS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+_PLAIN_TYPES = {str, int, bool, type(None)}  # JSON values that need no preparation
+
+
+def round_floats(obj: Any, ndigits: int = FLOAT_POINTS) -> Any:
+    """Prepare a result for serialization: round floats, and convert tuples and arrays to lists.
+    Lists are checked by the types of their items at once: lists of strings are returned as they are, and
+    lists of floats (e.g. scores) are rounded in bulk.
+
+    :param obj: result made of dicts, lists, and JSON values
+    :param ndigits: digits of floats after the decimal point
+    :return: obj, or a copy of its parts that needed to change
+    """
+    if isinstance(obj, float):
+        return round(obj, ndigits)
+    if obj is None or isinstance(obj, (str, int)):
+        return obj
+    if isinstance(obj, dict):
+        return {key: round_floats(val, ndigits) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        types = set(map(type, obj))
+        if types <= _PLAIN_TYPES:
+            return obj if isinstance(obj, list) else list(obj)
+        if types == {float}:
+            return [round(val, ndigits) for val in obj]
+        return [round_floats(val, ndigits) for val in obj]
+    if hasattr(obj, 'tolist'):  # numpy arrays and scalars
+        return round_floats(obj.tolist(), ndigits)
+    log.warning(f"Type {type(obj)} maybe not be json serializable")
+    return obj
+
+
+def dumps_json(obj: Any) -> bytes:
+    """JSON of a prepared result, as UTF-8 bytes; see round_floats()"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def negotiate(accept: MIMEAccept) -> str:
+    """Response mimetype: MessagePack if the client prefers it and msgpack is installed; otherwise JSON"""
+    if msgpack is None:
+        return JSON_TYPE
+    best = accept.best_match((JSON_TYPE,) + MSGPACK_TYPES, default=JSON_TYPE)
+    return MSGPACK_TYPE if best in MSGPACK_TYPES else JSON_TYPE
+
+
+def encode(obj: Any, mimetype: str = JSON_TYPE) -> bytes:
+    """Serialize a result in the given mimetype; floats are rounded"""
+    obj = round_floats(obj)
+    if mimetype == MSGPACK_TYPE:
+        return msgpack.packb(obj, use_bin_type=True)
+    return dumps_json(obj)
+
+
+def compress(
+    body: bytes, accept_encodings: Accept, min_bytes: int = DEF_GZIP_MIN_BYTES
+) -> Tuple[bytes, bool]:
+    """Gzip a body of at least min_bytes if the client accepts gzip; 0 min_bytes => never
+
+    :return: body, and whether it was compressed
+    """
+    if min_bytes <= 0 or len(body) < min_bytes or not accept_encodings['gzip']:
+        return body, False
+    return gzip.compress(body, compresslevel=DEF_GZIP_LEVEL), True
+
+
+def respond(obj: Any, status: int = 200) -> flask.Response:
+    """Response of a result to the current request, in the format negotiated by its Accept headers"""
+    mimetype = negotiate(flask.request.accept_mimetypes)
+    with timing.phase('serialize'):
+        body, compressed = compress(encode(obj, mimetype), flask.request.accept_encodings)
+    response = flask.Response(body, status=status, mimetype=mimetype)
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
@@ -0,0 +1,75 @@
+"""
+Incremental translation of large documents.
+
+Documents are read line by line, segmented lazily and translated in bounded chunks, so memory use does not grow
+with document size and results are available as soon as each chunk is done.
+"""
+import io
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from .constants import DEF_STREAM_CHUNK_SIZE
+
+
+def iter_lines(stream, encoding='utf-8') -> Iterator[str]:
+    """Iterate lines of a binary or text stream without reading it all"""
+    if isinstance(stream, io.TextIOBase):
+        yield from stream
+        return
+    for line in stream:
+        yield line.decode(encoding, errors='replace') if isinstance(line, bytes) else line
+
+
+def iter_sentences(lines: Iterable[str], split_fn: Callable[[str], List[str]]) -> Iterator[Tuple[int, str]]:
+    """Sentence-split lines lazily
+
+    :param lines: lines (paragraphs) of a document
+    :param split_fn: sentence splitter
+    :return: (line index, sentence) pairs; empty lines produce nothing
+    """
+    for line_idx, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        for sent in split_fn(line):
+            if sent:
+                yield line_idx, sent
+
+
+def _call(fn: Callable, *args, **kwargs) -> Any:
+    return fn(*args, **kwargs)
+
+
+def translate_stream(
+    service,
+    model_name: str,
+    lines: Iterable[str],
+    chunk_size: int = DEF_STREAM_CHUNK_SIZE,
+    run: Callable[..., Any] = _call,
+) -> Iterator[Dict]:
+    """Translate a document in chunks of sentences
+
+    :param service: translator service
+    :param model_name: model name
+    :param lines: lines of the document; consumed lazily
+    :param chunk_size: number of sentences translated at once
+    :param run: calls the translation of a chunk with its args, e.g. off the event loop of the server
+    :return: records of dict(line=int, source=str, translation=str), in document order
+    """
+    assert chunk_size > 0, f"chunk_size should be positive. Given: {chunk_size}"
+    chunk: List[Tuple[int, str]] = []
+
+    def flush():
+        outputs = run(service.translate, model_name, [sent for _, sent in chunk])[0]['outputs']
+        for (line_idx, sent), output in zip(chunk, outputs):
+            yield dict(line=line_idx, source=sent, translation=output)
+        chunk.clear()
+
+    # documents are read once; their paragraphs would only evict others from the segmentation cache
+    split_fn = partial(service.sentence_split, model_name=model_name, cache=False)
+    for item in iter_sentences(lines, split_fn):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield from flush()
+    if chunk:
+        yield from flush()
@@ -0,0 +1,100 @@
+"""
+Phase timing of requests, reported in Server-Timing headers.
+
+A request collects the spans of its phases (e.g. sentence splitting, model loading, decoding, QE scoring) in
+a Timings object that is held in a context variable, so services record their phases with `phase()` without
+passing it around. Work done on other threads is attributed to the request: thread pools run tasks in a copy
+of the caller's context (see `in_context`), batching schedulers add the spans of a batch to every request in
+it, and worker processes send their spans back with results.
+
+Phases may overlap, e.g. when chunks are translated in parallel: the time of a phase is the wall time when at
+least one of its spans was running, so it is never more than the time of the request.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Span = Tuple[str, float, float]  # phase, start, end; time.monotonic() seconds, which forked processes share
+
+_CURRENT: ContextVar[Optional['Timings']] = ContextVar('pymarian_timings', default=None)
+
+
+class Timings:
+    """Spans of the phases of a request; safe to add to from several threads"""
+
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float):
+        with self.lock:
+            self.spans.append((name, start, end))
+
+    def extend(self, spans: List[Span]):
+        with self.lock:
+            self.spans.extend(spans)
+
+    def durations(self) -> Dict[str, float]:
+        """Milliseconds of each phase, in the order phases started, and `total` since the start"""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        busy: Dict[str, List[float]] = {}  # phase -> [time, end of last span]
+        for name, start, end in spans:
+            if name not in busy:
+                busy[name] = [end - start, end]
+                continue
+            acc = busy[name]
+            if end > acc[1]:
+                acc[0] += end - max(start, acc[1])
+                acc[1] = end
+        res = {name: round(acc[0] * 1000, 2) for name, acc in busy.items()}
+        res['total'] = round((time.monotonic() - self.start) * 1000, 2)
+        return res
+
+    def header(self, durations: Optional[Dict[str, float]] = None) -> str:
+        """Value of a Server-Timing header, e.g. `decode;dur=12.5, total;dur=14.1`"""
+        durations = durations or self.durations()
+        return ', '.join(f'{name};dur={dur}' for name, dur in durations.items())
+
+
+def current() -> Optional[Timings]:
+    """Timings of the request being handled; None if it does not collect them"""
+    return _CURRENT.get()
+
+
+@contextmanager
+def collect(timings: Optional[Timings] = None) -> Iterator[Timings]:
+    """Collect the phases recorded in the block, and in tasks it hands to other threads with `in_context`"""
+    timings = timings or Timings()
+    token = _CURRENT.set(timings)
+    try:
+        yield timings
+    finally:
+        _CURRENT.reset(token)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Record the block as a span of a phase of the current request; does nothing if there is none"""
+    timings = _CURRENT.get()
+    if timings is None:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        timings.add(name, start, time.monotonic())
+
+
+def in_context(fn: Callable) -> Callable:
+    """fn bound to a copy of the current context, so that it records phases of the current request when run
+    on another thread, e.g. `executor.submit(in_context(fn), *args)`. The result is meant to be called once
+    """
+    if _CURRENT.get() is None:
+        return fn
+    ctx = copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
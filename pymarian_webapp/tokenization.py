@@ -0,0 +1,99 @@
+"""
+Subword tokenization of translations, for trimming them at token boundaries in live translation.
+
+Targets are split with the SentencePiece model of the translator's vocab, so that trimming counts the same
+tokens as the model does. The `sentencepiece` package is optional; without it, or for models without a
+SentencePiece vocab (e.g. MTAPI), whitespace tokens are used.
+"""
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from . import log
+
+WORD_START = '▁'  # SentencePiece marker of a piece that starts a word
+
+
+def vocab_path(model: Dict) -> Optional[Path]:
+    """Path to the vocab of a Marian model config; None for other model types"""
+    if model.get("type", "base") != "base" or "model" not in model:
+        return None
+    return Path(model["vocab"]) if "vocab" in model else Path(model["model"]).parent / "vocab.spm"
+
+
+class Tokenizer:
+    """SentencePiece pieces of text, or whitespace tokens if no SentencePiece model is given"""
+
+    def __init__(self, spm_path: Optional[Path] = None) -> None:
+        self.spm = None
+        if spm_path:
+            import sentencepiece
+
+            self.spm = sentencepiece.SentencePieceProcessor(model_file=str(spm_path))
+
+    def tokenize(self, text: str) -> List[str]:
+        if self.spm is None:
+            return text.split()
+        return self.spm.encode(text, out_type=str)
+
+    def detokenize(self, tokens: List[str]) -> str:
+        if self.spm is None:
+            return " ".join(tokens)
+        return self.spm.decode(tokens)
+
+    def _starts_word(self, token: str) -> bool:
+        return self.spm is None or token.startswith(WORD_START)
+
+    def _word_boundary(self, tokens: List[str], n: int) -> int:
+        """Largest i <= n such that tokens[:i] does not end in the middle of a word"""
+        while 0 < n < len(tokens) and not self._starts_word(tokens[n]):
+            n -= 1
+        return n
+
+    def trim(self, text: str, n_tokens: int) -> str:
+        """Remove n_tokens tokens from the end of text, and the rest of a word that would be cut by it"""
+        if n_tokens <= 0:
+            return text
+        tokens = self.tokenize(text)
+        keep = self._word_boundary(tokens, max(0, len(tokens) - n_tokens))
+        return self.detokenize(tokens[:keep])
+
+    def common_prefix(self, text1: str, text2: str) -> str:
+        """Longest common prefix, in whole words, of two texts, e.g. consecutive translations of a sentence"""
+        tokens1, tokens2 = self.tokenize(text1), self.tokenize(text2)
+        n = 0
+        while n < min(len(tokens1), len(tokens2)) and tokens1[n] == tokens2[n]:
+            n += 1
+        # a word is agreed only if it ended in both texts
+        n = min(self._word_boundary(tokens1, n), self._word_boundary(tokens2, n))
+        return self.detokenize(tokens1[:n])
+
+
+class Tokenizers:
+    """Tokenizer of each model; loaded on first use"""
+
+    def __init__(self, mt_models: Dict[str, Dict]) -> None:
+        self.known_models = mt_models
+        self.tokenizers: Dict[str, Tokenizer] = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_name: Optional[str]) -> Tokenizer:
+        tokenizer = self.tokenizers.get(model_name)
+        if tokenizer is not None:
+            return tokenizer
+        with self.lock:
+            if model_name not in self.tokenizers:
+                self.tokenizers[model_name] = self._load(model_name)
+            return self.tokenizers[model_name]
+
+    def _load(self, model_name: Optional[str]) -> Tokenizer:
+        path = vocab_path(self.known_models.get(model_name) or {})
+        if path is None or path.suffix != '.spm' or not path.exists():
+            return Tokenizer()
+        try:
+            return Tokenizer(path)
+        except ImportError:
+            log.warning(f"sentencepiece is not installed; whitespace tokens are used for {model_name}")
+        except Exception as e:
+            log.warning(f"Could not load SentencePiece model {path}: {e}; using whitespace tokens")
+        return Tokenizer()
@@ -1,110 +1,410 @@
-from functools import lru_cache
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
 from itertools import zip_longest
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from . import log, payload_log, profiling, timing
+from .batcher import MicroBatcher, count_tokens, decode_bucketed
+from .cache import TranslationCache
+from .constants import (
+    BASE_ARGS,
+    CPU_THREADS,
+    DEF_DOC_WINDOW_OVERLAP,
+    DEF_DOC_WINDOW_TOKENS,
+    DEF_EAGER_LOAD,
+    DEF_FLICKER_SIZE,
+    DEF_LANGUAGE,
+    DEF_MAX_BATCH_SIZE,
+    DEF_MAX_BATCH_TOKENS,
+    DEF_MAX_WAIT_MS,
+    DEF_PROFILE_INTERVAL_MS,
+    DEF_REPLICAS,
+    DEF_WARMUP_DECODES,
+    WARMUP_SENTENCES,
+)
+from .disk_cache import DiskCache
+from .instrumentation import (
+    BATCH_SECONDS,
+    BATCH_SIZE,
+    MODEL_LOAD_SECONDS,
+    REGISTRY,
+    REQUESTS,
+    SENTENCES,
+    MetricFamily,
+    cache_families,
+    queue_families,
+)
+from .mtapi_client import MTAPIClient
+from .reload import diff_models
+from .replicas import ReplicaPool
+from .residency import ResidencyManager, estimate_cost
+from .segmentation import SEGMENTER, Segmenter, model_language
+from .tokenization import Tokenizer, Tokenizers
 
-import sentence_splitter
-from pymarian import Translator
+if TYPE_CHECKING:
+    import sentence_splitter
+    from pymarian import Translator
 
-from . import log
-from .constants import BASE_ARGS, DEF_FLICKER_SIZE, DEF_EAGER_LOAD
-from .mtapi_client import MTAPIClient
+
+# decoding options of Marian models; part of the identity of their translations in the persistent cache
+DECODE_ARGS = dict(beam_size=1, normalize=1)
+# resident name of the new versions of models being loaded by TranslatorService.reload()
+RELOAD_RESIDENT = "reload:translators"
 
 
 class TranslatorService:
 
-    def __init__(self, mt_models: Dict[str, Dict[str, str]], eager_load=DEF_EAGER_LOAD) -> None:
+    def __init__(
+        self,
+        mt_models: Dict[str, Dict[str, str]],
+        eager_load=DEF_EAGER_LOAD,
+        residency: Optional[ResidencyManager] = None,
+        segmenter: Optional[Segmenter] = None,
+        disk_cache: Optional[DiskCache] = None,
+    ) -> None:
+        """
+        :param mt_models: model configs, keyed by model name
+        :param eager_load: load all models now
+        :param residency: keeps loaded models within a memory budget; may be shared with other services.
+            Default: no budget
+        :param segmenter: sentence segmentation. Default: the one shared by all services of this process
+        :param disk_cache: persistent translation cache; looked up for sentences not in the in-memory cache
+        """
         self.known_models = {}  # base case: no known models; not using MT service
 
         if mt_models:
             self.known_models = mt_models
-        self.cache: Dict[str, Translator] = {}
+        self.residency = residency or ResidencyManager(budget=0, idle_timeout=0)
+        self.segmenter = segmenter or SEGMENTER
+        self.tokenizers = Tokenizers(self.known_models)
+        self.cache: Dict[str, 'Translator'] = {}
+        self.replica_pools: Dict[str, ReplicaPool] = {}
+        self._load_lock = threading.RLock()
+        self.batchers: Dict[str, MicroBatcher] = {}
+        self.translation_cache = TranslationCache()
+        for model_name, model in self.known_models.items():
+            self.translation_cache.configure(
+                model_name, max_bytes=model.get("cache_bytes"), ttl=model.get("cache_ttl")
+            )
+        self._batchers_lock = threading.RLock()
+        self.disk_cache = disk_cache
+        self.model_ids: Dict[str, Optional[str]] = {}  # identity of each model in the persistent cache
+        self.versions: Dict[str, int] = {}  # of each model swapped in by reload(); 0 if never
 
         if eager_load:
             for model_name in self.known_models:
                 self.get_model(model_name)
-        # TODO: retrieve language ID from config file
-        self.sentence_splitter = sentence_splitter.SentenceSplitter(language="en")
 
-    def sentence_split(self, text: str) -> List[str]:
-        return self.sentence_splitter.split(text)
+    def sentence_splitter(self, model_name: Optional[str] = None) -> 'sentence_splitter.SentenceSplitter':
+        """Sentence splitter of the source language of a model; default language if model_name is None"""
+        return self.segmenter.get_splitter(model_language(self.known_models.get(model_name)))
+
+    def sentence_split(self, text: str, model_name: Optional[str] = None, cache=True) -> List[str]:
+        """Split text into sentences, in the source language of a model
 
-    def tokenize(self, text: str) -> List[str]:
-        # TODO: support tokenization using sentence piece model used by Marian
-        return text.split()
+        :param cache: cache sentences of each paragraph; disable for large documents that are read only once
+        """
+        return self.segmenter.split(text, model_language(self.known_models.get(model_name)), cache=cache)
+
+    def tokenizer(self, model_name: Optional[str] = None) -> Tokenizer:
+        """Tokenizer of a model: SentencePiece model of its vocab if available, otherwise whitespace"""
+        return self.tokenizers.get(model_name)
 
-    def detokenize(self, text: List[str]) -> str:
-        return " ".join(text)
+    def tokenize(self, text: str, model_name: Optional[str] = None) -> List[str]:
+        return self.tokenizer(model_name).tokenize(text)
 
-    def get_model(self, model_name) -> Translator:
+    def detokenize(self, text: List[str], model_name: Optional[str] = None) -> str:
+        return self.tokenizer(model_name).detokenize(text)
+
+    def get_model(self, model_name) -> 'Translator':
         """
         Instantiate a model if not already in cache.
         """
-        if model_name not in self.cache:
-            log.warning(
-                f"Model name '{model_name}' not in cache. Going to initialize. Currently cached models are {self.cache.keys()}"
-            )
-            assert (
-                model_name in self.known_models
-            ), f"Unknown model {model_name}. Known models are {self.known_models}"
-            model = self.known_models[model_name]
-
-            model_type = model.get("type", None)
-
-            if model_type == "mtapi":
-                for key in ["subscription-key", "source-language", "target-language"]:
-                    assert key in model, f"'{key}' is required for model type 'mtapi'"
-
-                log.info(f"Creating MTAPI translator")
-                self.cache[model_name] = MTAPIClient(
-                    srcLang=model["source-language"],
-                    trgLang=model["target-language"],
-                    subscription_key=model["subscription-key"],
+        translator = self.cache.get(model_name)
+        if translator is not None:
+            self.residency.touch(f"translator:{model_name}")
+            return translator
+        with self._load_lock:
+            if model_name not in self.cache:
+                log.warning(
+                    f"Model name '{model_name}' not in cache. Going to initialize. Currently cached models are {self.cache.keys()}"
                 )
-
-            else:
-                assert model_type in (
-                    "base",
-                ), f"Unknown model type '{model_type}'. Known types are 'base', or 'mtapi'"
-                for key in ["model"]:
-                    assert key in model, f"'{key}' is required for model type 'mttruck' or 'base'"
-
-                model_path = Path(model["model"])
-                vocab_path = Path(model["vocab"]) if "vocab" in model else model_path.parent / "vocab.spm"
-
                 assert (
-                    model_path.exists() and model_path.is_file()
-                ), f"Model path '{model_path}' does not exist"
-                assert vocab_path.exists(), f"Vocab path '{vocab_path}' does not exist"
-                mt_args = BASE_ARGS | dict(
-                    models=str(model_path),
-                    vocabs=[str(vocab_path), str(vocab_path)],
-                    # TODO: allow to override these options in the config file
-                    beam_size=1,
-                    normalize=1,
-                    maxi_batch=1,
-                    mini_batch=1,
-                    # output_approx_knn=(128, 1024)  # FIXME this crashes --force-decode
-                )
-
-                log.info(f"Creating translator with args:\n {mt_args}")
-                translator = Translator(**mt_args)
-
-                sentence_breaking = model.get("sentence_breaking", False)
-                doc_enabled = model.get("doc_enabled", False)
-
-                if sentence_breaking or doc_enabled:
-                    sentence_join_token = model.get("sentence_join_token", " [eos]")
-                    sb_args = dict(
-                        translator=translator,
-                        doc_enabled=doc_enabled,
-                        sentence_join_token=sentence_join_token,
+                    model_name in self.known_models
+                ), f"Unknown model {model_name}. Known models are {self.known_models}"
+                model = self.known_models[model_name]
+                st = time.perf_counter()
+
+                model_type = model.get("type", None)
+
+                if model_type == "mtapi":
+                    for key in ["subscription-key", "source-language", "target-language"]:
+                        assert key in model, f"'{key}' is required for model type 'mtapi'"
+
+                    log.info(f"Creating MTAPI translator")
+                    mtapi_args = dict(
+                        srcLang=model["source-language"],
+                        trgLang=model["target-language"],
+                        subscription_key=model["subscription-key"],
                     )
-                    self.cache[model_name] = SentenceBreakerWrapper(**sb_args)
+                    for key in ["region", "endpoint", "max_parallel", "timeout"]:
+                        if model.get(key) is not None:
+                            mtapi_args[key] = model[key]
+                    with timing.phase('load'):
+                        self.cache[model_name] = MTAPIClient(**mtapi_args)
+
                 else:
-                    self.cache[model_name] = translator
+                    assert model_type in (
+                        "base",
+                    ), f"Unknown model type '{model_type}'. Known types are 'base', or 'mtapi'"
+                    for key in ["model"]:
+                        assert key in model, f"'{key}' is required for model type 'mttruck' or 'base'"
+
+                    model_path = Path(model["model"])
+                    vocab_path = Path(model["vocab"]) if "vocab" in model else model_path.parent / "vocab.spm"
+
+                    assert (
+                        model_path.exists() and model_path.is_file()
+                    ), f"Model path '{model_path}' does not exist"
+                    assert vocab_path.exists(), f"Vocab path '{vocab_path}' does not exist"
+                    n_replicas = model.get("replicas", DEF_REPLICAS)
+                    assert n_replicas > 0, f"replicas should be positive. Given: {n_replicas}"
+                    mt_args = BASE_ARGS | DECODE_ARGS | dict(
+                        models=str(model_path),
+                        vocabs=[str(vocab_path), str(vocab_path)],
+                        maxi_batch=1,
+                        mini_batch=model.get("max_batch_size", DEF_MAX_BATCH_SIZE),
+                        cpu_threads=model.get("cpu_threads", CPU_THREADS),
+                        # output_approx_knn=(128, 1024)  # FIXME this crashes --force-decode
+                    )
 
-        return self.cache[model_name]
+                    resident_name = f"translator:{model_name}"
+                    self.residency.admit(
+                        resident_name, cost=self._memory_cost(model), unload=partial(self._unload, model_name)
+                    )
+                    log.info(f"Creating {n_replicas} translator replica(s) with args:\n {mt_args}")
+                    try:
+                        from pymarian import Translator
+
+                        # each replica decodes one batch at a time with its own cpu_threads
+                        with timing.phase('load'):
+                            translator = ReplicaPool([Translator(**mt_args) for _ in range(n_replicas)])
+                    except Exception:
+                        self.residency.discard(resident_name)
+                        raise
+                    self.replica_pools[model_name] = translator
+
+                    sentence_breaking = model.get("sentence_breaking", False)
+                    doc_enabled = model.get("doc_enabled", False)
+
+                    if sentence_breaking or doc_enabled:
+                        sentence_join_token = model.get("sentence_join_token", " [eos]")
+                        sb_args = dict(
+                            translator=translator,
+                            language=model_language(model),
+                            segmenter=self.segmenter,
+                            doc_enabled=doc_enabled,
+                            sentence_join_token=sentence_join_token,
+                            max_batch_size=model.get("max_batch_size", DEF_MAX_BATCH_SIZE),
+                            max_batch_tokens=model.get("max_batch_tokens", DEF_MAX_BATCH_TOKENS),
+                            doc_window_tokens=model.get("doc_window_tokens", DEF_DOC_WINDOW_TOKENS),
+                            doc_window_overlap=model.get("doc_window_overlap", DEF_DOC_WINDOW_OVERLAP),
+                        )
+                        self.cache[model_name] = SentenceBreakerWrapper(**sb_args)
+                    else:
+                        self.cache[model_name] = translator
+                MODEL_LOAD_SECONDS.observe(time.perf_counter() - st, service='translator', model=model_name)
+
+            return self.cache[model_name]
+
+    @staticmethod
+    def _memory_cost(model: Dict) -> float:
+        """Estimated memory (MB) of all replicas of a Marian model"""
+        return (model.get("memory_mb") or estimate_cost(model["model"])) * model.get("replicas", DEF_REPLICAS)
+
+    def _unload(self, model_name: str):
+        """Unload a model; it will be loaded again when needed"""
+        log.info(f"Unloading model '{model_name}'")
+        self.cache.pop(model_name, None)
+        self.replica_pools.pop(model_name, None)
+
+    def warm_up(self, model_name: str, n_decodes: int = DEF_WARMUP_DECODES):
+        """Load a model and run a few dummy decodes, so that its workspace is allocated before requests come.
+        Dummy decodes bypass the batching scheduler and the translation cache.
+        """
+        self.get_model(model_name)
+        self.model_id(model_name)  # hashes model files and preloads the persistent cache, if any
+        pool = self.replica_pools.get(model_name)
+        if pool is None:
+            return  # remote service, e.g. mtapi; nothing to warm up here, and requests are billed
+        for replica in pool.replicas:
+            for _ in range(n_decodes):
+                replica.translate(WARMUP_SENTENCES)
+
+    def model_id(self, model_name: str) -> Optional[str]:
+        """Identity of a model in the persistent cache; None if there is no persistent cache.
+        Known translations of the model (`cache_preload` TSV file of its config) are loaded on first call.
+        """
+        if self.disk_cache is None:
+            return None
+        if model_name in self.model_ids:
+            return self.model_ids[model_name]
+        with self._load_lock:
+            if model_name not in self.model_ids:
+                model = self.known_models[model_name]
+                try:
+                    model_id = self.disk_cache.model_id(model, DECODE_ARGS)
+                    preload = model.get("cache_preload")
+                    if preload:
+                        self.disk_cache.preload(model_id, Path(preload), TranslationCache.make_key)
+                except Exception as e:
+                    log.warning(f"Persistent cache is not used for {model_name}: {e}")
+                    model_id = None
+                self.model_ids[model_name] = model_id
+            return self.model_ids[model_name]
+
+    def reload(self, mt_models: Dict[str, Dict], n_decodes: int = DEF_WARMUP_DECODES) -> Dict[str, List[str]]:
+        """Serve a new set of models. New and changed models are loaded and warmed up while the current ones
+        keep serving, and then swapped in at once. Sentences already sent to a changed or removed model are
+        decoded by its previous version, which is unloaded when they are done. Nothing changes if a model
+        fails to load.
+
+        :param mt_models: model configs, keyed by model name
+        :param n_decodes: dummy decodes of each new or changed model
+        :return: names of added, changed, removed and unchanged models; see reload.diff_models()
+        """
+        changes = diff_models(self.known_models, mt_models)
+        loads = changes['added'] + changes['changed']
+        staging = TranslatorService(
+            {name: mt_models[name] for name in loads}, segmenter=self.segmenter, disk_cache=self.disk_cache
+        )
+        # staged models are admitted to the memory budget together, before they load, so that least recently
+        # used models are unloaded to make room; each is admitted on its own when swapped in
+        marian = [mt_models[name] for name in loads if mt_models[name].get("type") == "base"]
+        cost = sum(self._memory_cost(model) for model in marian)
+        if cost:
+            self.residency.admit(RELOAD_RESIDENT, cost=cost, unload=lambda: None)
+            budget, used = self.residency.budget, self.residency.used
+            if budget > 0 and used > budget:
+                log.warning(
+                    f"Reload of models {loads} goes over the memory budget: {used:.0f}MB of {budget}MB "
+                    "are used while the new versions load, besides the ones that are draining"
+                )
+        try:
+            for model_name in loads:
+                log.info(f"Loading new version of model '{model_name}'")
+                staging.warm_up(model_name, n_decodes=n_decodes)
+        except Exception:
+            self.residency.discard(RELOAD_RESIDENT)
+            raise
+
+        retired = {}
+        with self._load_lock, self._batchers_lock:
+            for model_name in changes['changed'] + changes['removed']:
+                batcher = self.batchers.pop(model_name, None)
+                if batcher is not None:
+                    old_model = self.known_models[model_name]
+                    translator = self.cache.get(model_name)
+                    if translator is None:  # unloaded meanwhile; loaded again only if sentences are queued
+                        previous = TranslatorService({model_name: old_model}, segmenter=self.segmenter)
+                        batcher.fn = partial(previous._decode, model_name)
+                    else:
+                        batcher.fn = partial(self._decode, model_name, translator=translator, model=old_model)
+                    retired[model_name] = batcher
+                self.cache.pop(model_name, None)
+                self.replica_pools.pop(model_name, None)
+                self.model_ids.pop(model_name, None)
+                self.residency.discard(f"translator:{model_name}")
+                self.versions[model_name] = self.versions.get(model_name, 0) + 1
+            for model_name in changes['removed']:
+                self.translation_cache.remove(model_name)
+            self.residency.discard(RELOAD_RESIDENT)
+            for model_name in loads:
+                model = mt_models[model_name]
+                self.cache[model_name] = staging.cache[model_name]
+                if model_name in staging.replica_pools:
+                    self.replica_pools[model_name] = staging.replica_pools[model_name]
+                    self.residency.admit(
+                        f"translator:{model_name}",
+                        cost=self._memory_cost(model),
+                        unload=partial(self._unload, model_name),
+                    )
+                if model_name in staging.model_ids:
+                    self.model_ids[model_name] = staging.model_ids[model_name]
+                self.translation_cache.configure(
+                    model_name, max_bytes=model.get("cache_bytes"), ttl=model.get("cache_ttl")
+                )
+            self.known_models = mt_models
+            self.tokenizers = Tokenizers(mt_models)
+        for model_name, batcher in retired.items():
+            threading.Thread(target=self._retire, args=(model_name, batcher), daemon=True).start()
+        return changes
+
+    def _retire(self, model_name: str, batcher: MicroBatcher):
+        """Close the batcher of a previous version of a model once its sentences are decoded"""
+        batcher.close(wait=True)  # for requests that got the batcher just before the swap; see held_batcher()
+        batcher.join()
+        batcher.fn = None  # releases the model
+        log.info(f"Previous version of model '{model_name}' is drained and unloaded")
+
+    def get_batcher(self, model_name) -> MicroBatcher:
+        """
+        Get the batching scheduler of a model; created if not already.
+        Sentences from concurrent requests to the same model are decoded together in batches.
+        """
+        with self._batchers_lock:
+            if model_name not in self.batchers:
+                assert (
+                    model_name in self.known_models
+                ), f"Unknown model {model_name}. Known models are {self.known_models}"
+                model = self.known_models[model_name]
+                self.batchers[model_name] = MicroBatcher(
+                    fn=partial(self._decode, model_name),
+                    name=model_name,
+                    max_batch_size=model.get("max_batch_size", DEF_MAX_BATCH_SIZE),
+                    max_batch_tokens=model.get("max_batch_tokens", DEF_MAX_BATCH_TOKENS),
+                    max_wait_ms=model.get("max_wait_ms", DEF_MAX_WAIT_MS),
+                    # a batch for each replica can be decoded at the same time
+                    num_workers=model.get("replicas", DEF_REPLICAS),
+                )
+            return self.batchers[model_name]
+
+    @contextmanager
+    def held_batcher(self, model_name) -> Iterator[MicroBatcher]:
+        """Batcher of a model, kept open for the block to submit to even if reload() retires it meanwhile"""
+        with self._batchers_lock:
+            batcher = self.get_batcher(model_name)
+            batcher.hold()
+        try:
+            yield batcher
+        finally:
+            batcher.release()
+
+    def _decode(
+        self, model_name: str, sources: List[str], translator=None, model: Optional[Dict] = None, **kwargs
+    ) -> List[str]:
+        """Decode a batch of sources. Called by the batching scheduler.
+
+        :param translator: model to decode with, e.g. the previous version of a model swapped by reload().
+            Default: the current model
+        :param model: config of the translator. Default: the current config
+        """
+        BATCH_SIZE.observe(len(sources), service='translator', model=model_name)
+        with BATCH_SECONDS.time(service='translator', model=model_name):
+            translator = translator or self.get_model(model_name)
+            if not isinstance(translator, ReplicaPool):  # remote service, or sentence breaker; buckets itself
+                return translator.translate(sources, **kwargs)
+            model = model or self.known_models[model_name]
+            return decode_bucketed(
+                translator.translate,
+                sources,
+                max_batch_size=model.get("max_batch_size", DEF_MAX_BATCH_SIZE),
+                max_batch_tokens=model.get("max_batch_tokens", DEF_MAX_BATCH_TOKENS),
+                **kwargs,
+            )
 
     def translate(self, model_name:str, sources:List[str]) -> List[str]:
         """
@@ -132,37 +432,130 @@ class TranslatorService:
             }
         }
         """
-        log.info(f"Translating '{sources}' using '{model_name}'")
-        translator = self.get_model(model_name)
-        return [{"outputs": translator.translate(sources)}]
+        payload_log.debug("Translating '%s' using '%s'", sources, model_name)
+        return [{"outputs": self.force_decode_batch(model_name, sources)}]
 
     def force_decode_batch(
         self, model_name: str, sources: List[str], prefixes: Optional[List[str]] = None
         ) -> List[str]:
-        """Force decode with prefixes
+        """Force decode with prefixes. Supports caching of args.
+        Sentences that are not in cache are decoded together; the ones without prefix are decoded freely.
+
         :param model_name: model name
         :param sources: list of source sentences
-        :param prefixes: list of prefixes
+        :param prefixes: list of prefixes; empty or None prefix means no force decoding
         :return: list of translations
         """
-        translator = self.get_model(model_name)
-        if not prefixes or len(prefixes) == 1 and not prefixes[0]:
-            log.info(f"Decoding without prefixes (no force decode): \n {sources}")
-            result = translator.translate(sources)
-        else:
-            assert len(sources) == len(
-                prefixes
-            ), f"Length of sources and prefixes should be the same. Got {sources} and {prefixes}"
-            sources = [
-                '%s\t%s' % (source.replace('\t', ' ').rstrip(), prefix.replace('\t', ' ').rstrip())
-                for source, prefix in zip(sources, prefixes)
-            ]
-            log.info(f"Force decoding with sources:\n {sources}")
-            result = translator.translate(sources, force_decode=True, tsv=True, tsv_fields=2)
-
+        prefixes = prefixes or [None] * len(sources)
+        assert len(sources) == len(
+            prefixes
+        ), f"Length of sources and prefixes should be the same. Got {sources} and {prefixes}"
+        REQUESTS.inc(service='translator', model=model_name)
+        SENTENCES.inc(len(sources), service='translator', model=model_name)
+        version = self.versions.get(model_name, 0)
+        force_args = dict(force_decode=True, tsv=True, tsv_fields=2)
+        keys = [
+            self.translation_cache.make_key(source, prefix, force_args if prefix else None)
+            for source, prefix in zip(sources, prefixes)
+        ]
+        result = [None] * len(sources)
+        misses = []
+        with timing.phase('cache'):
+            for idx, key in enumerate(keys):
+                result[idx] = self.translation_cache.get(model_name, key)
+                if result[idx] is None:
+                    misses.append(idx)
+            model_id = self.model_id(model_name) if misses else None
+            if model_id:
+                found = self.disk_cache.get_many(model_id, [keys[idx] for idx in misses])
+                for idx, output in zip(misses, found):
+                    if output is not None:
+                        result[idx] = output
+                        self.translation_cache.put(model_name, keys[idx], output)
+                misses = [idx for idx in misses if result[idx] is None]
+        if not misses:
+            return result
+
+        # submitted shortest first, so that batches cut from a long request hold sentences of similar length
+        misses.sort(key=lambda idx: count_tokens(sources[idx]) + count_tokens(prefixes[idx] or ''))
+        free_idxs = [idx for idx in misses if not prefixes[idx]]
+        free_sources = [sources[idx] for idx in free_idxs]
+        forced_idxs = [idx for idx in misses if prefixes[idx]]
+        forced_sources = [
+            '%s\t%s' % (sources[idx].replace('\t', ' ').rstrip(), prefixes[idx].replace('\t', ' ').rstrip())
+            for idx in forced_idxs
+        ]
+        jobs = []
+        with self.held_batcher(model_name) as batcher:
+            if free_sources:
+                payload_log.debug("Decoding without prefixes (no force decode): \n %s", free_sources)
+                jobs.append((free_idxs, batcher.submit(free_sources)))
+            if forced_sources:
+                payload_log.debug("Force decoding with sources:\n %s", forced_sources)
+                jobs.append((forced_idxs, batcher.submit(forced_sources, **force_args)))
+
+        for idxs, future in jobs:
+            for idx, output in zip(idxs, future.result()):
+                result[idx] = output
+        if self.versions.get(model_name, 0) != version:
+            return result  # the model was swapped by reload() meanwhile; outputs are not cached
+        for idx in misses:
+            self.translation_cache.put(model_name, keys[idx], result[idx])
+        if model_id:
+            self.disk_cache.put_many(model_id, [(keys[idx], result[idx]) for idx in misses])
         return result
 
-    @lru_cache(maxsize=1024)
+    def resident_models(self) -> List[Dict]:
+        """Translators currently loaded in memory"""
+        return self.residency.resident(prefix="translator:")
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Translation cache statistics of each model"""
+        return self.translation_cache.stats()
+
+    def disk_cache_stats(self) -> Dict[str, Dict]:
+        """Persistent cache statistics, keyed by 'disk'; empty if there is no persistent cache"""
+        return {} if self.disk_cache is None else dict(disk=self.disk_cache.stats())
+
+    def queue_stats(self) -> Dict[str, Dict]:
+        """Load of each model that has a batching scheduler: sentences waiting to be batched, busy replicas"""
+        stats = {}
+        for model_name, batcher in list(self.batchers.items()):
+            pool = self.replica_pools.get(model_name)
+            stats[model_name] = dict(
+                queue_depth=batcher.queue_depth(),
+                **(pool.stats() if pool else dict(replicas=0, busy=0, waiting=0)),
+            )
+        return stats
+
+    def collect_metrics(self, process_wide=False) -> List[MetricFamily]:
+        """Metrics of this service in Prometheus families; see instrumentation.py
+
+        :param process_wide: also include the metrics recorded by this process, e.g. when running in a worker process.
+            Otherwise, only the cache statistics are included
+        """
+        families = cache_families(self.cache_stats(), cache='translations')
+        families += cache_families(self.segmenter.stats(), cache='segments')  # keyed by language
+        families += cache_families(self.disk_cache_stats(), cache='disk')
+        families += queue_families(self.queue_stats())
+        if process_wide:
+            families = REGISTRY.collect() + families
+        return families
+
+    def profile(self, seconds: float, interval_ms: float = DEF_PROFILE_INTERVAL_MS) -> Dict:
+        """Sampled stacks of the threads of this process; see profiling.sample()"""
+        return profiling.sample(seconds, interval_ms)
+
+    def flush_cache(self, model_name: Optional[str] = None):
+        """Flush translation cache of a model, in memory and on disk; all models if model_name is None"""
+        self.translation_cache.flush(model_name)
+        if self.disk_cache is None:
+            return
+        if model_name is None:
+            self.disk_cache.flush()
+        elif self.model_id(model_name):
+            self.disk_cache.flush(self.model_id(model_name))
+
     def force_decode(self, model_name: str, source: str, prefix: str) -> str:
         """Force decode with prefix. Supports caching of args.
 
@@ -171,30 +564,26 @@ class TranslatorService:
         :param prefix: prefix
         :return: translation
         """
-        translator = self.get_model(model_name)
-        if not prefix:
-            log.info(f"Decoding without prefix (no force decode): \n {source}")
-            result = translator.translate(source)
-        else:
-            source = source.replace('\t', ' ').rstrip()
-            prefix = prefix.replace('\t', ' ').rstrip()
-            source = f"{source}\t{prefix}"
-            log.info(f"Force decoding with source:\n {source}")
-            result = translator.translate(source, force_decode=True, tsv=True, tsv_fields=2)
-        return result
+        return self.force_decode_batch(model_name, [source], [prefix])[0]
 
-    def _flicker_sentence(self, sentence: str, flicker_size: int) -> str:
-        """Flicker the sentence by removing flicker_size tokens from the end
+    def _flicker_sentence(self, sentence: str, flicker_size: int, model_name: Optional[str] = None) -> str:
+        """Flicker the sentence by removing flicker_size tokens from the end, and the rest of a word cut by it
 
         :param sentence: sentence
-        :param flicker_size: size of flicker; number of tokens
+        :param flicker_size: size of flicker; number of (subword) tokens of the model
+        :param model_name: model name, for its tokenizer
         :return: flickered sentence
         """
         assert flicker_size > 0, f"Flicker size should be greater than 0. Got {flicker_size}"
-        return self.detokenize(self.tokenize(sentence)[:-flicker_size])
+        return self.tokenizer(model_name).trim(sentence, flicker_size)
 
     def live_translate(
-        self, model_name: str, source: str, target_segments: List[str], flicker_size=DEF_FLICKER_SIZE
+        self,
+        model_name: str,
+        source: str,
+        target_segments: List[str],
+        flicker_size=DEF_FLICKER_SIZE,
+        source_segments: Optional[List[str]] = None,
     ) -> str:
         """Live translation with prefix caching and flickering (last) target sentence
 
@@ -202,13 +591,19 @@ class TranslatorService:
         :param source: source sentence
         :param target_segments: target segments (i.e., sentences that align 1:1 with source segments)
         :param flicker_size: size of flicker; number of tokens
+        :param source_segments: source segments that target_segments are translations of, as returned by
+            the previous call. Sentences whose source did not change are final; they are not decoded again
         :return: translated sentence
         """
         assert source, "Source should not be empty"
 
         rows = []
-        source_sents = self.sentence_split(source)
+        source_sents = self.sentence_split(source, model_name)
         target_segments = (target_segments or [])[: len(source_sents)]  # ignore extra target sentences
+        prev_sources = source_segments or []
+        unchanged = [
+            idx < len(prev_sources) and prev_sources[idx] == src for idx, src in enumerate(source_sents)
+        ]
 
         last_tgt_idx = -1
         for idx, (src, tgt) in enumerate(zip_longest(source_sents, target_segments)):
@@ -216,47 +611,164 @@ class TranslatorService:
             if tgt:  # not empty,  not None
                 last_tgt_idx = idx
 
-        if flicker_size > 0 and last_tgt_idx >= 0:
+        if flicker_size > 0 and last_tgt_idx >= 0 and not unchanged[last_tgt_idx]:
             # flicker the last tgt sentence
             last_tgt_segment = rows[last_tgt_idx][1]
-            rows[last_tgt_idx][1] = self._flicker_sentence(last_tgt_segment, flicker_size)
+            rows[last_tgt_idx][1] = self._flicker_sentence(last_tgt_segment, flicker_size, model_name)
 
-        src_segs_out = []
-        tgt_segs_out = []
+        src_segs_out = [src for src, tgt in rows]
+        tgt_segs_out = [None] * len(rows)
+        fresh_idxs = []
         for idx, (src, tgt) in enumerate(rows):
-            src_segs_out.append(src)
-            if tgt and last_tgt_idx >= 0 and idx < last_tgt_idx:  # reuse prior translations
-                tgt_segs_out.append(tgt)
+            if tgt and (idx < last_tgt_idx or unchanged[idx]):  # reuse prior translations
+                tgt_segs_out[idx] = tgt
             else:  # fresh translation
-                tgt_segs_out.append(self.force_decode(model_name, src, tgt))  # assumption: cached
-                # TODO: support batching
+                fresh_idxs.append(idx)
+        if fresh_idxs:
+            # one batched call for all fresh rows; cached rows are not decoded again
+            fresh_outs = self.force_decode_batch(
+                model_name, [rows[idx][0] for idx in fresh_idxs], [rows[idx][1] for idx in fresh_idxs]
+            )
+            for idx, out in zip(fresh_idxs, fresh_outs):
+                tgt_segs_out[idx] = out
         return src_segs_out, tgt_segs_out
 
 
+def doc_windows(lengths: List[int], max_tokens: int, overlap: int = 0) -> List[Tuple[int, int, int]]:
+    """Split a document into windows of consecutive sentences, each within a token budget.
+
+    :param lengths: token length of each sentence of the document
+    :param max_tokens: maximum tokens of a window. A sentence longer than this makes its own window
+    :param overlap: number of sentences of the preceding window repeated at the start of a window, as context.
+        Context is dropped when it does not fit in the budget
+    :return: (context_start, start, end) of each window; sentences [start, end) are translated by the window,
+        and [context_start, start) are its context
+    """
+    assert max_tokens > 0, f"max_tokens should be positive. Given: {max_tokens}"
+    assert overlap >= 0, f"overlap should be non-negative. Given: {overlap}"
+    windows = []
+    start = 0
+    while start < len(lengths):
+        ctx_start = max(0, start - overlap)
+        n_tokens = sum(lengths[ctx_start:start])
+        end = start
+        while end < len(lengths) and (end == start or n_tokens + lengths[end] <= max_tokens):
+            n_tokens += lengths[end]
+            end += 1
+            while n_tokens > max_tokens and ctx_start < start:  # make room by dropping context
+                n_tokens -= lengths[ctx_start]
+                ctx_start += 1
+        windows.append((ctx_start, start, end))
+        start = end
+    return windows
+
+
 class SentenceBreakerWrapper:
-    def __init__(self, translator=None, language="en", **kwargs):
+    def __init__(
+        self,
+        translator=None,
+        language=DEF_LANGUAGE,
+        segmenter: Optional[Segmenter] = None,
+        max_batch_size=DEF_MAX_BATCH_SIZE,
+        max_batch_tokens=DEF_MAX_BATCH_TOKENS,
+        doc_window_tokens=DEF_DOC_WINDOW_TOKENS,
+        doc_window_overlap=DEF_DOC_WINDOW_OVERLAP,
+        **kwargs,
+    ):
+        """
+        :param translator: translator of sentences (or documents, if doc_enabled)
+        :param language: language of the sentence splitter
+        :param segmenter: sentence segmentation. Default: the one shared by all services of this process
+        :param max_batch_size: maximum number of segments per call of translator
+        :param max_batch_tokens: maximum number of padded tokens per call of translator
+        :param doc_window_tokens: doc_enabled only; maximum tokens of a window of sentences decoded together
+        :param doc_window_overlap: doc_enabled only; sentences of the preceding window given as context
+        """
         self.translator = translator
-        log.info(f"Creating sentence breaker for language '{language}'")
-        self.splitter = sentence_splitter.SentenceSplitter(language=language)
+        self.language = language
+        self.segmenter = segmenter or SEGMENTER
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.doc_window_tokens = doc_window_tokens
+        self.doc_window_overlap = doc_window_overlap
 
         self.doc_enabled = kwargs.get("doc_enabled", False)
         self.sentence_join_token = kwargs.get("sentence_join_token", None)
 
+    def _translate_bucketed(self, segments: List[str]) -> List[str]:
+        """Translate segments in buckets of similar length; empty segments are not decoded"""
+        idxs = [idx for idx, seg in enumerate(segments) if seg.strip()]
+        outputs = decode_bucketed(
+            self.translator.translate,
+            [segments[idx] for idx in idxs],
+            max_batch_size=self.max_batch_size,
+            max_batch_tokens=self.max_batch_tokens,
+        )
+        translations = [""] * len(segments)
+        for idx, output in zip(idxs, outputs):
+            translations[idx] = output
+        return translations
+
     def translate(self, sources: List[str]) -> List[str]:
+        """Translate lines of text; each line may have several sentences.
+
+        :param sources: lines of text
+        :return: translation of each line
+        """
+        split_sources = [self.segmenter.split(s, self.language) for s in sources]
         if self.doc_enabled:
-            # for doc models, sentence-split, but then join by [eos] within each original line
-            sources = [self.sentence_join_token.join(self.splitter.split(s)) for s in sources]
-            log.info(f"Combined source sentences into: {sources}")
-            translations = self.translator.translate(sources)
-            translations = [" ".join(translations[0].split(self.sentence_join_token))]
-        else:
-            # otherwise, split on sentences, but maintain the original boundaries
-            sources = [self.splitter.split(s) for s in sources]
-            log.info(f"Split source sentences into: {sources}")
-            lens = [len(s) for s in sources]
-            # flatten the list of lists
-            sources = [s for sublist in sources for s in sublist]
-            translations = self.translator.translate(sources)
-            # unflatten the list of lists
-            translations = [translations[i : i + l] for i, l in enumerate(lens)]
-        return translations
+            return self._translate_docs(split_sources)
+
+        # otherwise, split on sentences, but maintain the original boundaries
+        payload_log.debug("Split source sentences into: %s", split_sources)
+        # flatten the list of lists; line i has segments offsets[i] to offsets[i + 1]
+        offsets = [0]
+        for sents in split_sources:
+            offsets.append(offsets[-1] + len(sents))
+        translations = self._translate_bucketed([s for sents in split_sources for s in sents])
+        # unflatten: sentences of a line are joined back into one output per line
+        return [" ".join(translations[offsets[i] : offsets[i + 1]]) for i in range(len(sources))]
+
+    def _join(self, sents: List[str]) -> str:
+        return self.sentence_join_token.join(sents)
+
+    def _unjoin(self, text: str) -> List[str]:
+        return [sent.strip() for sent in text.split(self.sentence_join_token.strip())]
+
+    def _translate_docs(self, docs: List[List[str]]) -> List[str]:
+        """Translate documents with a doc model, in windows of sentences joined by sentence_join_token.
+        Windows of all documents are decoded together.
+
+        :param docs: sentences of each document (line)
+        :return: translation of each document
+        """
+        windows = []  # (doc_idx, context_start, start, end)
+        for doc_idx, sents in enumerate(docs):
+            lengths = [count_tokens(sent) for sent in sents]
+            for window in doc_windows(lengths, self.doc_window_tokens, self.doc_window_overlap):
+                windows.append((doc_idx, *window))
+        rows = [self._join(docs[doc_idx][ctx_start:end]) for doc_idx, ctx_start, _, end in windows]
+        payload_log.debug("Combined source sentences into windows: %s", rows)
+        outputs = self._translate_bucketed(rows)
+
+        doc_sents = [[] for _ in docs]
+        retry = []  # windows whose output could not be mapped to their sentences
+        for window, output in zip(windows, outputs):
+            doc_idx, ctx_start, start, end = window
+            pieces = self._unjoin(output)
+            if len(pieces) == end - ctx_start:
+                doc_sents[doc_idx].append((start, pieces[start - ctx_start :]))
+            elif ctx_start == start:  # no context to drop; the join tokens still are
+                doc_sents[doc_idx].append((start, [" ".join(pieces)]))
+            else:
+                retry.append(window)
+        if retry:
+            # the model merged or split sentences, so its context can't be told apart; decode without context
+            log.warning(f"Sentence count mismatch in {len(retry)} windows; translating them without context")
+            outputs = self._translate_bucketed([self._join(docs[d][start:end]) for d, _, start, end in retry])
+            for (doc_idx, _, start, end), output in zip(retry, outputs):
+                pieces = self._unjoin(output)
+                if len(pieces) != end - start:
+                    pieces = [" ".join(pieces)]
+                doc_sents[doc_idx].append((start, pieces))
+        return [" ".join(" ".join(pieces) for _, pieces in sorted(parts)) for parts in doc_sents]
@@ -0,0 +1,123 @@
+"""
+Background warm-up of models, and their load state for health checks.
+
+Models are resolved (downloaded, if needed), loaded and primed with a few dummy decodes in a background thread,
+so that the server starts accepting connections right away and a readiness probe can hold traffic back
+until the models are warm.
+"""
+import threading
+import time
+from functools import partial
+from typing import Dict, List, Optional
+
+from . import log
+from .constants import DEF_WARMUP_DECODES
+
+PENDING = 'pending'  # waiting for its turn
+LOADING = 'loading'
+READY = 'ready'  # loaded and primed
+LAZY = 'lazy'  # resolved, but loaded on first use
+FAILED = 'failed'
+
+
+class WarmUp:
+    """Warms up the models of translator and evaluator services in a background thread"""
+
+    def __init__(
+        self,
+        transl_service,
+        eval_service,
+        load_translators=False,
+        load_evaluators=False,
+        n_decodes=DEF_WARMUP_DECODES,
+    ) -> None:
+        """
+        :param transl_service: TranslatorService or WorkerPool
+        :param eval_service: EvaluatorService
+        :param load_translators: load and prime translators; otherwise, they are loaded on first use
+        :param load_evaluators: load and prime evaluators; otherwise, they are only resolved (downloaded)
+        :param n_decodes: number of dummy decodes (or scoring calls) run after loading a model
+        """
+        self.transl_service = transl_service
+        self.eval_service = eval_service
+        self.load_translators = load_translators
+        self.load_evaluators = load_evaluators
+        self.n_decodes = n_decodes
+        self.lock = threading.Lock()
+        self.states: Dict[str, Dict] = {}
+        for name in transl_service.known_models:
+            self.states[f'translator:{name}'] = dict(state=PENDING if load_translators else LAZY)
+        for name in eval_service.known_models:
+            self.states[f'evaluator:{name}'] = dict(state=PENDING)
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self) -> 'WarmUp':
+        self.thread = threading.Thread(target=self.run, name='model-warmup', daemon=True)
+        self.thread.start()
+        return self
+
+    def _set(self, key: str, **state):
+        with self.lock:
+            self.states[key] = state
+
+    def _warm(self, key: str, fn, lazy=False):
+        self._set(key, state=LOADING)
+        st = time.time()
+        try:
+            fn()
+        except Exception as e:
+            log.exception(f"Warm-up of {key} failed")
+            self._set(key, state=FAILED, error=f'{type(e).__name__}: {e}')
+            return
+        state = LAZY if lazy else READY
+        self._set(key, state=state, load_secs=round(time.time() - st, 3))
+        log.info(f"Warm-up of {key} done in {time.time() - st:.2f}s")
+
+    def run(self):
+        try:
+            for name in list(self.transl_service.known_models):  # loaded now rather than by the first request
+                self.transl_service.sentence_splitter(name)
+            if self.load_translators:
+                for name in list(self.transl_service.known_models):
+                    fn = partial(self.transl_service.warm_up, name, n_decodes=self.n_decodes)
+                    self._warm(f'translator:{name}', fn)
+            for name in list(self.eval_service.known_models):
+                if self.load_evaluators:
+                    fn = partial(self.eval_service.warm_up, name, n_decodes=self.n_decodes)
+                else:
+                    fn = partial(self.eval_service.resolve_model, name)
+                self._warm(f'evaluator:{name}', fn, lazy=not self.load_evaluators)
+        finally:
+            self.finished_at = time.time()
+            self.done.set()
+            log.info(f"Warm-up finished in {self.finished_at - self.started_at:.2f}s")
+
+    def reloaded(self, changes: Dict[str, List[str]]):
+        """Update translator states after a config reload; new and changed translators are warm"""
+        with self.lock:
+            for name in changes['removed']:
+                self.states.pop(f'translator:{name}', None)
+            for name in changes['added'] + changes['changed']:
+                self.states[f'translator:{name}'] = dict(state=READY)
+
+    def is_ready(self) -> bool:
+        """Warm-up is finished and all translators are usable. Evaluators that failed do not hold readiness"""
+        if not self.done.is_set():
+            return False
+        with self.lock:
+            translators = [st for key, st in self.states.items() if key.startswith('translator:')]
+        return all(st['state'] != FAILED for st in translators)
+
+    def status(self) -> Dict:
+        with self.lock:
+            models = {key: dict(st) for key, st in self.states.items()}
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return dict(
+            ready=self.is_ready(),
+            warmup_done=self.done.is_set(),
+            warmup_secs=round(elapsed, 3),
+            models=models,
+        )
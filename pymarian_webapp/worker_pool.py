@@ -0,0 +1,404 @@
+"""
+Pool of long-lived worker processes that keep MT models resident.
+
+Each worker process owns a TranslatorService with the models assigned to it, loads them once,
+and serves requests sent by the web front end over IPC queues. Phases of a request in a worker are sent back
+with its result, and added to the timings of the request in the front end.
+"""
+import atexit
+import contextlib
+import itertools
+import multiprocessing as mp
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from . import log, timing
+from .constants import DEF_MEMORY_BUDGET, DEF_PROFILE_INTERVAL_MS, DEF_WARMUP_DECODES, DEF_WORKER_THREADS
+from .instrumentation import MetricFamily, cache_families, merge, with_labels
+from .reload import diff_models
+from .segmentation import SEGMENTER, model_language
+from .tokenization import Tokenizer, Tokenizers
+
+if TYPE_CHECKING:
+    from .disk_cache import DiskCache
+
+POLL_INTERVAL = 1  # seconds; how often the result collector checks on worker liveness
+MAX_RESTARTS = 3  # workers that keep dying (e.g. a model fails to load) are not restarted forever
+
+
+def _worker_main(
+    worker_id: int,
+    mt_models: Dict[str, Dict],
+    requests: mp.Queue,
+    results: mp.Queue,
+    threads: int,
+    memory_budget: int,
+    disk_cache_args: Optional[tuple],
+):
+    """Entry point of a worker process"""
+    from .disk_cache import DiskCache
+    from .residency import ResidencyManager
+    from .translator_service import TranslatorService
+
+    # the database connection is opened by this process rather than inherited
+    disk_cache = DiskCache(*disk_cache_args) if disk_cache_args else None
+
+    log.info(f"Worker {worker_id} loading models {list(mt_models.keys())}")
+    # models are kept resident in workers, so no idle unloading
+    service = TranslatorService(
+        mt_models,
+        eager_load=True,
+        residency=ResidencyManager(budget=memory_budget, idle_timeout=0),
+        disk_cache=disk_cache,
+    )
+    log.info(f"Worker {worker_id} ready")
+
+    def handle(req_id, method, args, kwargs, timed):
+        # pickled here rather than by the queue's feeder thread, so serialization errors reach the caller
+        with timing.collect() if timed else contextlib.nullcontext() as timings:
+            try:
+                ok, result = True, getattr(service, method)(*args, **kwargs)
+            except Exception as e:
+                ok, result = False, e
+        spans = timings.spans if timed else None
+        try:
+            payload = pickle.dumps((ok, result, spans))
+        except Exception as e:
+            payload = pickle.dumps((False, RuntimeError(f'{type(e).__name__}: {e}'), spans))
+        results.put((req_id, payload))
+
+    # requests are handled concurrently so that the batching scheduler can group them
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'worker{worker_id}') as executor:
+        while True:
+            msg = requests.get()
+            if msg is None:  # shutdown
+                break
+            executor.submit(handle, *msg)
+    log.info(f"Worker {worker_id} stopped")
+
+
+class _Worker:
+    def __init__(self, worker_id: int, mt_models: Dict[str, Dict]) -> None:
+        self.id = worker_id
+        self.mt_models = mt_models
+        self.requests = None
+        self.process = None
+        self.pending: Dict[int, Future] = {}
+        self.restarts = 0
+
+
+class WorkerPool:
+    """Front-end proxy that dispatches TranslatorService calls to worker processes.
+
+    Exposes the same methods as TranslatorService used by the web app, so it can be used in its place.
+    Models are placed on workers according to the optional `placement` list of worker indices in the
+    model config; by default every worker loads every model.
+    """
+
+    def __init__(
+        self,
+        mt_models: Dict[str, Dict[str, Any]],
+        num_workers: int,
+        threads=DEF_WORKER_THREADS,
+        memory_budget=DEF_MEMORY_BUDGET,
+        disk_cache: Optional['DiskCache'] = None,
+    ) -> None:
+        """
+        :param mt_models: model configs, keyed by model name
+        :param num_workers: number of worker processes
+        :param threads: number of requests handled concurrently by each worker
+        :param memory_budget: memory budget (MB) for models in each worker; 0 => unlimited
+        :param disk_cache: persistent translation cache, shared by workers
+        """
+        assert num_workers > 0, f"num_workers should be positive. Given: {num_workers}"
+        self.known_models = mt_models or {}
+        self.tokenizers = Tokenizers(self.known_models)
+        self.num_workers = num_workers
+        self.threads = threads
+        self.memory_budget = memory_budget
+        self.disk_cache = disk_cache
+        self.placement = self._place(self.known_models)
+
+        # workers are forked before any model is loaded in this process, so they start fast, without importing
+        # modules again; the app makes the pool before it starts threads or opens the cache database.
+        # Restarts happen while this process runs threads, which a forked child would inherit in any state
+        # (e.g. holding locks), so restarted workers are spawned
+        self.fork_ctx = mp.get_context('fork')
+        self.ctx = mp.get_context('spawn')  # of queues, which spawned workers are given too
+        self.results = self.ctx.Queue()
+        self.lock = threading.Lock()
+        self.req_ids = itertools.count()
+        self.closed = False
+        self.workers: List[_Worker] = []
+        for wid in range(num_workers):
+            models = {name: model for name, model in self.known_models.items() if wid in self.placement[name]}
+            worker = _Worker(wid, models)
+            self._start(worker)
+            self.workers.append(worker)
+        self.collector = threading.Thread(target=self._collect, name='worker-pool-collector', daemon=True)
+        self.collector.start()
+        atexit.register(self.close)
+
+    def _place(self, mt_models: Dict[str, Dict[str, Any]]) -> Dict[str, List[int]]:
+        """Ids of the workers that serve each model"""
+        placement = {}
+        num_workers = self.num_workers
+        for model_name, model in mt_models.items():
+            worker_ids = model.get("placement") or list(range(num_workers))
+            for wid in worker_ids:
+                assert (
+                    isinstance(wid, int) and 0 <= wid < num_workers
+                ), f"Invalid placement {worker_ids} for model {model_name}; worker ids should be in [0, {num_workers})"
+            placement[model_name] = worker_ids
+        return placement
+
+    def _start(self, worker: _Worker, ctx=None):
+        """Start the process of a worker
+
+        :param ctx: multiprocessing context. Default: fork
+        """
+        disk_cache = self.disk_cache
+        worker.requests = self.ctx.Queue()
+        worker.process = (ctx or self.fork_ctx).Process(
+            target=_worker_main,
+            args=(
+                worker.id,
+                worker.mt_models,
+                worker.requests,
+                self.results,
+                self.threads,
+                self.memory_budget,
+                (disk_cache.path, disk_cache.max_bytes) if disk_cache else None,
+            ),
+            name=f'pymarian-worker-{worker.id}',
+            daemon=True,
+        )
+        worker.process.start()
+        log.info(f"Started worker {worker.id} (pid={worker.process.pid}) for models {list(worker.mt_models)}")
+
+    def _collect(self):
+        """Resolves futures with results from workers; restarts workers that died"""
+        last_check = time.monotonic()
+        while not self.closed:
+            if time.monotonic() - last_check >= POLL_INTERVAL:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                req_id, payload = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future = None
+                for worker in self.workers:
+                    future = worker.pending.pop(req_id, None)
+                    if future:
+                        break
+            if future is None:
+                log.warning(f"Dropping result of unknown request {req_id}")
+                continue
+            ok, result, future.spans = pickle.loads(payload)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _check_workers(self):
+        with self.lock:
+            for worker in self.workers:
+                if self.closed or worker.process is None or worker.process.is_alive():
+                    continue
+                log.error(f"Worker {worker.id} died with exit code {worker.process.exitcode}")
+                for future in worker.pending.values():
+                    future.set_exception(RuntimeError(f"Worker {worker.id} died"))
+                worker.pending.clear()
+                if worker.restarts < MAX_RESTARTS:
+                    worker.restarts += 1
+                    log.warning(f"Restarting worker {worker.id}; attempt {worker.restarts} of {MAX_RESTARTS}")
+                    self._start(worker, ctx=self.ctx)
+                else:
+                    log.error(f"Worker {worker.id} failed too many times; not restarting")
+                    worker.process = None
+
+    def _submit(self, worker: _Worker, method: str, args: tuple, kwargs: dict) -> Future:
+        """Sends a request to a worker. Caller must hold the lock."""
+        future = Future()
+        req_id = next(self.req_ids)
+        worker.pending[req_id] = future
+        worker.requests.put((req_id, method, args, kwargs, timing.current() is not None))
+        return future
+
+    def call(self, model_name: str, method: str, *args, **kwargs) -> Any:
+        """Calls `TranslatorService.<method>(model_name, *args, **kwargs)` on the least loaded worker
+        that holds the model.
+        """
+        assert model_name in self.known_models, f"Unknown model {model_name}. Known models are {self.known_models}"
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Worker pool is closed")
+            candidates = [self.workers[wid] for wid in self.placement[model_name] if self.workers[wid].process]
+            if not candidates:
+                raise RuntimeError(f"No live worker serves model {model_name}")
+            worker = min(candidates, key=lambda w: len(w.pending))
+            future = self._submit(worker, method, (model_name,) + args, kwargs)
+        result = future.result()
+        timings, spans = timing.current(), getattr(future, 'spans', None)
+        if timings is not None and spans:
+            timings.extend(spans)
+        return result
+
+    def broadcast(self, method: str, *args, **kwargs) -> Dict[int, Any]:
+        """Calls `TranslatorService.<method>(*args, **kwargs)` on every live worker
+        :return: map of worker id to result
+        """
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Worker pool is closed")
+            futures = {w.id: self._submit(w, method, args, kwargs) for w in self.workers if w.process}
+        return {wid: future.result() for wid, future in futures.items()}
+
+    # sentence splitting of live sessions and documents happens in this process
+    def sentence_splitter(self, model_name: Optional[str] = None):
+        return SEGMENTER.get_splitter(model_language(self.known_models.get(model_name)))
+
+    def sentence_split(self, text: str, model_name: Optional[str] = None, cache=True) -> List[str]:
+        return SEGMENTER.split(text, model_language(self.known_models.get(model_name)), cache=cache)
+
+    def tokenizer(self, model_name: Optional[str] = None) -> Tokenizer:
+        # live sessions trim translations in this process
+        return self.tokenizers.get(model_name)
+
+    def translate(self, model_name: str, sources: List[str]):
+        return self.call(model_name, 'translate', sources)
+
+    def force_decode_batch(self, model_name: str, sources: List[str], prefixes=None) -> List[str]:
+        return self.call(model_name, 'force_decode_batch', sources, prefixes)
+
+    def force_decode(self, model_name: str, source: str, prefix: str) -> str:
+        return self.call(model_name, 'force_decode', source, prefix)
+
+    def live_translate(self, model_name: str, source: str, target_segments: List[str], **kwargs):
+        return self.call(model_name, 'live_translate', source, target_segments, **kwargs)
+
+    def warm_up(self, model_name: str, n_decodes: int = DEF_WARMUP_DECODES):
+        """Warm up a model on every worker it is placed on; waits for the workers to load their models"""
+        assert (
+            model_name in self.known_models
+        ), f"Unknown model {model_name}. Known models are {self.known_models}"
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Worker pool is closed")
+            futures = [
+                self._submit(w, 'warm_up', (model_name,), dict(n_decodes=n_decodes))
+                for w in self.workers
+                if w.process and w.id in self.placement[model_name]
+            ]
+        for future in futures:
+            future.result()
+
+    def reload(self, mt_models: Dict[str, Dict[str, Any]], n_decodes: int = DEF_WARMUP_DECODES) -> Dict:
+        """Serve a new set of models; each worker reloads the models placed on it.
+        See TranslatorService.reload(). If a worker fails to reload, the others serve their new models, and
+        this process keeps routing requests by the previous config until a reload succeeds.
+
+        :return: names of added, changed, removed and unchanged models
+        """
+        placement = self._place(mt_models)
+        worker_models = {
+            w.id: {name: model for name, model in mt_models.items() if w.id in placement[name]}
+            for w in self.workers
+        }
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Worker pool is closed")
+            futures = [
+                self._submit(w, 'reload', (worker_models[w.id],), dict(n_decodes=n_decodes))
+                for w in self.workers
+                if w.process
+            ]
+        for future in futures:
+            future.result()
+        with self.lock:
+            changes = diff_models(self.known_models, mt_models)
+            self.known_models = mt_models
+            self.placement = placement
+            self.tokenizers = Tokenizers(mt_models)
+            for worker in self.workers:
+                worker.mt_models = worker_models[worker.id]  # of restarts
+        return changes
+
+    def resident_models(self) -> List[Dict]:
+        """Translators currently loaded in memory of each worker"""
+        return [
+            dict(res, name=f"{res['name']}@worker{wid}")
+            for wid, residents in self.broadcast('resident_models').items()
+            for res in residents
+        ]
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Translation cache statistics of each model in each worker; keys are `<model>@worker<id>`"""
+        return {
+            f'{model_name}@worker{wid}': stats
+            for wid, worker_stats in self.broadcast('cache_stats').items()
+            for model_name, stats in worker_stats.items()
+        }
+
+    def disk_cache_stats(self) -> Dict[str, Dict]:
+        """Persistent cache statistics of each worker; keys are `disk@worker<id>`"""
+        return {
+            f'{name}@worker{wid}': stats
+            for wid, worker_stats in self.broadcast('disk_cache_stats').items()
+            for name, stats in worker_stats.items()
+        }
+
+    def queue_stats(self) -> Dict[str, Dict]:
+        """Load of each model in each worker; keys are `<model>@worker<id>`"""
+        return {
+            f'{model_name}@worker{wid}': stats
+            for wid, worker_stats in self.broadcast('queue_stats').items()
+            for model_name, stats in worker_stats.items()
+        }
+
+    def flush_cache(self, model_name: Optional[str] = None):
+        self.broadcast('flush_cache', model_name)
+
+    def profile(self, worker_id: int, seconds: float, interval_ms: float = DEF_PROFILE_INTERVAL_MS) -> Dict:
+        """Sampled stacks of the threads of a worker process; see profiling.sample()"""
+        with self.lock:
+            live = [w for w in self.workers if w.id == worker_id and w.process]
+            if not live:
+                raise ValueError(f"No live worker {worker_id}")
+            future = self._submit(live[0], 'profile', (seconds, interval_ms), {})
+        return future.result()
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """Metrics recorded by each worker process, labelled with worker id"""
+        return merge(
+            *(
+                with_labels(families, worker=wid)
+                for wid, families in self.broadcast('collect_metrics', process_wide=True).items()
+            ),
+            cache_families(SEGMENTER.stats(), cache='segments'),  # of live sessions and documents
+        )
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for worker in self.workers:
+            try:
+                worker.requests.put(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+import pytest
+import yaml
+
+from pymarian_webapp import batch
+
+
+class Translator:
+    """Stands in for TranslatorService: translation is the reversed source; fails on call `fail_at`"""
+
+    fail_at = None
+    calls = 0
+
+    def __init__(self, models: Dict, **kwargs) -> None:
+        self.known_models = list(models)
+
+    def translate(self, model_name: str, sources: List[str], **kwargs) -> List[Dict]:
+        cls = type(self)
+        cls.calls += 1
+        if cls.calls == cls.fail_at:
+            raise RuntimeError("killed")
+        return [{'outputs': [src[::-1] for src in sources]}]
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, 'TranslatorService', Translator)
+    monkeypatch.setattr(Translator, 'calls', 0)
+    monkeypatch.setattr(Translator, 'fail_at', None)
+    inp = tmp_path / 'input.txt'
+    lines = [f'line {idx} ünïcode' if idx % 7 else '' for idx in range(50)]
+    inp.write_text(''.join(line + '\n' for line in lines), encoding='utf-8')
+
+    def run(output: str, model_config: Dict = None):
+        config = tmp_path / 'config.yml'
+        config.write_text(yaml.safe_dump({'translators': {'en-de': model_config or {'model': 'a.npz'}}}))
+        argv = ['-c', str(config), '-m', 'en-de', '-i', str(inp), '-o', str(tmp_path / output)]
+        batch.main(argv + ['-w', '0', '-cs', '4', '-if', '1', '-cd', ''])
+        return (tmp_path / output).read_bytes()
+
+    return run
+
+
+def test_resumed_output_is_identical(job, tmp_path):
+    expected = job('full.txt')
+    Translator.calls, Translator.fail_at = 0, 5
+    with pytest.raises(RuntimeError, match='killed'):
+        job('resumed.txt')
+    checkpoint = batch.Checkpoint.load(tmp_path / 'resumed.txt.ckpt')
+    assert checkpoint.lines == 16 and not checkpoint.done
+    Translator.calls, Translator.fail_at = 0, None
+    assert job('resumed.txt') == expected
+    assert Translator.calls == 9  # only the 34 lines left are translated
+    assert batch.Checkpoint.load(tmp_path / 'resumed.txt.ckpt').done
+
+
+def test_resume_with_other_model_is_refused(job, tmp_path):
+    Translator.fail_at = 3
+    with pytest.raises(RuntimeError):
+        job('out.txt')
+    Translator.fail_at = None
+    with pytest.raises(AssertionError, match='model_config changed'):
+        job('out.txt', model_config={'model': 'b.npz'})
+    job('out.txt')  # same config resumes
+    assert batch.Checkpoint.load(tmp_path / 'out.txt.ckpt').done
@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+
+from pymarian_webapp.batcher import MicroBatcher, count_tokens, decode_bucketed, length_buckets
+
+
+class Recorder:
+    """Batch function that appends '!' to items, and records its calls"""
+
+    def __init__(self, delay: float = 0, fail_on: str = None) -> None:
+        self.delay = delay
+        self.fail_on = fail_on
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, items: List[str], **options) -> List[str]:
+        with self.lock:
+            self.calls.append((list(items), options))
+        time.sleep(self.delay)
+        if self.fail_on in items:
+            raise ValueError(f"cannot decode {self.fail_on}")
+        return [f'{item}!' for item in items]
+
+
+def test_concurrent_callers_get_their_outputs_in_order():
+    fn = Recorder(delay=0.01)
+    batcher = MicroBatcher(fn, max_batch_size=16, max_wait_ms=50)
+    requests = [[f'r{i} s{j}' for j in range(i % 5 + 1)] for i in range(20)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(batcher.process, requests))
+    assert results == [[f'{item}!' for item in items] for items in requests]
+    assert len(fn.calls) < len(requests)  # requests were batched together
+    batcher.close()
+
+
+def test_batch_bounds():
+    fn = Recorder()
+    batcher = MicroBatcher(fn, max_batch_size=4, max_batch_tokens=10, max_wait_ms=20)
+    items = [' '.join(['w'] * (i % 4 + 1)) for i in range(30)]
+    futures = [batcher.submit(items[i : i + 3]) for i in range(0, len(items), 3)]
+    assert [out for future in futures for out in future.result()] == [f'{item}!' for item in items]
+    for batch, _ in fn.calls:
+        assert len(batch) <= 4
+        assert len(batch) == 1 or sum(count_tokens(item) for item in batch) <= 10
+    batcher.close()
+
+
+def test_max_wait():
+    batcher = MicroBatcher(Recorder(), max_batch_size=100, max_wait_ms=100)
+    start = time.monotonic()
+    assert batcher.process(['alone']) == ['alone!']
+    assert 0.09 <= time.monotonic() - start < 1  # waited for the batch to fill up, then ran
+    batcher.close()
+
+
+def test_different_options_are_not_batched_together():
+    fn = Recorder()
+    batcher = MicroBatcher(fn, max_batch_size=100, max_wait_ms=50)
+    plain = [batcher.submit([f'p{i}']) for i in range(5)]
+    forced = [batcher.submit([f'f{i}'], force_decode=True) for i in range(5)]
+    assert [f.result() for f in plain] == [[f'p{i}!'] for i in range(5)]
+    assert [f.result() for f in forced] == [[f'f{i}!'] for i in range(5)]
+    for batch, options in fn.calls:
+        prefixes = {item[0] for item in batch}
+        assert prefixes == ({'f'} if options else {'p'})
+        assert options in ({}, dict(force_decode=True))
+    batcher.close()
+
+
+def test_failure_reaches_every_job_of_the_batch():
+    fn = Recorder(fail_on='bad')
+    batcher = MicroBatcher(fn, max_batch_size=3, max_wait_ms=50)
+    # the failing job spans two batches; its remaining items are not decoded
+    failing = batcher.submit(['a', 'bad', 'b', 'c', 'd'])
+    other = batcher.submit(['x'])
+    with pytest.raises(ValueError):
+        failing.result()
+    decoded = [item for batch, _ in fn.calls for item in batch]
+    assert 'd' not in decoded
+    assert other.result() == ['x!']
+    # a job in the same batch as a failing item fails too
+    fn.calls.clear()
+    batcher2 = MicroBatcher(fn, max_batch_size=10, max_wait_ms=50)
+    first, second = batcher2.submit(['bad']), batcher2.submit(['fine'])
+    for future in (first, second):
+        with pytest.raises(ValueError):
+            future.result()
+    assert len(fn.calls) == 1
+    batcher.close()
+    batcher2.close()
+
+
+def test_close_waits_for_holders():
+    batcher = MicroBatcher(Recorder(), max_wait_ms=0)
+    batcher.hold()
+    closer = threading.Thread(target=batcher.close, kwargs=dict(wait=True))
+    closer.start()
+    closer.join(0.1)
+    assert closer.is_alive() and not batcher.closed
+    future = batcher.submit(['late'])  # a holder can still submit
+    batcher.release()
+    closer.join(1)
+    assert not closer.is_alive() and batcher.closed
+    assert future.result() == ['late!']
+    with pytest.raises(RuntimeError):
+        batcher.submit(['too late'])
+    with pytest.raises(RuntimeError):
+        batcher.hold()
+    batcher.join(1)
+
+
+def test_decode_bucketed():
+    lengths = [5, 1, 3, 1, 5]
+    assert length_buckets(lengths, max_batch_size=2) == [[1, 3], [2, 0], [4]]
+    items = ['a b c d', 'a', 'a b', 'b', 'e f g h']
+    fn = Recorder()
+    assert decode_bucketed(fn, items, max_batch_size=2) == [f'{item}!' for item in items]
+    assert [batch for batch, _ in fn.calls] == [['a', 'b'], ['a b', 'a b c d'], ['e f g h']]
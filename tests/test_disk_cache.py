@@ -0,0 +1,56 @@
+from pymarian_webapp.cache import TranslationCache
+from pymarian_webapp.disk_cache import DiskCache
+from pymarian_webapp.translator_service import TranslatorService
+
+key = TranslationCache.make_key
+
+
+def test_values_round_trip(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.db')
+    # outputs of MTAPI models are lists of translations; text is stored as JSON too
+    items = [(key('a'), ['x', 'y']), (key('b'), 'zz'), (key('c', 'pre', {'tsv': True}), 'ü\t"q"')]
+    cache.put_many('m1', items)
+    reopened = DiskCache(tmp_path / 'cache.db')
+    assert reopened.get_many('m1', [k for k, _ in items] + [key('d')]) == [v for _, v in items] + [None]
+    assert reopened.get_many('m2', [key('a')]) == [None]  # entries are kept apart by model identity
+    stats = reopened.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (3, 3, 2)
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.db', max_bytes=2000)
+    for idx in range(40):
+        cache.put_many('m', [(key(f'source {idx}'), f'translation {idx}')])
+    stats = cache.stats()
+    assert 0 < stats['bytes'] <= 2000 and stats['evictions'] > 0
+    assert stats['entries'] == 40 - stats['evictions']
+    found = cache.get_many('m', [key(f'source {idx}') for idx in range(40)])
+    kept = [idx for idx, value in enumerate(found) if value is not None]
+    assert kept == list(range(40 - len(kept), 40))  # the newest entries
+    assert found[-1] == 'translation 39'
+
+
+def test_preload(tmp_path):
+    tsv = tmp_path / 'known.tsv'
+    tsv.write_text('Hello\tHallo\nno tab\n\tempty\n  World \tWelt\n', encoding='utf-8')
+    cache = DiskCache(tmp_path / 'cache.db')
+    assert cache.preload('m', tsv, key) == 2
+    assert cache.preload('m', tsv, key) == 0  # loaded once per model and file
+    assert cache.get_many('m', [key('Hello'), key('World')]) == ['Hallo', 'Welt']
+    tsv.write_text('Hello\tServus\n', encoding='utf-8')
+    assert cache.preload('m', tsv, key) == 1  # unless the file changes
+    assert cache.get_many('m', [key('Hello')]) == ['Servus']
+
+
+def test_preload_is_served_without_decoding(tmp_path):
+    tsv = tmp_path / 'known.tsv'
+    tsv.write_text('Hello\tHallo\n', encoding='utf-8')
+    models = {'en-de': {'type': 'base', 'cache_preload': str(tsv)}}  # no model files: never loaded here
+    service = TranslatorService(models, eager_load=False, disk_cache=DiskCache(tmp_path / 'cache.db'))
+    assert service.translate('en-de', ['Hello']) == [{'outputs': ['Hallo']}]
+    assert not service.cache and not service.batchers
+    # found on disk, the translation is kept in the memory cache
+    assert service.translation_cache.get('en-de', key('Hello')) == 'Hallo'
+    assert service.disk_cache.stats()['hits'] == 1
+    assert service.translate('en-de', ['Hello']) == [{'outputs': ['Hallo']}]
+    assert service.disk_cache.stats()['hits'] == 1
@@ -0,0 +1,25 @@
+from typing import List
+
+from pymarian_webapp.evaluator_service import EvaluatorService
+
+
+class Evaluator:
+    """Score is the length of the `source<tab>mt` row"""
+
+    def __init__(self) -> None:
+        self.rows = []
+
+    def evaluate(self, rows: List[str]) -> List[float]:
+        self.rows.extend(rows)
+        return [float(len(row)) for row in rows]
+
+
+def test_list_translations_are_scored_and_cached():
+    service = EvaluatorService(names=['qe'], eager_load=False)
+    evaluator = Evaluator()
+    service.get_model = lambda model_name: evaluator
+    # outputs of MTAPI models are lists of translations of each source
+    assert service.evaluate('qe', ['a', 'b'], [['x y'], 'zz']) == [5.0, 4.0]
+    assert evaluator.rows == ['a\tx y', 'b\tzz']
+    assert service.evaluate('qe', ['a'], [['x', 'y']]) == [5.0]
+    assert len(evaluator.rows) == 2  # cached
@@ -0,0 +1,135 @@
+import json
+import random
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from pymarian_webapp.live_session import LiveSession
+from pymarian_webapp.segmentation import Segmenter
+from pymarian_webapp.tokenization import Tokenizer
+
+TEMPLATE = Path(__file__).parent.parent / 'pymarian_webapp' / 'templates' / 'livemt.html'
+
+
+class Service:
+    """Translation is the upper-cased source; prefixes are ignored"""
+
+    def __init__(self) -> None:
+        self.segmenter = Segmenter()
+        self.decoded = []
+
+    def sentence_split(self, text: str, model_name: Optional[str] = None, cache=True) -> List[str]:
+        return self.segmenter.split(text, 'en', cache=cache)
+
+    def tokenizer(self, model_name: Optional[str] = None) -> Tokenizer:
+        return Tokenizer()
+
+    def force_decode_batch(self, model_name: str, sources: List[str], prefixes=None) -> List[str]:
+        self.decoded.extend(sources)
+        return [source.upper() for source in sources]
+
+
+def compute_edit(old_text: str, new_text: str) -> dict:
+    """Edit computed by compute_edit() of the live translation page"""
+    page = TEMPLATE.read_text(encoding='utf-8')
+    script = re.search(r'  function compute_edit\(.*?\n  }\n', page, re.S).group(0)
+    script += f'console.log(JSON.stringify(compute_edit({json.dumps(old_text)}, {json.dumps(new_text)})));'
+    out = subprocess.run(['node', '-e', script], capture_output=True, check=True, encoding='utf-8').stdout
+    return json.loads(out)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='needs node')
+@pytest.mark.parametrize(
+    'old_text, new_text',
+    [
+        ('😀 hello world', '😀 hello there'),
+        ('a 😀 b', 'a 😁 b'),  # surrogate pairs share their high half
+        ('𝔘𝔫𝔦 code', '𝔘𝔫𝔦𝔠𝔬 code'),
+    ],
+)
+def test_page_edits_apply_to_astral_text(old_text, new_text):
+    session = LiveSession(Service(), 'm')
+    res = session.reset(old_text)
+    session.apply_edits([compute_edit(old_text, new_text)], version=res['version'])
+    assert session.text == new_text
+
+
+def apply(client: dict, res: dict):
+    """Splice a response into the segments of a client, as the live translation page does"""
+    client['version'] = res['version']
+    end = res['start'] + res['delete']
+    client['sources'][res['start'] : end] = [source for source, _ in res['segments']]
+    client['targets'][res['start'] : end] = [target for _, target in res['segments']]
+
+
+def new_session(text: str):
+    service = Service()
+    session = LiveSession(service, 'm')
+    client = dict(sources=[], targets=[])
+    apply(client, session.reset(text))
+    return service, session, client
+
+
+def edit(session: LiveSession, client: dict, offset: int, delete: int = 0, insert: str = ''):
+    res = session.apply_edits([dict(offset=offset, delete=delete, insert=insert)], version=client['version'])
+    apply(client, res)
+    return res
+
+
+def test_insert_sentence():
+    service, session, client = new_session('One here. Two here.')
+    service.decoded.clear()
+    res = edit(session, client, len('One here.'), insert=' New one.')
+    assert client['sources'] == ['One here.', 'New one.', 'Two here.']
+    assert client['targets'] == ['ONE HERE.', 'NEW ONE.', 'TWO HERE.']
+    assert service.decoded == ['New one.']  # neighbors are re-segmented, but their translations are reused
+    assert res['version'] == 2
+
+
+def test_delete_sentence():
+    _, session, client = new_session('One here. Two here. Three here.')
+    edit(session, client, len('One here.'), delete=len(' Two here.'))
+    assert client['sources'] == ['One here.', 'Three here.']
+    assert client['targets'] == ['ONE HERE.', 'THREE HERE.']
+    assert session.text == 'One here. Three here.'
+
+
+def test_paragraph_breaks():
+    service, session, client = new_session('One here.\n\nTwo here.')
+    assert client['sources'] == ['One here.', '', 'Two here.']
+    assert client['targets'] == ['ONE HERE.', '', 'TWO HERE.']
+    edit(session, client, len('One here.\n'), insert='\n')
+    assert client['sources'] == ['One here.', '', '', 'Two here.']
+    assert client['sources'] == service.segmenter.split(session.text)
+    edit(session, client, len('One here.'), delete=2)
+    assert client['sources'] == ['One here.', 'Two here.']
+    assert client['targets'] == ['ONE HERE.', 'TWO HERE.']
+    assert '' not in service.decoded
+
+
+def test_random_edits_match_segmentation():
+    service, session, client = new_session('')
+    rnd = random.Random(1)
+    pieces = ['Hello', ' world.', ' How are you?', '\n', '\n\n', ' ', 'Yes.', '\n \n', '😀']
+    for _ in range(200):
+        text = session.text
+        offset = rnd.randint(0, len(text))
+        delete = rnd.randint(0, min(5, len(text) - offset))
+        insert = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 3)))
+        edit(session, client, offset, delete, insert)
+        expected = service.segmenter.split(session.text)
+        assert client['sources'] == expected
+        assert client['targets'] == [sent.upper() for sent in expected]
+
+
+def test_version_mismatch():
+    _, session, client = new_session('One here.')
+    with pytest.raises(ValueError):
+        session.apply_edits([dict(offset=0, insert='x')], version=client['version'] - 1)
+    with pytest.raises(ValueError):
+        session.apply_edits([dict(offset=100, insert='x')], version=client['version'])
+    assert session.text == 'One here.' and session.version == client['version']
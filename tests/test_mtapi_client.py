@@ -0,0 +1,82 @@
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pymarian_webapp import mtapi_client
+from pymarian_webapp.mtapi_client import MTAPIClient, MTAPIError, make_chunks
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+
+from mtapi_stub import serve  # noqa: E402
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Delays between retries; not slept"""
+    delays = []
+    clock = SimpleNamespace(perf_counter=time.perf_counter, sleep=delays.append)
+    monkeypatch.setattr(mtapi_client, 'time', clock)
+    return delays
+
+
+def test_make_chunks():
+    assert make_chunks(['a'] * 5, max_elements=2) == [(0, 2), (2, 4), (4, 5)]
+    assert make_chunks(['aaa', 'bb', 'c', 'dddddd', 'e'], max_chars=5) == [(0, 2), (2, 3), (3, 4), (4, 5)]
+    assert make_chunks([]) == []
+
+
+@pytest.mark.parametrize(
+    'texts, requests',
+    [
+        ([f'text {idx}' for idx in range(2500)], 3),  # element limit of the service
+        (['x' * 20_000] * 5, 3),  # char limit
+    ],
+)
+def test_requests_are_within_limits(texts, requests):
+    with serve() as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy')
+        # the stub rejects requests over the limits of the service
+        assert client.translate(texts) == [[text.upper()] for text in texts]
+        assert endpoint.state.stats()['requests'] == requests
+
+
+def test_order_with_parallel_requests():
+    # earlier chunks are longer, so they are answered last
+    texts = ['x' * (10 * (20 - idx)) + str(idx) for idx in range(20)]
+    with serve(per_char_latency=0.0005) as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy', max_parallel=4, max_elements=2)
+        assert client.translate(texts) == [[text.upper()] for text in texts]
+        stats = endpoint.state.stats()
+    assert stats['requests'] == 10
+    assert 1 < stats['max_concurrent'] <= 4
+
+
+def test_retries_after_throttling_and_errors(delays):
+    texts = [f'text {idx}' for idx in range(10)]
+    with serve(throttle_rate=0.3, fail_rate=0.3, seed=1) as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy', max_parallel=1, max_elements=1)
+        assert client.translate(texts) == [[text.upper()] for text in texts]
+        failures = endpoint.state.stats()['failures']
+    assert failures > 0 and len(delays) == failures
+
+
+def test_retry_after_is_honored(delays):
+    with serve(throttle_rate=1.0) as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy', max_retries=2)
+        with pytest.raises(MTAPIError, match='HTTP 429'):
+            client.translate(['text'])
+        assert endpoint.state.stats()['requests'] == 3
+    assert delays == [0.0, 0.0]  # Retry-After of the stub
+
+
+def test_backoff_on_server_errors(delays):
+    with serve(fail_rate=1.0) as endpoint:
+        client = MTAPIClient(endpoint=endpoint, subscription_key='dummy', max_retries=3)
+        with pytest.raises(MTAPIError, match='HTTP 503'):
+            client.translate(['text'])
+    assert len(delays) == 3
+    for attempt, delay in enumerate(delays):
+        assert 0.5 * mtapi_client.DEF_BACKOFF * 2**attempt <= delay <= mtapi_client.DEF_BACKOFF * 2**attempt
@@ -0,0 +1,11 @@
+from pymarian_webapp.segmentation import Segmenter
+
+
+def test_unsupported_language_falls_back_to_default():
+    segmenter = Segmenter()
+    assert segmenter.split('Hello there. How are you?', 'xx') == ['Hello there.', 'How are you?']
+    assert segmenter.get_splitter('xx') is segmenter.get_splitter('en')
+
+
+def test_blank_lines_are_kept():
+    assert Segmenter().split('One. Two.\n\nThree.', 'en') == ['One.', 'Two.', '', 'Three.']
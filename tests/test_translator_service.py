@@ -0,0 +1,99 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from pymarian_webapp.residency import ResidencyManager
+from pymarian_webapp.translator_service import RELOAD_RESIDENT, SentenceBreakerWrapper, TranslatorService
+
+JOIN = ' [eos] '
+
+
+class Segmenter:
+    """Sentences are separated by '|'"""
+
+    def split(self, text: str, language: str = 'en', cache=True) -> List[str]:
+        return text.split('|')
+
+
+class Translator:
+    """Upper-cases the sentences of windows; with merge, the first two sentences of a window become one"""
+
+    def __init__(self, merge: bool = False) -> None:
+        self.merge = merge
+        self.calls = []
+
+    def translate(self, sources: List[str]) -> List[str]:
+        self.calls.append(list(sources))
+        outputs = []
+        for source in sources:
+            sents = [sent.strip().upper() for sent in source.split(JOIN.strip())]
+            if self.merge and len(sents) > 1:
+                sents = [f'{sents[0]} {sents[1]}'] + sents[2:]
+            outputs.append(JOIN.join(sents))
+        return outputs
+
+
+def doc_wrapper(translator, **kwargs) -> SentenceBreakerWrapper:
+    return SentenceBreakerWrapper(
+        translator, segmenter=Segmenter(), doc_enabled=True, sentence_join_token=JOIN, **kwargs
+    )
+
+
+def test_doc_windows():
+    translator = Translator()
+    # windows (context_start, start, end): (0, 0, 3) and (2, 3, 5); context of the second is dropped
+    wrapper = doc_wrapper(translator, doc_window_tokens=6, doc_window_overlap=1)
+    assert wrapper.translate(['a|b|c|d|e']) == ['A B C D E']
+    assert len(translator.calls) == 1
+
+
+def test_doc_sentence_count_mismatch():
+    translator = Translator(merge=True)
+    wrapper = doc_wrapper(translator, doc_window_tokens=6, doc_window_overlap=1)
+    # the first window has no context, so its output is kept; the second is translated again without context,
+    # and its output is kept though the model merges sentences again. Join tokens are removed from both
+    assert wrapper.translate(['a|b|c|d|e']) == ['A B C D E']
+    assert translator.calls[1] == ['d [eos] e']
+
+
+class Marian:
+    """Stands in for pymarian.Translator; records what is resident while new versions load"""
+
+    residency = None
+    loads = []
+
+    def __init__(self, models: str, **kwargs) -> None:
+        resident = [res['name'] for res in self.residency.resident()]
+        self.loads.append((Path(models).name, self.residency.used, resident))
+
+    def translate(self, sources: List[str]) -> List[str]:
+        return [source.upper() for source in sources]
+
+
+def test_reload_is_admitted_to_memory_budget(tmp_path, monkeypatch, caplog):
+    import pymarian
+
+    for name in ('v1.npz', 'v2.npz', 'vocab.spm'):
+        (tmp_path / name).touch()
+
+    def config(version: str, memory_mb: int = 1000):
+        return dict(type='base', model=str(tmp_path / f'{version}.npz'), memory_mb=memory_mb)
+
+    residency = ResidencyManager(budget=3000, idle_timeout=0)
+    monkeypatch.setattr(pymarian, 'Translator', Marian)
+    monkeypatch.setattr(Marian, 'residency', residency)
+    monkeypatch.setattr(Marian, 'loads', [])
+    service = TranslatorService(dict(a=config('v1'), b=config('v1')), eager_load=True, residency=residency)
+    assert residency.used == 2000
+
+    # a is the least recently used, so it makes room for the new versions; b is replaced once they are loaded
+    service.reload(dict(a=config('v1'), b=config('v2'), c=config('v2')), n_decodes=0)
+    assert Marian.loads[2:] == [('v2.npz', 3000, ['translator:b', RELOAD_RESIDENT])] * 2
+    assert sorted(res['name'] for res in service.resident_models()) == ['translator:b', 'translator:c']
+    assert residency.used == 2000 and 'a' not in service.cache
+
+    with caplog.at_level(logging.WARNING):
+        service.reload(dict(b=config('v1'), c=config('v2')), n_decodes=0)
+        assert 'goes over the memory budget' not in caplog.text
+        service.reload(dict(b=config('v1'), c=config('v2'), d=config('v2', memory_mb=4000)), n_decodes=0)
+        assert 'goes over the memory budget' in caplog.text